@@ -5,7 +5,8 @@ from django.contrib import admin
 from .models import (
     Conversation, Message, BotContext,
     Negocio, HorarioAtencion, ProductoNegocio, 
-    CategoriaNegocio, ResenaNegocio
+    CategoriaNegocio, ResenaNegocio, ResumenCalificacion, PerfilNegocio,
+    Campana, EnvioCampana, ArchivoMedia, MediaSubida
 )
 
 
@@ -168,12 +169,98 @@ class ResenaNegocioAdmin(admin.ModelAdmin):
     
     def aprobar_resenas(self, request, queryset):
         """Aprobar reseñas seleccionadas"""
-        count = queryset.update(aprobado=True)
+        count = queryset.cambiar_aprobacion(True)
         self.message_user(request, f'{count} reseña(s) aprobada(s).')
     aprobar_resenas.short_description = "Aprobar reseñas seleccionadas"
     
     def rechazar_resenas(self, request, queryset):
         """Rechazar reseñas seleccionadas"""
-        count = queryset.update(aprobado=False)
+        count = queryset.cambiar_aprobacion(False)
         self.message_user(request, f'{count} reseña(s) rechazada(s).')
-    rechazar_resenas.short_description = "Rechazar reseñas seleccionadas"
\ No newline at end of file
+    rechazar_resenas.short_description = "Rechazar reseñas seleccionadas"
+
+
+@admin.register(ResumenCalificacion)
+class ResumenCalificacionAdmin(admin.ModelAdmin):
+    list_display = ['negocio', 'total', 'promedio_display', 'fecha_actualizacion']
+    search_fields = ['negocio__nombre']
+    list_select_related = ['negocio']
+    readonly_fields = [
+        'negocio', 'total', 'suma', 'estrellas_1', 'estrellas_2',
+        'estrellas_3', 'estrellas_4', 'estrellas_5', 'fecha_actualizacion'
+    ]
+    
+    def promedio_display(self, obj):
+        """Mostrar promedio con un decimal"""
+        return f"{obj.promedio:.1f}" if obj.promedio is not None else "-"
+    promedio_display.short_description = 'Promedio'
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(PerfilNegocio)
+class PerfilNegocioAdmin(admin.ModelAdmin):
+    list_display = ['negocio', 'texto_preview', 'modelo', 'fecha_generacion']
+    search_fields = ['negocio__nombre', 'texto']
+    list_select_related = ['negocio']
+    readonly_fields = ['negocio', 'hash_contenido', 'modelo', 'fecha_generacion']
+    
+    def texto_preview(self, obj):
+        """Mostrar vista previa del perfil"""
+        return obj.texto[:80] + '...' if len(obj.texto) > 80 else obj.texto
+    texto_preview.short_description = 'Perfil'
+    
+    def has_add_permission(self, request):
+        return False
+
+
+# ==================== CAMPAÑAS ====================
+
+@admin.register(Campana)
+class CampanaAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'plantilla', 'estado', 'evento', 'negocio', 'fecha_creacion']
+    list_filter = ['estado', 'fecha_creacion']
+    search_fields = ['nombre', 'plantilla']
+    readonly_fields = ['estado', 'fecha_creacion', 'fecha_actualizacion']
+
+
+@admin.register(EnvioCampana)
+class EnvioCampanaAdmin(admin.ModelAdmin):
+    list_display = ['campana', 'conversation', 'estado', 'codigo_error', 'intentos', 'fecha_actualizacion']
+    list_filter = ['campana', 'estado']
+    search_fields = ['conversation__phone_number', 'message_id']
+    list_select_related = ['campana', 'conversation']
+    readonly_fields = [
+        'campana', 'conversation', 'estado', 'message_id', 'codigo_error',
+        'error', 'intentos', 'fecha_actualizacion'
+    ]
+    
+    def has_add_permission(self, request):
+        return False
+
+
+# ==================== MEDIOS ====================
+
+@admin.register(ArchivoMedia)
+class ArchivoMediaAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'mime_type', 'tamano', 'referencias', 'ultimo_acceso']
+    list_filter = ['mime_type']
+    search_fields = ['sha256']
+    readonly_fields = ['sha256', 'ruta', 'mime_type', 'tamano', 'referencias', 'fecha_creacion', 'ultimo_acceso']
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(MediaSubida)
+class MediaSubidaAdmin(admin.ModelAdmin):
+    list_display = ['url_origen', 'media_id', 'fecha_subida', 'expira', 'fecha_verificacion']
+    search_fields = ['url_origen', 'media_id', 'sha256']
+    readonly_fields = [
+        'url_origen', 'sha256', 'media_id', 'mime_type', 'etag', 'last_modified',
+        'fecha_subida', 'expira', 'fecha_verificacion'
+    ]
+    
+    def has_add_permission(self, request):
+        return False
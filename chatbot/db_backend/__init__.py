@@ -0,0 +1,6 @@
+"""
+Backend MySQL con conexiones persistentes medidas
+
+Se usa como ENGINE ('chatbot.db_backend') en lugar de
+'django.db.backends.mysql'. Ver base.py.
+"""
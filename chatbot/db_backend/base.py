@@ -0,0 +1,135 @@
+"""
+Backend MySQL (PyMySQL) con conexiones persistentes, verificación previa y
+métricas de tiempo de conexión frente a tiempo de consultas
+
+La persistencia la da CONN_MAX_AGE y la verificación CONN_HEALTH_CHECKS: al
+inicio de cada petición se hace un ping a la conexión reutilizada y, si el
+servidor la cerró, Django la descarta y abre otra en la siguiente consulta.
+Este backend hace que ese ping no reconecte por su cuenta (así toda
+reconexión pasa por connect() y queda medida) y lleva las métricas del
+proceso en `metricas`.
+"""
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+from django.db.backends.mysql.base import Database
+
+logger = logging.getLogger('chatbot')
+
+
+class MetricasConexion:
+    """Acumuladores por proceso (cada worker lleva los suyos)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.conexiones = 0
+            self.conexiones_ms = 0.0
+            self.conexion_max_ms = 0.0
+            self.pings = 0
+            self.pings_fallidos = 0
+            self.pings_ms = 0.0
+            self.consultas = 0
+            self.consultas_ms = 0.0
+
+    def registrar_conexion(self, ms):
+        with self._lock:
+            self.conexiones += 1
+            self.conexiones_ms += ms
+            self.conexion_max_ms = max(self.conexion_max_ms, ms)
+
+    def registrar_ping(self, ms, ok):
+        with self._lock:
+            self.pings += 1
+            self.pings_ms += ms
+            if not ok:
+                self.pings_fallidos += 1
+
+    def registrar_consulta(self, ms):
+        with self._lock:
+            self.consultas += 1
+            self.consultas_ms += ms
+
+    def resumen(self):
+        """Dict serializable con totales y promedios en milisegundos"""
+        with self._lock:
+            total_ms = self.conexiones_ms + self.pings_ms + self.consultas_ms
+            return {
+                'conexiones': self.conexiones,
+                'conexion_promedio_ms': round(self.conexiones_ms / self.conexiones, 2) if self.conexiones else None,
+                'conexion_max_ms': round(self.conexion_max_ms, 2),
+                'pings': self.pings,
+                'pings_fallidos': self.pings_fallidos,
+                'ping_promedio_ms': round(self.pings_ms / self.pings, 2) if self.pings else None,
+                'consultas': self.consultas,
+                'consulta_promedio_ms': round(self.consultas_ms / self.consultas, 2) if self.consultas else None,
+                # Fracción del tiempo de BD que se va en abrir y verificar conexiones
+                'fraccion_conexion': round((self.conexiones_ms + self.pings_ms) / total_ms, 4) if total_ms else None,
+            }
+
+
+metricas = MetricasConexion()
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._conectando = False
+        self.execute_wrappers.append(self._medir_consulta)
+
+    def connect(self):
+        # Incluye TCP, autenticación, init_command y la configuración inicial
+        inicio = time.perf_counter()
+        self._conectando = True
+        try:
+            super().connect()
+        finally:
+            self._conectando = False
+        ms = (time.perf_counter() - inicio) * 1000
+        metricas.registrar_conexion(ms)
+        logger.info(f"Conexión a la BD '{self.alias}' abierta en {ms:.1f} ms")
+
+    def is_usable(self):
+        inicio = time.perf_counter()
+        try:
+            # Sin reconectar: si falla, Django cierra y connect() reconecta
+            self.connection.ping(reconnect=False)
+            usable = True
+        except Database.Error:
+            usable = False
+        metricas.registrar_ping((time.perf_counter() - inicio) * 1000, usable)
+        if not usable:
+            logger.warning(f"Conexión a la BD '{self.alias}' caída; se reconectará")
+        return usable
+
+    def _medir_consulta(self, execute, sql, params, many, context):
+        if self._conectando:
+            return execute(sql, params, many, context)
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metricas.registrar_consulta((time.perf_counter() - inicio) * 1000)
+
+
+def calentar_conexiones():
+    """
+    Abrir las conexiones de este proceso antes de la primera petición
+
+    Se llama al cargar la aplicación WSGI y al crear cada hilo del pool de
+    etapas (services/message_pipeline.py, ASGI); un fallo solo se registra,
+    la conexión se reintentará con la primera consulta.
+    """
+    for alias in connections:
+        conexion = connections[alias]
+        try:
+            conexion.ensure_connection()
+        except Exception as e:
+            logger.error(f"Error calentando la conexión '{alias}': {e}")
@@ -0,0 +1,87 @@
+"""
+Router de BD: lecturas del catálogo a una réplica local, todo lo demás al primario
+
+El catálogo (negocios, horarios, productos, categorías, reseñas, eventos) se
+lee desde el alias settings.CATALOG_REPLICA_ALIAS, una copia local que
+refresca el comando sincronizar_replica. Las escrituras y la conversación
+(Conversation, Message, BotContext) siempre van a 'default'.
+
+Para leer lo que uno mismo escribió, después de escribir en el catálogo las
+lecturas de este proceso vuelven al primario durante
+CATALOG_REPLICA_STALE_SECONDS (la réplica no lo tendrá hasta la siguiente
+sincronización). `usar_primaria()` fuerza el primario en un bloque.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+MODELOS_CATALOGO = {
+    'negocio', 'horarioatencion', 'productonegocio', 'categorianegocio',
+    'resenanegocio', 'resumencalificacion', 'eventodeportivo', 'perfilnegocio',
+}
+
+_estado = threading.local()
+_ultima_escritura = 0.0
+
+
+def es_catalogo(model):
+    return model._meta.app_label == 'chatbot' and model._meta.model_name in MODELOS_CATALOGO
+
+
+def marcar_escritura():
+    """Registrar una escritura al catálogo en este proceso"""
+    global _ultima_escritura
+    _ultima_escritura = time.monotonic()
+
+
+@contextmanager
+def usar_primaria():
+    """Leer el catálogo desde el primario dentro del bloque"""
+    _estado.primaria = getattr(_estado, 'primaria', 0) + 1
+    try:
+        yield
+    finally:
+        _estado.primaria -= 1
+
+
+def leyendo_primaria():
+    """True si las lecturas del catálogo deben ir al primario ahora mismo"""
+    if getattr(_estado, 'primaria', 0):
+        return True
+    return time.monotonic() - _ultima_escritura < settings.CATALOG_REPLICA_STALE_SECONDS
+
+
+class CatalogReadRouter:
+    """Envía las lecturas del catálogo a la réplica cuando está configurada"""
+
+    def db_for_read(self, model, **hints):
+        replica = settings.CATALOG_REPLICA_ALIAS
+        if not replica or not es_catalogo(model):
+            return None
+
+        # Relaciones de un objeto ya cargado: misma BD que el objeto
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db:
+            return instancia._state.db
+
+        return 'default' if leyendo_primaria() else replica
+
+    def db_for_write(self, model, **hints):
+        if es_catalogo(model):
+            marcar_escritura()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica es una copia del primario: las filas son intercambiables
+        aliases = {'default', settings.CATALOG_REPLICA_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # El esquema de la réplica lo crea sincronizar_replica
+        if db == settings.CATALOG_REPLICA_ALIAS:
+            return False
+        return None
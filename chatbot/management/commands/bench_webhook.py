@@ -0,0 +1,160 @@
+"""
+Comando para medir cuántos mensajes por segundo atiende el webhook
+
+Crea una base de datos de prueba con un catálogo realista (el mismo de las
+pruebas de presupuesto de consultas, services/catalogo_prueba.py), levanta la Graph API simulada y reemplaza Gemini por
+una espera configurable; luego envía payloads de Meta a /chatbot/webhook/
+con una concurrencia o un ritmo fijos y reporta en JSON el rendimiento, los
+percentiles de latencia (webhook, extremo a extremo y por etapa), las
+consultas SQL y las tasas de error, para comparar una corrida con otra.
+
+El generador de carga corre en el mismo proceso y event loop que el webhook:
+el resultado es el de un worker ASGI.
+"""
+import asyncio
+import json
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from chatbot.services import catalogo_prueba
+from chatbot.services.graph_simulator import ConfigSimulador, SimuladorGraph
+from chatbot.services.webhook_bench import (
+    MEZCLA_POR_DEFECTO, PHONE_NUMBER_ID, BancoWebhook, GeneradorPayloads, llm_simulado, parsear_mezcla
+)
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga del webhook con la Graph API y el LLM simulados; reporta latencias en JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensajes', type=int, default=500, help='Peticiones al webhook a medir')
+        parser.add_argument(
+            '--concurrencia', type=int, default=20,
+            help='Peticiones en curso a la vez (carga cerrada)',
+        )
+        parser.add_argument(
+            '--rps', type=float,
+            help='Peticiones por segundo, sin esperar respuestas (carga abierta; ignora --concurrencia)',
+        )
+        parser.add_argument(
+            '--mezcla', default=MEZCLA_POR_DEFECTO,
+            help='Pesos de cada tipo de payload: texto, imagen, ubicacion, lote, estados',
+        )
+        parser.add_argument('--usuarios', type=int, default=200, help='Remitentes distintos')
+        parser.add_argument('--calentamiento', type=int, default=20, help='Peticiones previas sin medir')
+        parser.add_argument('--negocios', type=int, default=300, help='Negocios en la base de prueba')
+        parser.add_argument('--llm-ms', type=float, default=800.0, help='Latencia del LLM simulado')
+        parser.add_argument('--llm-variacion-ms', type=float, default=300.0, help='Variación de esa latencia (±)')
+        parser.add_argument('--llm-caracteres', type=int, default=400, help='Largo de las respuestas simuladas')
+        parser.add_argument('--graph-latencia-ms', type=float, default=80.0, help='Latencia de la Graph API simulada')
+        parser.add_argument('--graph-tasa-error', type=float, default=0.0, help='Fracción de respuestas 500')
+        parser.add_argument('--graph-tasa-429', type=float, default=0.0, help='Fracción de envíos con 429')
+        parser.add_argument(
+            '--espera', type=float, default=30.0,
+            help='Segundos máximos para esperar las respuestas pendientes al terminar',
+        )
+        parser.add_argument('--semilla', type=int, default=42, help='Semilla de los payloads generados')
+        parser.add_argument('--salida', help='Archivo donde guardar el reporte JSON')
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Reutilizar la base de prueba si ya existe y no destruirla al terminar',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            mezcla = parsear_mezcla(options['mezcla'])
+        except ValueError as e:
+            raise CommandError(f'--mezcla inválida: {e}')
+        if options['mensajes'] < 1 or options['concurrencia'] < 1:
+            raise CommandError('--mensajes y --concurrencia deben ser al menos 1')
+
+        self.stdout.write(self.style.SUCCESS('=== Prueba de carga del webhook ===\n'))
+
+        keepdb = options['keepdb']
+        nombre_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+        try:
+            self.stdout.write('1. Generando datos de prueba...')
+            datos = catalogo_prueba.sembrar(options['negocios'])
+            catalogo_prueba.analizar_tablas()
+            self.stdout.write(
+                f"  {datos['negocios']} negocios, {datos['conversaciones']} conversaciones y {datos['eventos']} eventos"
+            )
+
+            modo = f"{options['rps']:g} peticiones/s" if options['rps'] else f"concurrencia {options['concurrencia']}"
+            self.stdout.write(f"\n2. Enviando {options['mensajes']} peticiones ({modo})...")
+            reporte = self.medir(options, mezcla)
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=keepdb)
+            catalogo_prueba.invalidar_indices()
+
+        configuracion = {
+            clave: options[clave] for clave in (
+                'mensajes', 'concurrencia', 'rps', 'mezcla', 'usuarios', 'negocios',
+                'llm_ms', 'llm_variacion_ms', 'llm_caracteres',
+                'graph_latencia_ms', 'graph_tasa_error', 'graph_tasa_429',
+            )
+        }
+        configuracion['base_de_datos'] = connection.vendor
+        reporte = {'configuracion': configuracion, **reporte}
+
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                archivo.write(texto + '\n')
+            self.stdout.write(f"  Reporte guardado en {options['salida']}")
+        self.stdout.write(texto)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\n  {reporte['rendimiento']['mensajes_por_s']} mensajes/s, "
+            f"webhook p95 {reporte['webhook'].get('p95_ms')} ms, "
+            f"extremo a extremo p95 {reporte['extremo_a_extremo'].get('p95_ms')} ms"
+        ))
+
+    def medir(self, options, mezcla):
+        simulador = SimuladorGraph(
+            ConfigSimulador(
+                latencia_ms=options['graph_latencia_ms'],
+                variacion_ms=options['graph_latencia_ms'] / 4,
+                tasa_error=options['graph_tasa_error'],
+                tasa_429=options['graph_tasa_429'],
+            ),
+            puerto=0,
+        )
+        banco = BancoWebhook(
+            GeneradorPayloads(mezcla, usuarios=options['usuarios'], semilla=options['semilla']),
+            simulador,
+            concurrencia=options['concurrencia'],
+            rps=options['rps'],
+            espera=options['espera'],
+        )
+
+        # El log del webhook es muy detallado: con -v 2 se mantiene
+        registro = logging.getLogger('chatbot')
+        nivel = registro.level
+        if options['verbosity'] < 2:
+            registro.setLevel(logging.WARNING)
+
+        url_simulador = simulador.iniciar()
+        try:
+            with tempfile.TemporaryDirectory() as medios, override_settings(
+                META_GRAPH_BASE_URL=url_simulador,
+                META_PHONE_NUMBER_ID=PHONE_NUMBER_ID,
+                META_ACCESS_TOKEN='simulador',
+                META_WEBHOOK_SECRET='simulador',
+                GEMINI_API_KEY='simulador',
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                # Todo sobre la base de prueba, sin réplica
+                CATALOG_REPLICA_ALIAS=None,
+                MEDIA_STORE_DIR=medios,
+            ), llm_simulado(options['llm_ms'], options['llm_variacion_ms'], options['llm_caracteres']):
+                return asyncio.run(banco.correr(options['mensajes'], calentamiento=options['calentamiento']))
+        finally:
+            simulador.detener()
+            registro.setLevel(nivel)
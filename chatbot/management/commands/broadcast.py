@@ -0,0 +1,261 @@
+"""
+Comando para enviar una plantilla a todas las conversaciones activas
+"""
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from chatbot.models import Campana, Conversation, EnvioCampana, EventoDeportivo, Negocio
+from chatbot.services.dispatcher import DespachadorSalida, EnvioSaliente
+from chatbot.services.graph_transport import transporte_graph
+from chatbot.services.whatsapp_service import WhatsAppService
+
+
+class ValoresPlantilla(dict):
+    """Los marcadores desconocidos se dejan tal cual"""
+
+    def __missing__(self, clave):
+        return '{' + clave + '}'
+
+
+def personalizar(componentes, valores):
+    """Reemplazar los marcadores en los textos de los componentes"""
+    if isinstance(componentes, str):
+        return componentes.format_map(valores)
+    if isinstance(componentes, list):
+        return [personalizar(c, valores) for c in componentes]
+    if isinstance(componentes, dict):
+        return {k: personalizar(v, valores) for k, v in componentes.items()}
+    return componentes
+
+
+class Command(BaseCommand):
+    help = 'Envía una plantilla a las conversaciones activas; reanuda la campaña si ya existe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campana', type=str, help='Nombre de la campaña (se crea si no existe)')
+        parser.add_argument('--plantilla', type=str, help='Plantilla aprobada (obligatoria al crear)')
+        parser.add_argument('--idioma', type=str, default='es', help='Código de idioma de la plantilla')
+        parser.add_argument(
+            '--componentes',
+            type=str,
+            help='JSON con los componentes de la plantilla; admite {nombre}, {evento}, {fecha}, {lugar} y {negocio}',
+        )
+        parser.add_argument('--evento', type=int, help='ID del evento que se anuncia')
+        parser.add_argument('--negocio', type=int, help='ID del negocio que se anuncia')
+        parser.add_argument(
+            '--concurrencia',
+            type=int,
+            default=settings.BROADCAST_CONCURRENCY,
+            help='Envíos simultáneos',
+        )
+        parser.add_argument(
+            '--tasa',
+            type=float,
+            default=settings.BROADCAST_RATE_PER_SECOND,
+            help='Mensajes por segundo como máximo',
+        )
+        parser.add_argument('--lote', type=int, default=500, help='Destinatarios por lote')
+        parser.add_argument('--limite', type=int, help='Enviar como mucho a esta cantidad en esta corrida')
+        parser.add_argument(
+            '--reintentar-fallidos',
+            action='store_true',
+            help='Volver a enviar a los destinatarios con envío fallido',
+        )
+        parser.add_argument(
+            '--reintentar-inciertos',
+            action='store_true',
+            help='Volver a enviar los que quedaron pendientes por una corrida interrumpida (pueden duplicarse)',
+        )
+
+    def handle(self, *args, **options):
+        campana = self.obtener_campana(options)
+        if campana.estado == 'completada' and not (options['reintentar_fallidos'] or options['reintentar_inciertos']):
+            self.stdout.write(self.style.WARNING(f'La campaña "{campana.nombre}" ya está completada'))
+            self.reporte(campana, None)
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'=== Campaña "{campana.nombre}" ({campana.plantilla}) ===\n'))
+        despachador = DespachadorSalida(tasa=options['tasa'], rafaga=max(1, int(options['tasa'])), asincrono=False)
+        # Una conexión keep-alive por hilo de envío
+        transporte_graph.asegurar_pool(options['concurrencia'])
+        valores = self.valores_base(campana)
+
+        destinatarios = self.destinatarios(campana, options)
+        if options['limite']:
+            destinatarios = islice(destinatarios, options['limite'])
+
+        inicio = time.perf_counter()
+        corrida = Counter()
+        with ThreadPoolExecutor(max_workers=options['concurrencia']) as executor:
+            while True:
+                lote = list(islice(destinatarios, options['lote']))
+                if not lote:
+                    break
+                self.enviar_lote(campana, lote, valores, despachador, executor, corrida)
+                transcurrido = time.perf_counter() - inicio
+                self.stdout.write(
+                    f'  {sum(corrida.values())} enviados en esta corrida '
+                    f'({sum(corrida.values()) / transcurrido:.1f}/s, {corrida["failed"]} fallidos)'
+                )
+
+        self.actualizar_estado(campana)
+        self.reporte(campana, (corrida, time.perf_counter() - inicio))
+
+    # ==================== CAMPAÑA ====================
+
+    def obtener_campana(self, options):
+        componentes = None
+        if options['componentes']:
+            try:
+                componentes = json.loads(options['componentes'])
+            except ValueError as e:
+                raise CommandError(f'--componentes no es JSON válido: {e}')
+
+        campana = Campana.objects.filter(nombre=options['campana']).first()
+        if campana is not None:
+            if options['plantilla'] and options['plantilla'] != campana.plantilla:
+                raise CommandError(f'La campaña ya existe con la plantilla "{campana.plantilla}"')
+            return campana
+
+        if not options['plantilla']:
+            raise CommandError('--plantilla es obligatoria para crear una campaña')
+        evento = negocio = None
+        if options['evento']:
+            evento = EventoDeportivo.objects.filter(id=options['evento']).first()
+            if evento is None:
+                raise CommandError(f'No existe el evento {options["evento"]}')
+        if options['negocio']:
+            negocio = Negocio.objects.filter(id=options['negocio']).first()
+            if negocio is None:
+                raise CommandError(f'No existe el negocio {options["negocio"]}')
+
+        return Campana.objects.create(
+            nombre=options['campana'],
+            plantilla=options['plantilla'],
+            idioma=options['idioma'],
+            componentes=componentes or [],
+            evento=evento,
+            negocio=negocio,
+        )
+
+    def valores_base(self, campana):
+        valores = ValoresPlantilla()
+        if campana.evento:
+            valores['evento'] = campana.evento.nombre
+            valores['fecha'] = timezone.localtime(campana.evento.fecha_evento).strftime('%d/%m/%Y %I:%M %p')
+            valores['lugar'] = campana.evento.lugar
+        if campana.negocio:
+            valores['negocio'] = campana.negocio.nombre
+        return valores
+
+    def destinatarios(self, campana, options):
+        """
+        Conversaciones activas sin envío registrado (y las fallidas o
+        inciertas si se pide), leídas por partes con iterator()
+        """
+        estados = []
+        if options['reintentar_fallidos']:
+            estados.append('failed')
+        if options['reintentar_inciertos']:
+            estados.append('pending')
+        registrados = EnvioCampana.objects.filter(campana=campana, conversation=OuterRef('pk'))
+        if estados:
+            registrados = registrados.exclude(estado__in=estados)
+        return (
+            Conversation.objects.filter(is_active=True)
+            .filter(~Exists(registrados))
+            .order_by('id')
+            .only('id', 'phone_number', 'name')
+            .iterator(chunk_size=2000)
+        )
+
+    def actualizar_estado(self, campana):
+        """Completada cuando ya no queda ninguna conversación activa sin fila de envío"""
+        sin_envio = Conversation.objects.filter(is_active=True).filter(
+            ~Exists(EnvioCampana.objects.filter(campana=campana, conversation=OuterRef('pk')))
+        ).exists()
+        campana.estado = 'en_curso' if sin_envio else 'completada'
+        campana.save(update_fields=['estado', 'fecha_actualizacion'])
+
+    # ==================== ENVÍO ====================
+
+    def enviar_lote(self, campana, lote, valores, despachador, executor, corrida):
+        """
+        Registrar el lote como pendiente, enviarlo en paralelo y guardar cada
+        resultado apenas llega (las escrituras quedan en el hilo principal);
+        si el proceso se cae, solo quedan inciertos los envíos en vuelo
+        """
+        ids = [c.id for c in lote]
+        EnvioCampana.objects.bulk_create(
+            [EnvioCampana(campana=campana, conversation_id=i) for i in ids],
+            ignore_conflicts=True,
+        )
+        EnvioCampana.objects.filter(campana=campana, conversation_id__in=ids).update(estado='pending')
+        filas = {e.conversation_id: e for e in EnvioCampana.objects.filter(campana=campana, conversation_id__in=ids)}
+
+        futuros = {}
+        for conversation in lote:
+            valores['nombre'] = conversation.name or ''
+            payload = WhatsAppService.payload_plantilla(
+                conversation.phone_number, campana.plantilla, campana.idioma,
+                personalizar(campana.componentes, valores) or None
+            )
+            envio = EnvioSaliente(None, conversation.phone_number, payload)
+            futuros[executor.submit(despachador.enviar_con_reintentos, envio)] = (filas[conversation.id], envio)
+
+        for futuro in as_completed(futuros):
+            fila, envio = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                fila.estado, fila.error, fila.codigo_error = 'failed', f'Error inesperado: {e}', None
+            else:
+                if resultado.ok:
+                    fila.estado, fila.message_id, fila.error, fila.codigo_error = 'sent', resultado.message_id, '', None
+                else:
+                    fila.estado, fila.error, fila.codigo_error = 'failed', resultado.error, resultado.codigo
+            fila.intentos += envio.intentos
+            fila.save(update_fields=['estado', 'message_id', 'error', 'codigo_error', 'intentos', 'fecha_actualizacion'])
+            corrida[fila.estado] += 1
+
+    # ==================== REPORTE ====================
+
+    def reporte(self, campana, corrida):
+        if corrida is not None:
+            contador, segundos = corrida
+            total = sum(contador.values())
+            self.stdout.write(self.style.SUCCESS(
+                f'\n=== Corrida: {total} envíos en {segundos:.1f} s '
+                f'({total / segundos if segundos else 0:.1f} mensajes/s) ==='
+            ))
+
+        por_estado = dict(
+            EnvioCampana.objects.filter(campana=campana)
+            .values_list('estado').annotate(total=Count('id')).order_by()
+        )
+        self.stdout.write(f'\nCampaña "{campana.nombre}": {campana.get_estado_display()}')
+        for estado, etiqueta in EnvioCampana.ESTADO_CHOICES:
+            if por_estado.get(estado):
+                self.stdout.write(f'  {etiqueta}: {por_estado[estado]}')
+
+        fallos = (
+            EnvioCampana.objects.filter(campana=campana, estado='failed')
+            .values('codigo_error').annotate(total=Count('id')).order_by('-total')
+        )
+        if fallos:
+            self.stdout.write(self.style.WARNING('\nFallos por código:'))
+            for fila in fallos:
+                codigo = fila['codigo_error'] if fila['codigo_error'] is not None else 'sin código (red)'
+                ejemplo = (
+                    EnvioCampana.objects.filter(campana=campana, estado='failed', codigo_error=fila['codigo_error'])
+                    .values_list('error', flat=True).first()
+                )
+                self.stdout.write(f'  {codigo}: {fila["total"]} - {ejemplo[:120] if ejemplo else ""}')
@@ -0,0 +1,118 @@
+"""
+Comando para generar los perfiles compactos de negocios con el LLM
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.db_router import usar_primaria
+from chatbot.models import Negocio, ProductoNegocio, PerfilNegocio
+from chatbot.services.business_profiles import GeneradorPerfiles, texto_fuente, hash_fuente
+
+
+class Command(BaseCommand):
+    help = 'Resume cada negocio y su catálogo en un perfil corto para el prompt (solo los que cambiaron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--negocio',
+            type=int,
+            action='append',
+            help='ID de negocio a procesar (se puede repetir; por defecto, todos los activos)',
+        )
+        parser.add_argument(
+            '--concurrencia',
+            type=int,
+            default=settings.PROFILE_BUILD_CONCURRENCY,
+            help='Llamadas simultáneas al LLM',
+        )
+        parser.add_argument(
+            '--max-chars',
+            type=int,
+            default=settings.PROFILE_MAX_CHARS,
+            help='Tamaño máximo de cada perfil',
+        )
+        parser.add_argument(
+            '--forzar',
+            action='store_true',
+            help='Regenerar aunque los datos no hayan cambiado',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrencia'] < 1:
+            raise CommandError('--concurrencia debe ser al menos 1')
+
+        generador = GeneradorPerfiles(max_chars=options['max_chars'])
+        if not generador.disponible:
+            raise CommandError('GEMINI_API_KEY no está configurada')
+
+        self.stdout.write(self.style.SUCCESS('=== Generación de perfiles de negocios ===\n'))
+        inicio = time.perf_counter()
+
+        # Los hashes se comparan con lo último escrito, no con una réplica atrasada
+        with usar_primaria():
+            pendientes, sin_cambios = self.pendientes(options['negocio'], generador, options['forzar'])
+
+        self.stdout.write(f'  {len(pendientes)} por generar, {sin_cambios} sin cambios')
+
+        generados, fallidos = 0, []
+        if pendientes:
+            # Las llamadas al LLM van en hilos; las escrituras, en el hilo principal
+            with ThreadPoolExecutor(max_workers=options['concurrencia']) as executor:
+                futuros = {
+                    executor.submit(generador.generar, fuente): (negocio, huella)
+                    for negocio, fuente, huella in pendientes
+                }
+                for futuro in as_completed(futuros):
+                    negocio, huella = futuros[futuro]
+                    texto = futuro.result()
+                    if not texto:
+                        fallidos.append(negocio.id)
+                        continue
+                    PerfilNegocio.objects.update_or_create(
+                        negocio=negocio,
+                        defaults={'texto': texto, 'hash_contenido': huella, 'modelo': generador.modelo},
+                    )
+                    generados += 1
+                    self.stdout.write(f'  [{negocio.id}] {negocio.nombre}: {len(texto)} caracteres')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\n=== {generados} generados, {sin_cambios} sin cambios, {len(fallidos)} fallidos '
+            f'en {time.perf_counter() - inicio:.1f} s ==='
+        ))
+        if fallidos:
+            self.stdout.write(self.style.WARNING(f'  Fallidos: {sorted(fallidos)}'))
+
+    def pendientes(self, negocio_ids, generador, forzar):
+        """
+        Negocios cuyo perfil falta o quedó viejo
+
+        Returns:
+            ([(negocio, texto_fuente, hash)], cantidad sin cambios)
+        """
+        negocios = Negocio.objects.filter(activo=True).order_by('id')
+        if negocio_ids:
+            negocios = negocios.filter(id__in=negocio_ids)
+        negocios = list(negocios)
+        ids = [n.id for n in negocios]
+
+        productos = {}
+        filas = ProductoNegocio.objects.filter(
+            negocio_id__in=ids, activo=True, disponible=True
+        ).order_by('negocio_id', '-destacado', 'orden', 'nombre')
+        for p in filas:
+            productos.setdefault(p.negocio_id, []).append(p)
+
+        hashes = dict(PerfilNegocio.objects.filter(negocio_id__in=ids).values_list('negocio_id', 'hash_contenido'))
+
+        pendientes, sin_cambios = [], 0
+        for negocio in negocios:
+            fuente = texto_fuente(negocio, productos.get(negocio.id, []))
+            huella = hash_fuente(fuente, generador.max_chars, generador.modelo)
+            if not forzar and hashes.get(negocio.id) == huella:
+                sin_cambios += 1
+                continue
+            pendientes.append((negocio, fuente, huella))
+        return pendientes, sin_cambios
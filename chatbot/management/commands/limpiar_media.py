@@ -0,0 +1,51 @@
+"""
+Comando para recolectar los archivos sin uso del almacén de medios
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from chatbot.models import ArchivoMedia
+from chatbot.services.media_store import almacen_media
+
+
+class Command(BaseCommand):
+    help = 'Borra del almacén de medios los archivos sin referencias viejos o que exceden el tamaño máximo'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-mb',
+            type=int,
+            default=settings.MEDIA_STORE_MAX_BYTES // (1024 * 1024),
+            help='Tamaño máximo del almacén en MB',
+        )
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=settings.MEDIA_STORE_MAX_AGE_DAYS,
+            help='Borrar los archivos sin referencias no usados en estos días',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Solo informar lo que se borraría',
+        )
+    
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('=== Limpieza del almacén de medios ===\n'))
+        
+        antes = ArchivoMedia.objects.aggregate(archivos=Count('sha256'), bytes=Sum('tamano'))
+        self.stdout.write(f"  Almacén: {antes['archivos']} archivos, {(antes['bytes'] or 0) / 1024 / 1024:.1f} MB")
+        
+        borrados, liberados = almacen_media.recolectar(
+            max_bytes=options['max_mb'] * 1024 * 1024,
+            max_edad=timedelta(days=options['dias']),
+            simular=options['simular'],
+        )
+        
+        verbo = 'Se borrarían' if options['simular'] else 'Borrados'
+        self.stdout.write(self.style.SUCCESS(
+            f'  {verbo}: {borrados} archivos, {liberados / 1024 / 1024:.1f} MB'
+        ))
@@ -0,0 +1,29 @@
+"""
+Comando para recalcular los resúmenes de calificaciones desde las reseñas
+"""
+from django.core.management.base import BaseCommand
+from chatbot.models import ResumenCalificacion
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el resumen materializado de calificaciones y corrige diferencias'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--negocio',
+            type=int,
+            action='append',
+            help='ID de negocio a reconciliar (se puede repetir; por defecto, todos)',
+        )
+    
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('=== Reconciliación de calificaciones ===\n'))
+        
+        corregidos = ResumenCalificacion.recalcular(negocio_ids=options.get('negocio'))
+        
+        if corregidos:
+            self.stdout.write(
+                self.style.WARNING(f'  {len(corregidos)} resumen(es) corregido(s): {sorted(corregidos)}')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS('  Todos los resúmenes estaban al día'))
@@ -0,0 +1,55 @@
+"""
+Comando para recuperar las respuestas salientes que quedaron pendientes
+
+La cola del despachador vive en memoria: si el proceso se reinicia o se cae,
+lo que estaba encolado queda como Message saliente con status='pending' y
+nunca se envía. Conviene correrlo periódicamente (cron, Heroku Scheduler) y
+tras cada despliegue.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.services.dispatcher import DespachadorSalida
+
+
+class Command(BaseCommand):
+    help = 'Reenvía (o marca como fallidas) las respuestas salientes pendientes cuyo envío se perdió'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--segundos',
+            type=int,
+            default=settings.OUTBOUND_RECOVERY_AGE_SECONDS,
+            help='Antigüedad mínima de un envío pendiente para darlo por perdido',
+        )
+        parser.add_argument(
+            '--marcar-fallidos',
+            action='store_true',
+            help='Marcar los pendientes como fallidos en lugar de reenviarlos',
+        )
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Solo informar lo que se haría',
+        )
+
+    def handle(self, *args, **options):
+        if options['segundos'] < 0:
+            raise CommandError('--segundos no puede ser negativo')
+
+        self.stdout.write(self.style.SUCCESS('=== Recuperación de salientes pendientes ===\n'))
+
+        # Envío síncrono: el comando termina cuando todo quedó registrado
+        despachador = DespachadorSalida(asincrono=False)
+        reencolados, fallidos = despachador.recuperar_pendientes(
+            timedelta(seconds=options['segundos']),
+            marcar_fallidos=options['marcar_fallidos'],
+            simular=options['simular'],
+        )
+
+        prefijo = 'Se reenviarían' if options['simular'] else 'Reenviados'
+        self.stdout.write(self.style.SUCCESS(
+            f'  {prefijo}: {reencolados} mensajes; marcados como fallidos: {fallidos}'
+        ))
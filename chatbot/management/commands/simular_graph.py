@@ -0,0 +1,82 @@
+"""
+Comando para levantar una Graph API falsa (pruebas de carga sin red)
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.services.graph_simulator import ConfigSimulador, SimuladorGraph
+
+
+class Command(BaseCommand):
+    help = 'Atiende localmente los endpoints de Graph API que usa el bot (mensajes, medios y webhooks de estado)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Dirección en la que escuchar')
+        parser.add_argument('--puerto', type=int, default=8765, help='Puerto en el que escuchar')
+        parser.add_argument('--latencia-ms', type=float, default=50, help='Demora media de cada respuesta')
+        parser.add_argument('--variacion-ms', type=float, default=20, help='Variación de la demora (±)')
+        parser.add_argument(
+            '--tasa-error', type=float, default=0.0,
+            help='Fracción de peticiones que responden 500 (0 a 1)',
+        )
+        parser.add_argument(
+            '--tasa-429', type=float, default=0.0,
+            help='Fracción de envíos que responden 429 por límite de tasa (0 a 1)',
+        )
+        parser.add_argument(
+            '--limite-rps', type=int, default=0,
+            help='Envíos por segundo antes de responder 429 (0 = sin límite)',
+        )
+        parser.add_argument(
+            '--webhook',
+            help='URL del webhook al que devolver los estados sent/delivered/read '
+                 '(p. ej. http://127.0.0.1:8000/chatbot/webhook/)',
+        )
+        parser.add_argument(
+            '--secreto', default=settings.META_WEBHOOK_SECRET,
+            help='Clave para firmar los webhooks (por defecto META_WEBHOOK_SECRET)',
+        )
+        parser.add_argument('--demora-estados-ms', type=float, default=200, help='Tiempo entre estados')
+        parser.add_argument('--media-kb', type=int, default=64, help='Tamaño de los archivos sintéticos')
+        parser.add_argument('--registro', help='Archivo JSONL donde anotar cada petición recibida')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('=== Graph API simulada ===\n'))
+
+        simulador = SimuladorGraph(
+            ConfigSimulador(
+                latencia_ms=options['latencia_ms'],
+                variacion_ms=options['variacion_ms'],
+                tasa_error=options['tasa_error'],
+                tasa_429=options['tasa_429'],
+                limite_rps=options['limite_rps'],
+                webhook_url=options['webhook'],
+                secreto=options['secreto'],
+                demora_estados_ms=options['demora_estados_ms'],
+                media_bytes=options['media_kb'] * 1024,
+                archivo_registro=options['registro'],
+            ),
+            host=options['host'],
+            puerto=options['puerto'],
+        )
+        base_url = simulador.iniciar()
+
+        self.stdout.write(f"  Escuchando en {base_url}")
+        self.stdout.write(f"  Iniciar el bot con META_GRAPH_BASE_URL={base_url}")
+        if options['webhook']:
+            self.stdout.write(f"  Estados de entrega hacia {options['webhook']}")
+        self.stdout.write("  Ctrl+C para terminar\n")
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulador.detener()
+
+        self.stdout.write(self.style.SUCCESS('\nResumen:'))
+        self.stdout.write(json.dumps(simulador.resumen(), indent=2, ensure_ascii=False))
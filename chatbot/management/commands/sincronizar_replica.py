@@ -0,0 +1,116 @@
+"""
+Comando para copiar el catálogo del primario a la réplica de lectura
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from chatbot.models import (
+    CategoriaNegocio, Negocio, HorarioAtencion, ProductoNegocio,
+    ResenaNegocio, ResumenCalificacion, EventoDeportivo, PerfilNegocio
+)
+from chatbot.services.query_cache import cache_consultas, etiqueta
+
+# Padres antes que hijos (se borra en orden inverso)
+MODELOS = [
+    CategoriaNegocio, Negocio, HorarioAtencion, ProductoNegocio,
+    ResenaNegocio, ResumenCalificacion, EventoDeportivo, PerfilNegocio,
+]
+
+
+class Command(BaseCommand):
+    help = 'Copia las tablas del catálogo desde la BD principal a la réplica de lectura'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            type=str,
+            default=settings.CATALOG_REPLICA_ALIAS,
+            help='Alias de la réplica (por defecto, CATALOG_REPLICA_ALIAS)',
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=1000,
+            help='Filas por lote de inserción',
+        )
+        parser.add_argument(
+            '--recrear',
+            action='store_true',
+            help='Borrar y volver a crear las tablas (tras cambios de esquema)',
+        )
+
+    def handle(self, *args, **options):
+        destino = options['database']
+        if not destino or destino not in connections:
+            raise CommandError('No hay réplica configurada (define DB_REPLICA_NAME)')
+        if destino == 'default':
+            raise CommandError('La réplica no puede ser la BD principal')
+
+        self.stdout.write(self.style.SUCCESS(f'=== Sincronización de la réplica "{destino}" ===\n'))
+        inicio = time.perf_counter()
+
+        self.preparar_tablas(destino, options['recrear'])
+
+        # Una sola transacción: los lectores ven la copia anterior hasta el commit
+        with transaction.atomic(using=destino):
+            with connections[destino].cursor() as cursor:
+                for modelo in reversed(MODELOS):
+                    tabla = connections[destino].ops.quote_name(modelo._meta.db_table)
+                    cursor.execute(f'DELETE FROM {tabla}')
+
+            for modelo in MODELOS:
+                total = self.copiar(modelo, destino, options['batch'])
+                self.stdout.write(f'  {modelo._meta.db_table}: {total} filas')
+
+        # Las copias no disparan señales: se avisa a los índices y cachés de todos los workers
+        cache_consultas.invalidar(*(etiqueta(modelo) for modelo in MODELOS))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\n=== Réplica sincronizada en {time.perf_counter() - inicio:.1f} s ==='
+        ))
+
+    def preparar_tablas(self, destino, recrear):
+        """Crear en la réplica las tablas que falten (o todas, con --recrear)"""
+        conexion = connections[destino]
+        existentes = set(conexion.introspection.table_names())
+        with conexion.schema_editor() as editor:
+            if recrear:
+                for modelo in reversed(MODELOS):
+                    if modelo._meta.db_table in existentes:
+                        editor.delete_model(modelo)
+                existentes = set()
+            for modelo in MODELOS:
+                if modelo._meta.db_table not in existentes:
+                    editor.create_model(modelo)
+                    self.stdout.write(f'  Tabla creada: {modelo._meta.db_table}')
+
+    def copiar(self, modelo, destino, batch):
+        """
+        Copiar las filas tal cual con INSERT directos
+
+        bulk_create no sirve: volvería a calcular los campos auto_now y
+        auto_now_add (fechas de reseñas, de actualización, etc.).
+        """
+        conexion = connections[destino]
+        campos = modelo._meta.concrete_fields
+        columnas = ', '.join(conexion.ops.quote_name(c.column) for c in campos)
+        marcadores = ', '.join(['%s'] * len(campos))
+        sql = f'INSERT INTO {conexion.ops.quote_name(modelo._meta.db_table)} ({columnas}) VALUES ({marcadores})'
+
+        filas = modelo.objects.using('default').order_by('pk').values_list(*[c.attname for c in campos])
+        total = 0
+        lote = []
+        with conexion.cursor() as cursor:
+            for fila in filas.iterator(chunk_size=batch):
+                lote.append([c.get_db_prep_save(v, conexion) for c, v in zip(campos, fila)])
+                if len(lote) >= batch:
+                    cursor.executemany(sql, lote)
+                    total += len(lote)
+                    lote = []
+            if lote:
+                cursor.executemany(sql, lote)
+                total += len(lote)
+        return total
@@ -0,0 +1,25 @@
+"""
+Comando para verificar el presupuesto de consultas de DatabaseService
+
+Atajo para correr chatbot/tests/test_presupuesto_consultas.py: crea una base
+de prueba con un catálogo de tamaño realista, cuenta las consultas SQL de
+cada método y revisa el plan de ejecución (EXPLAIN) de los marcados.
+"""
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+PRUEBAS = 'chatbot.tests.test_presupuesto_consultas'
+
+
+class Command(BaseCommand):
+    help = 'Verifica el número de consultas y el uso de índices de DatabaseService (corre sus pruebas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Reutilizar la base de prueba si ya existe y no destruirla al terminar',
+        )
+
+    def handle(self, *args, **options):
+        call_command('test', PRUEBAS, keepdb=options['keepdb'], verbosity=options['verbosity'])
@@ -0,0 +1,60 @@
+# Resumen materializado de calificaciones por negocio
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def poblar_resumenes(apps, schema_editor):
+    ResenaNegocio = apps.get_model('chatbot', 'ResenaNegocio')
+    ResumenCalificacion = apps.get_model('chatbot', 'ResumenCalificacion')
+    db = schema_editor.connection.alias
+
+    por_negocio = defaultdict(Counter)
+    filas = ResenaNegocio.objects.using(db).filter(aprobado=True).values(
+        'negocio_id', 'calificacion'
+    ).annotate(cantidad=models.Count('id'))
+    for fila in filas:
+        por_negocio[fila['negocio_id']][fila['calificacion']] = fila['cantidad']
+
+    resumenes = []
+    for negocio_id, por_estrellas in por_negocio.items():
+        valores = {f'estrellas_{e}': por_estrellas.get(e, 0) for e in range(1, 6)}
+        resumenes.append(ResumenCalificacion(
+            negocio_id=negocio_id,
+            total=sum(por_estrellas.values()),
+            suma=sum(c * n for c, n in por_estrellas.items()),
+            **valores
+        ))
+    ResumenCalificacion.objects.using(db).bulk_create(resumenes, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenCalificacion',
+            fields=[
+                ('negocio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumen_calificacion', serialize=False, to='chatbot.negocio')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('suma', models.PositiveIntegerField(default=0)),
+                ('estrellas_1', models.PositiveIntegerField(default=0)),
+                ('estrellas_2', models.PositiveIntegerField(default=0)),
+                ('estrellas_3', models.PositiveIntegerField(default=0)),
+                ('estrellas_4', models.PositiveIntegerField(default=0)),
+                ('estrellas_5', models.PositiveIntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Resumen de Calificaciones',
+                'verbose_name_plural': 'Resúmenes de Calificaciones',
+                'db_table': 'resumen_calificaciones',
+            },
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
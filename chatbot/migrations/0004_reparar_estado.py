@@ -0,0 +1,138 @@
+# Generated by Django 5.0 on 2026-10-19 10:17
+# Editada a mano: ver SeparateDatabaseAndState de EventoDeportivo
+#
+# Pone el estado de las migraciones al día con models.py, sin cambios de
+# esquema: los modelos sin gestionar (Cliente, Pedido, Producto,
+# DetallePedido) nunca se habían registrado, la tabla eventos_deportivos se
+# creó fuera de las migraciones y el help_text de Negocio.categoria cambió
+# sin migración. Va aparte de los índices (0005_indices_compuestos).
+
+from django.db import migrations, models
+
+
+def crear_tabla_eventos(apps, schema_editor):
+    EventoDeportivo = apps.get_model('chatbot', 'EventoDeportivo')
+    tablas = schema_editor.connection.introspection.table_names()
+    if EventoDeportivo._meta.db_table not in tablas:
+        schema_editor.create_model(EventoDeportivo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_resumencalificacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('telefono', models.CharField(blank=True, max_length=20)),
+                ('direccion', models.TextField(blank=True)),
+                ('fecha_registro', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Cliente',
+                'verbose_name_plural': 'Clientes',
+                'db_table': 'clientes',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DetallePedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField()),
+                ('precio_unitario', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'verbose_name': 'Detalle de Pedido',
+                'verbose_name_plural': 'Detalles de Pedidos',
+                'db_table': 'detalle_pedidos',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Pedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_pedido', models.DateTimeField(auto_now_add=True)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('estado', models.CharField(max_length=50)),
+                ('direccion_envio', models.TextField(blank=True)),
+                ('notas', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Pedido',
+                'verbose_name_plural': 'Pedidos',
+                'db_table': 'pedidos',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Producto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255)),
+                ('descripcion', models.TextField(blank=True)),
+                ('precio', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock', models.IntegerField(default=0)),
+                ('categoria', models.CharField(blank=True, max_length=100)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('activo', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Producto',
+                'verbose_name_plural': 'Productos',
+                'db_table': 'productos',
+                'managed': False,
+            },
+        ),
+        # La tabla eventos_deportivos ya existe en producción (se creó fuera de
+        # las migraciones); solo se registra el modelo y se crea la tabla si falta
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='EventoDeportivo',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('nombre', models.CharField(help_text='Nombre del evento', max_length=255)),
+                        ('tipo_evento', models.CharField(choices=[('futbol', 'Fútbol'), ('baloncesto', 'Baloncesto'), ('voleibol', 'Voleibol'), ('atletismo', 'Atletismo'), ('ciclismo', 'Ciclismo'), ('otro', 'Otro')], default='futbol', max_length=50)),
+                        ('descripcion', models.TextField(blank=True)),
+                        ('equipo_local', models.CharField(blank=True, max_length=100)),
+                        ('equipo_visitante', models.CharField(blank=True, max_length=100)),
+                        ('fecha_evento', models.DateTimeField(help_text='Fecha y hora del evento')),
+                        ('fecha_fin', models.DateTimeField(blank=True, help_text='Fecha de finalización (opcional)', null=True)),
+                        ('lugar', models.CharField(help_text='Ej: Estadio Municipal, Coliseo', max_length=255)),
+                        ('direccion', models.TextField(blank=True)),
+                        ('barrio', models.CharField(blank=True, max_length=100)),
+                        ('precio_entrada', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                        ('entrada_gratis', models.BooleanField(default=False)),
+                        ('organizador', models.CharField(blank=True, max_length=200)),
+                        ('contacto', models.CharField(blank=True, help_text='Teléfono de contacto', max_length=20)),
+                        ('imagen', models.URLField(blank=True)),
+                        ('activo', models.BooleanField(default=True)),
+                        ('destacado', models.BooleanField(default=False)),
+                        ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                        ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                    ],
+                    options={
+                        'verbose_name': 'Evento Deportivo',
+                        'verbose_name_plural': 'Eventos Deportivos',
+                        'db_table': 'eventos_deportivos',
+                        'ordering': ['fecha_evento'],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(crear_tabla_eventos, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='negocio',
+            name='categoria',
+            field=models.CharField(blank=True, help_text='Ej: Restaurante, Tienda, Farmacia', max_length=100),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-19 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_reparar_estado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='mensajes_conv_creado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='negocio',
+            index=models.Index(fields=['activo', 'ciudad', 'categoria'], name='negocios_activo_ciudad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productonegocio',
+            index=models.Index(fields=['negocio', 'activo', 'disponible', 'destacado', 'orden'], name='productos_neg_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventodeportivo',
+            index=models.Index(fields=['activo', 'fecha_evento'], name='eventos_activo_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0 on 2026-10-19 10:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_indices_compuestos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilNegocio',
+            fields=[
+                ('negocio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='perfil', serialize=False, to='chatbot.negocio')),
+                ('texto', models.TextField()),
+                ('hash_contenido', models.CharField(help_text='SHA-256 de los datos de origen; si no cambia, el perfil no se regenera', max_length=64)),
+                ('modelo', models.CharField(blank=True, max_length=100)),
+                ('fecha_generacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Perfil de Negocio',
+                'verbose_name_plural': 'Perfiles de Negocios',
+                'db_table': 'perfiles_negocio',
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0 on 2026-10-19 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_perfilnegocio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campana',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('plantilla', models.CharField(help_text='Nombre de la plantilla aprobada en Meta', max_length=255)),
+                ('idioma', models.CharField(default='es', max_length=10)),
+                ('componentes', models.JSONField(blank=True, default=list, help_text='Parámetros de la plantilla; admite {nombre}, {evento}, {fecha}, {lugar} y {negocio}')),
+                ('estado', models.CharField(choices=[('en_curso', 'En curso'), ('completada', 'Completada')], default='en_curso', max_length=20)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('evento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='campanas', to='chatbot.eventodeportivo')),
+                ('negocio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='campanas', to='chatbot.negocio')),
+            ],
+            options={
+                'verbose_name': 'Campaña',
+                'verbose_name_plural': 'Campañas',
+                'db_table': 'campanas',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EnvioCampana',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pending', 'Pendiente'), ('sent', 'Enviado'), ('delivered', 'Entregado'), ('read', 'Leído'), ('failed', 'Fallido')], default='pending', max_length=20)),
+                ('message_id', models.CharField(blank=True, db_index=True, max_length=100, null=True)),
+                ('codigo_error', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('intentos', models.IntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('campana', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envios', to='chatbot.campana')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envios_campana', to='chatbot.conversation')),
+            ],
+            options={
+                'verbose_name': 'Envío de Campaña',
+                'verbose_name_plural': 'Envíos de Campaña',
+                'db_table': 'envios_campana',
+                'indexes': [models.Index(fields=['campana', 'estado'], name='envios_campana_estado_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='enviocampana',
+            constraint=models.UniqueConstraint(fields=('campana', 'conversation'), name='envio_campana_unico'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-19 11:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_campanas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoMedia',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('ruta', models.CharField(help_text='Relativa a MEDIA_STORE_DIR', max_length=255)),
+                ('mime_type', models.CharField(blank=True, max_length=100)),
+                ('tamano', models.BigIntegerField(help_text='Bytes')),
+                ('referencias', models.IntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('ultimo_acceso', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Archivo Multimedia',
+                'verbose_name_plural': 'Archivos Multimedia',
+                'db_table': 'archivos_media',
+                'indexes': [models.Index(fields=['referencias', 'ultimo_acceso'], name='archivos_media_gc_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='archivo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mensajes', to='chatbot.archivomedia'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-19 12:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_archivos_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaSubida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_origen', models.URLField(max_length=500, unique=True)),
+                ('sha256', models.CharField(max_length=64)),
+                ('media_id', models.CharField(max_length=100)),
+                ('mime_type', models.CharField(blank=True, max_length=100)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=100)),
+                ('fecha_subida', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expira', models.DateTimeField()),
+                ('fecha_verificacion', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Media Subida',
+                'verbose_name_plural': 'Medias Subidas',
+                'db_table': 'medias_subidas',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-19 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_medias_subidas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='parte',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='respuesta_a',
+            field=models.ForeignKey(blank=True, help_text='Mensaje entrante al que responde', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='respuestas', to='chatbot.message'),
+        ),
+    ]
@@ -1,10 +1,18 @@
 """
 Modelos para almacenar conversaciones, mensajes y datos de negocios
 """
-from django.db import models
+from collections import Counter, defaultdict
+
+from django.db import models, router, transaction
+from django.db.models import F
+from django.dispatch import Signal
 from django.utils import timezone
 
 
+# Se envía con los IDs de negocio cuyo resumen de calificaciones cambió
+resumenes_calificacion_actualizados = Signal()
+
+
 class Conversation(models.Model):
     """Conversación con un usuario de WhatsApp"""
     phone_number = models.CharField(max_length=20, unique=True, db_index=True)
@@ -62,10 +70,33 @@ class Message(models.Model):
     status = models.CharField(max_length=20, blank=True, default='sent')
     error_message = models.TextField(blank=True, null=True)
     
+    # Copia local del archivo multimedia (ver services/media_store.py)
+    archivo = models.ForeignKey(
+        'ArchivoMedia',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='mensajes'
+    )
+    
+    # Respuesta larga dividida en varios mensajes (ver services/reply_segmenter.py)
+    respuesta_a = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='respuestas',
+        help_text="Mensaje entrante al que responde"
+    )
+    parte = models.PositiveSmallIntegerField(default=1)
+    
     class Meta:
         ordering = ['-timestamp']
         verbose_name = 'Mensaje'
         verbose_name_plural = 'Mensajes'
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='mensajes_conv_creado_idx'),
+        ]
     
     def __str__(self):
         return f"{self.conversation.phone_number} - {self.message_type} - {self.direction}"
@@ -129,6 +160,9 @@ class Negocio(models.Model):
         verbose_name = 'Negocio'
         verbose_name_plural = 'Negocios'
         ordering = ['nombre']
+        indexes = [
+            models.Index(fields=['activo', 'ciudad', 'categoria'], name='negocios_activo_ciudad_idx'),
+        ]
     
     def __str__(self):
         return self.nombre
@@ -197,6 +231,12 @@ class ProductoNegocio(models.Model):
         verbose_name = 'Producto/Servicio'
         verbose_name_plural = 'Productos/Servicios'
         ordering = ['negocio', '-destacado', 'orden', 'nombre']
+        indexes = [
+            models.Index(
+                fields=['negocio', 'activo', 'disponible', 'destacado', 'orden'],
+                name='productos_neg_activo_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.negocio.nombre} - {self.nombre}"
@@ -230,6 +270,48 @@ class CategoriaNegocio(models.Model):
         return self.nombre
 
 
+class ResenaNegocioQuerySet(models.QuerySet):
+    """QuerySet de reseñas que mantiene el resumen de calificaciones en operaciones masivas"""
+    
+    def cambiar_aprobacion(self, aprobado):
+        """
+        Aprobar o rechazar en bloque, actualizando los resúmenes en la misma transacción
+        
+        Returns:
+            Cantidad de reseñas que cambiaron de estado
+        """
+        with transaction.atomic(using=self.db):
+            afectadas = list(
+                self.select_for_update()
+                .exclude(aprobado=aprobado)
+                .values_list('id', 'negocio_id', 'calificacion')
+            )
+            if not afectadas:
+                return 0
+            
+            ResenaNegocio.objects.filter(id__in=[a[0] for a in afectadas]).update(aprobado=aprobado)
+            
+            signo = 1 if aprobado else -1
+            cambios = Counter()
+            for _, negocio_id, calificacion in afectadas:
+                cambios[(negocio_id, calificacion)] += signo
+            ResumenCalificacion.aplicar_cambios(cambios, using=self.db)
+        
+        return len(afectadas)
+    
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            cambios = Counter()
+            for negocio_id, calificacion in self.filter(aprobado=True).values_list('negocio_id', 'calificacion'):
+                cambios[(negocio_id, calificacion)] -= 1
+            resultado = super().delete()
+            ResumenCalificacion.aplicar_cambios(cambios, using=self.db)
+        return resultado
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class ResenaNegocio(models.Model):
     """Reseñas y calificaciones de negocios"""
     negocio = models.ForeignKey(Negocio, on_delete=models.CASCADE, related_name='resenas')
@@ -246,8 +328,190 @@ class ResenaNegocio(models.Model):
         verbose_name_plural = 'Reseñas'
         ordering = ['-fecha']
     
+    objects = ResenaNegocioQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.negocio.nombre} - {self.calificacion}⭐ por {self.nombre_cliente or self.telefono_cliente}"
+    
+    def save(self, *args, **kwargs):
+        """Guardar la reseña y ajustar el resumen del negocio en la misma transacción"""
+        using = kwargs.get('using') or router.db_for_write(ResenaNegocio, instance=self)
+        with transaction.atomic(using=using):
+            anterior = None
+            if self.pk:
+                anterior = ResenaNegocio.objects.using(using).select_for_update().filter(
+                    pk=self.pk
+                ).values('negocio_id', 'calificacion', 'aprobado').first()
+            
+            super().save(*args, **kwargs)
+            
+            cambios = Counter()
+            if anterior and anterior['aprobado']:
+                cambios[(anterior['negocio_id'], anterior['calificacion'])] -= 1
+            if self.aprobado:
+                cambios[(self.negocio_id, self.calificacion)] += 1
+            ResumenCalificacion.aplicar_cambios(cambios, using=using)
+    
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(ResenaNegocio, instance=self)
+        with transaction.atomic(using=using):
+            aprobado = ResenaNegocio.objects.using(using).filter(pk=self.pk, aprobado=True).exists()
+            resultado = super().delete(*args, **kwargs)
+            if aprobado:
+                ResumenCalificacion.aplicar_cambios(Counter({(self.negocio_id, self.calificacion): -1}), using=using)
+        return resultado
+
+
+class ResumenCalificacion(models.Model):
+    """
+    Resumen materializado de las reseñas aprobadas de un negocio
+    
+    Se actualiza de forma incremental al crear, aprobar, rechazar o borrar
+    reseñas; `manage.py reconciliar_calificaciones` lo recalcula desde cero.
+    """
+    negocio = models.OneToOneField(
+        Negocio,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='resumen_calificacion'
+    )
+    total = models.PositiveIntegerField(default=0)
+    suma = models.PositiveIntegerField(default=0)
+    estrellas_1 = models.PositiveIntegerField(default=0)
+    estrellas_2 = models.PositiveIntegerField(default=0)
+    estrellas_3 = models.PositiveIntegerField(default=0)
+    estrellas_4 = models.PositiveIntegerField(default=0)
+    estrellas_5 = models.PositiveIntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'resumen_calificaciones'
+        verbose_name = 'Resumen de Calificaciones'
+        verbose_name_plural = 'Resúmenes de Calificaciones'
+    
+    def __str__(self):
+        return f"{self.negocio_id} - {self.promedio or 0:.1f}⭐ ({self.total})"
+    
+    @property
+    def promedio(self):
+        """Calificación promedio, o None si no hay reseñas aprobadas"""
+        return self.suma / self.total if self.total else None
+    
+    def distribucion(self):
+        """Distribución con el mismo formato que values('calificacion').annotate(cantidad=...)"""
+        return [
+            {'calificacion': estrellas, 'cantidad': getattr(self, f'estrellas_{estrellas}')}
+            for estrellas in range(5, 0, -1)
+            if getattr(self, f'estrellas_{estrellas}')
+        ]
+    
+    @classmethod
+    def aplicar_cambios(cls, cambios, using='default'):
+        """
+        Aplicar variaciones de conteo a los resúmenes
+        
+        Args:
+            cambios: Counter {(negocio_id, calificacion): variación}
+        """
+        por_negocio = defaultdict(Counter)
+        for (negocio_id, calificacion), delta in cambios.items():
+            if delta:
+                por_negocio[negocio_id][calificacion] += delta
+        
+        for negocio_id, por_estrellas in por_negocio.items():
+            cls.objects.using(using).get_or_create(negocio_id=negocio_id)
+            actualizacion = {
+                'total': F('total') + sum(por_estrellas.values()),
+                'suma': F('suma') + sum(c * d for c, d in por_estrellas.items()),
+                'fecha_actualizacion': timezone.now(),
+            }
+            for calificacion, delta in por_estrellas.items():
+                campo = f'estrellas_{calificacion}'
+                actualizacion[campo] = F(campo) + delta
+            cls.objects.using(using).filter(negocio_id=negocio_id).update(**actualizacion)
+        
+        if por_negocio:
+            negocio_ids = list(por_negocio)
+            transaction.on_commit(
+                lambda: resumenes_calificacion_actualizados.send(sender=cls, negocio_ids=negocio_ids),
+                using=using
+            )
+    
+    @classmethod
+    def recalcular(cls, negocio_ids=None, using='default'):
+        """
+        Recalcular los resúmenes desde las reseñas aprobadas
+        
+        Returns:
+            Lista de IDs de negocio cuyo resumen estaba desactualizado
+        """
+        reales = defaultdict(Counter)
+        resenas = ResenaNegocio.objects.using(using).filter(aprobado=True)
+        if negocio_ids is not None:
+            resenas = resenas.filter(negocio_id__in=negocio_ids)
+        for fila in resenas.values('negocio_id', 'calificacion').annotate(cantidad=models.Count('id')):
+            reales[fila['negocio_id']][fila['calificacion']] = fila['cantidad']
+        
+        resumenes = cls.objects.using(using).all()
+        if negocio_ids is not None:
+            resumenes = resumenes.filter(negocio_id__in=negocio_ids)
+        
+        corregidos = []
+        with transaction.atomic(using=using):
+            existentes = {r.negocio_id: r for r in resumenes.select_for_update()}
+            for negocio_id in set(existentes) | set(reales):
+                por_estrellas = reales.get(negocio_id, Counter())
+                esperado = {
+                    'total': sum(por_estrellas.values()),
+                    'suma': sum(c * n for c, n in por_estrellas.items()),
+                }
+                for estrellas in range(1, 6):
+                    esperado[f'estrellas_{estrellas}'] = por_estrellas.get(estrellas, 0)
+                
+                resumen = existentes.get(negocio_id)
+                if resumen and all(getattr(resumen, campo) == valor for campo, valor in esperado.items()):
+                    continue
+                
+                cls.objects.using(using).update_or_create(negocio_id=negocio_id, defaults=esperado)
+                corregidos.append(negocio_id)
+            
+            if corregidos:
+                transaction.on_commit(
+                    lambda: resumenes_calificacion_actualizados.send(sender=cls, negocio_ids=corregidos),
+                    using=using
+                )
+        
+        return corregidos
+
+
+class PerfilNegocio(models.Model):
+    """
+    Perfil compacto de un negocio y su catálogo, resumido por el LLM
+    
+    Lo genera `manage.py build_profiles` fuera de línea; el contexto del
+    prompt lo usa en lugar de las descripciones completas.
+    """
+    negocio = models.OneToOneField(
+        Negocio,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='perfil'
+    )
+    texto = models.TextField()
+    hash_contenido = models.CharField(
+        max_length=64,
+        help_text="SHA-256 de los datos de origen; si no cambia, el perfil no se regenera"
+    )
+    modelo = models.CharField(max_length=100, blank=True)
+    fecha_generacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'perfiles_negocio'
+        verbose_name = 'Perfil de Negocio'
+        verbose_name_plural = 'Perfiles de Negocios'
+    
+    def __str__(self):
+        return f"Perfil de {self.negocio_id}"
 
 
 class EventoDeportivo(models.Model):
@@ -297,6 +561,9 @@ class EventoDeportivo(models.Model):
         verbose_name = 'Evento Deportivo'
         verbose_name_plural = 'Eventos Deportivos'
         ordering = ['fecha_evento']
+        indexes = [
+            models.Index(fields=['activo', 'fecha_evento'], name='eventos_activo_fecha_idx'),
+        ]
     
     def __str__(self):
         if self.equipo_local and self.equipo_visitante:
@@ -310,6 +577,142 @@ class EventoDeportivo(models.Model):
         return ahora <= self.fecha_evento <= ahora + timedelta(days=7)
 
 
+# --- CAMPAÑAS DE DIFUSIÓN ---
+
+class Campana(models.Model):
+    """Envío de una plantilla a todas las conversaciones activas (ver `manage.py broadcast`)"""
+    
+    ESTADO_CHOICES = [
+        ('en_curso', 'En curso'),
+        ('completada', 'Completada'),
+    ]
+    
+    nombre = models.CharField(max_length=100, unique=True)
+    plantilla = models.CharField(max_length=255, help_text="Nombre de la plantilla aprobada en Meta")
+    idioma = models.CharField(max_length=10, default='es')
+    componentes = models.JSONField(
+        default=list, blank=True,
+        help_text="Parámetros de la plantilla; admite {nombre}, {evento}, {fecha}, {lugar} y {negocio}"
+    )
+    evento = models.ForeignKey(
+        EventoDeportivo, on_delete=models.SET_NULL, null=True, blank=True, related_name='campanas'
+    )
+    negocio = models.ForeignKey(
+        Negocio, on_delete=models.SET_NULL, null=True, blank=True, related_name='campanas'
+    )
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='en_curso')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'campanas'
+        verbose_name = 'Campaña'
+        verbose_name_plural = 'Campañas'
+        ordering = ['-fecha_creacion']
+    
+    def __str__(self):
+        return self.nombre
+
+
+class EnvioCampana(models.Model):
+    """
+    Progreso de una campaña por destinatario
+    
+    La fila se crea como 'pending' antes de enviar y se actualiza con el
+    resultado; si el proceso se cae entre medio, queda 'pending' y al
+    reanudar no se reenvía (salvo con --reintentar-inciertos).
+    """
+    
+    ESTADO_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('sent', 'Enviado'),
+        ('delivered', 'Entregado'),
+        ('read', 'Leído'),
+        ('failed', 'Fallido'),
+    ]
+    
+    campana = models.ForeignKey(Campana, on_delete=models.CASCADE, related_name='envios')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='envios_campana')
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pending')
+    message_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    codigo_error = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    intentos = models.IntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'envios_campana'
+        verbose_name = 'Envío de Campaña'
+        verbose_name_plural = 'Envíos de Campaña'
+        constraints = [
+            models.UniqueConstraint(fields=['campana', 'conversation'], name='envio_campana_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['campana', 'estado'], name='envios_campana_estado_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.campana_id} → {self.conversation_id}: {self.estado}"
+
+
+# --- ALMACÉN DE MEDIOS ---
+
+class ArchivoMedia(models.Model):
+    """
+    Archivo del almacén local de medios, direccionado por su SHA-256
+    
+    El mismo contenido se guarda una sola vez. `referencias` cuenta los
+    mensajes que lo necesitan; los archivos sin referencias se borran por
+    antigüedad o por tamaño total del almacén (`manage.py limpiar_media`).
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    ruta = models.CharField(max_length=255, help_text="Relativa a MEDIA_STORE_DIR")
+    mime_type = models.CharField(max_length=100, blank=True)
+    tamano = models.BigIntegerField(help_text="Bytes")
+    referencias = models.IntegerField(default=0)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    ultimo_acceso = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'archivos_media'
+        verbose_name = 'Archivo Multimedia'
+        verbose_name_plural = 'Archivos Multimedia'
+        indexes = [
+            models.Index(fields=['referencias', 'ultimo_acceso'], name='archivos_media_gc_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.mime_type}, {self.tamano} bytes)"
+
+
+class MediaSubida(models.Model):
+    """
+    ID de media de WhatsApp de una imagen nuestra ya subida (logo, producto)
+    
+    Se envía por `id` en lugar de por `link`, así Meta no vuelve a descargar
+    la imagen en cada envío. Se vuelve a subir solo si el ID vence o si el
+    contenido de la URL cambia (ver services/media_uploads.py).
+    """
+    url_origen = models.URLField(max_length=500, unique=True)
+    sha256 = models.CharField(max_length=64)
+    media_id = models.CharField(max_length=100)
+    mime_type = models.CharField(max_length=100, blank=True)
+    # Validadores HTTP del origen para revalidar con una petición condicional
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    fecha_subida = models.DateTimeField(default=timezone.now)
+    expira = models.DateTimeField()
+    fecha_verificacion = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'medias_subidas'
+        verbose_name = 'Media Subida'
+        verbose_name_plural = 'Medias Subidas'
+    
+    def __str__(self):
+        return f"{self.url_origen} → {self.media_id}"
+
+
 
 # --- MODELOS ORIGINALES DE ÉBANO COMPANY (COMPATIBILIDAD) ---
 
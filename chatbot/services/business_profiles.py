@@ -0,0 +1,116 @@
+"""
+Perfiles compactos de negocios generados por el LLM
+
+Las descripciones de negocios y productos se recortaban a ciegas ([:60],
+[:100]) y aun así ocupaban buena parte del prompt. `manage.py build_profiles`
+resume fuera de línea cada negocio con su catálogo en un texto denso de
+tamaño fijo (PerfilNegocio); el contexto usa ese texto y omite las
+descripciones.
+
+Cada perfil guarda el hash de sus datos de origen (y de la versión del
+prompt, el modelo y el tamaño), así que regenerar solo cuesta llamadas al
+LLM para los negocios que cambiaron.
+"""
+import hashlib
+import logging
+
+import google.generativeai as genai
+from django.conf import settings
+
+logger = logging.getLogger('chatbot')
+
+# Cambiar al modificar PROMPT_PERFIL o la configuración de generación: obliga
+# a regenerar todos los perfiles
+VERSION_PROMPT = 2
+
+# Los modelos gemini-2.5 descuentan de max_output_tokens los tokens de
+# razonamiento: sin este margen la respuesta puede quedar vacía o cortada
+TOKENS_RAZONAMIENTO = 1024
+
+PROMPT_PERFIL = """Resume este negocio de Quibdó para un asistente de WhatsApp que recomienda negocios.
+Escribe en español, en un solo párrafo de máximo {max_chars} caracteres, sin emojis ni markdown.
+Incluye qué ofrece, productos o servicios característicos con precios si los hay, y lo que lo distingue.
+No repitas dirección, teléfono ni horario (se dan aparte). No inventes datos.
+
+{fuente}"""
+
+
+def texto_fuente(negocio, productos):
+    """Datos de un negocio que alimentan su perfil, en un formato estable"""
+    lineas = [f"Negocio: {negocio.nombre}"]
+    if negocio.categoria:
+        lineas.append(f"Categoría: {negocio.categoria}")
+    if negocio.barrio:
+        lineas.append(f"Barrio: {negocio.barrio}")
+    if negocio.descripcion:
+        lineas.append(f"Descripción: {negocio.descripcion.strip()}")
+
+    if productos:
+        lineas.append("Productos:")
+        for p in productos:
+            linea = f"- {p.nombre} ({p.get_precio_display()})"
+            if p.categoria:
+                linea += f" [{p.categoria}]"
+            if p.destacado:
+                linea += " destacado"
+            if p.descripcion:
+                linea += f": {p.descripcion.strip()}"
+            lineas.append(linea)
+    return "\n".join(lineas)
+
+
+def hash_fuente(fuente, max_chars, modelo):
+    """SHA-256 de todo lo que determina el perfil"""
+    contenido = f"v{VERSION_PROMPT}|{modelo}|{max_chars}\n{fuente}"
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def recortar(texto, max_chars):
+    """Una línea de como mucho max_chars, cortada en un límite de palabra"""
+    texto = " ".join(texto.split())
+    if len(texto) <= max_chars:
+        return texto
+    corte = texto[:max_chars - 1].rsplit(" ", 1)[0].rstrip(",;:.-")
+    return corte + "…"
+
+
+class GeneradorPerfiles:
+    """Llama al LLM para resumir un negocio; seguro para usar desde varios hilos"""
+
+    def __init__(self, modelo=None, max_chars=None):
+        self.modelo = modelo or settings.PROFILE_MODEL
+        self.max_chars = max_chars or settings.PROFILE_MAX_CHARS
+        self.disponible = bool(settings.GEMINI_API_KEY)
+        if not self.disponible:
+            logger.warning("API de Gemini sin configurar: no se pueden generar perfiles")
+            return
+
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.model = genai.GenerativeModel(
+            model_name=self.modelo,
+            generation_config={
+                "temperature": 0.2,
+                # Muy por encima de max_chars (~4 caracteres por token): el texto se recorta después
+                "max_output_tokens": TOKENS_RAZONAMIENTO + self.max_chars,
+            }
+        )
+
+    def generar(self, fuente):
+        """
+        Perfil de un negocio a partir de su texto fuente
+
+        Returns:
+            Texto recortado a max_chars, o None si el LLM falla
+        """
+        if not self.disponible:
+            return None
+        try:
+            prompt = PROMPT_PERFIL.format(max_chars=self.max_chars, fuente=fuente)
+            response = self.model.generate_content(prompt)
+            texto = (response.text or "").strip()
+            if not texto:
+                return None
+            return recortar(texto, self.max_chars)
+        except Exception as e:
+            logger.error(f"Error al generar perfil de negocio: {e}")
+            return None
@@ -0,0 +1,186 @@
+"""
+Catálogo de tamaño realista para las pruebas de consultas y de carga
+
+Lo usan las pruebas de presupuesto de consultas (chatbot/tests/) y
+`manage.py bench_webhook`; siempre sobre una base de prueba.
+"""
+import random
+from datetime import time, timedelta
+
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from ..models import (
+    Conversation, Message, Negocio, HorarioAtencion, ProductoNegocio,
+    ResenaNegocio, ResumenCalificacion, EventoDeportivo
+)
+from .gazetteer import gazetteer
+from .geo_index import indice_geografico
+from .horarios_index import indice_horarios
+from .ranking import tabla_atributos
+from .search_index import indice_catalogo
+
+CATEGORIAS = ['Restaurante', 'Panadería', 'Farmacia', 'Ferretería', 'Tienda', 'Peluquería']
+BARRIOS = ['Centro', 'Villa España', 'Kennedy', 'La Yesquita', 'Niño Jesús', 'El Poblado']
+CIUDADES = ['Quibdó', 'Istmina', 'Tadó']
+
+
+def invalidar_indices():
+    """Los índices en memoria pueden venir de otra base; se descartan"""
+    for indice in (indice_catalogo, gazetteer, indice_horarios, indice_geografico, tabla_atributos):
+        indice.invalidar()
+
+
+def sembrar(cantidad):
+    """
+    Generar un catálogo con bulk_create (no dispara señales)
+
+    Returns:
+        Dict con los totales generados y un 'negocio', 'evento_id' y
+        'conversacion' de ejemplo
+    """
+    aleatorio = random.Random(42)
+
+    Message.objects.all().delete()
+    Conversation.objects.all().delete()
+    EventoDeportivo.objects.all().delete()
+    Negocio.objects.all().delete()
+
+    Negocio.objects.bulk_create([
+        Negocio(
+            nombre=f'{CATEGORIAS[i % len(CATEGORIAS)]} Prueba {i}',
+            categoria=CATEGORIAS[i % len(CATEGORIAS)],
+            descripcion='Negocio generado para verificar consultas',
+            direccion=f'Calle {i}',
+            barrio=aleatorio.choice(BARRIOS),
+            ciudad=CIUDADES[0] if i % 5 else aleatorio.choice(CIUDADES),
+            latitud=round(5.69 + aleatorio.uniform(-0.03, 0.03), 6),
+            longitud=round(-76.65 + aleatorio.uniform(-0.03, 0.03), 6),
+            activo=i % 10 != 0,
+            verificado=i % 3 == 0,
+        )
+        for i in range(cantidad)
+    ], batch_size=500)
+    negocio_ids = list(Negocio.objects.values_list('id', flat=True))
+
+    HorarioAtencion.objects.bulk_create([
+        HorarioAtencion(negocio_id=negocio_id, dia_semana=dia, hora_apertura=time(8), hora_cierre=time(18))
+        for negocio_id in negocio_ids
+        for dia, _ in HorarioAtencion.DIAS_SEMANA
+    ], batch_size=1000)
+
+    ProductoNegocio.objects.bulk_create([
+        ProductoNegocio(
+            negocio_id=negocio_id,
+            nombre=f'Producto {j}',
+            precio=1000 * (j + 1),
+            destacado=j < 2,
+            orden=j,
+            disponible=j % 4 != 0,
+            activo=j % 7 != 0,
+        )
+        for negocio_id in negocio_ids
+        for j in range(10)
+    ], batch_size=1000)
+
+    ResenaNegocio.objects.bulk_create([
+        ResenaNegocio(
+            negocio_id=negocio_id,
+            telefono_cliente=f'57300{j:07d}',
+            calificacion=aleatorio.randint(1, 5),
+            aprobado=j % 4 != 0,
+        )
+        for negocio_id in negocio_ids
+        for j in range(5)
+    ], batch_size=1000)
+    ResumenCalificacion.recalcular()
+
+    ahora = timezone.now()
+    EventoDeportivo.objects.bulk_create([
+        EventoDeportivo(
+            nombre=f'Evento {i}',
+            tipo_evento='futbol' if i % 2 else 'baloncesto',
+            fecha_evento=ahora + timedelta(days=i - cantidad // 2),
+            lugar='Estadio Municipal',
+            activo=i % 10 != 0,
+        )
+        for i in range(cantidad)
+    ], batch_size=500)
+
+    Conversation.objects.bulk_create([
+        Conversation(phone_number=f'57310{i:07d}') for i in range(max(cantidad // 10, 1))
+    ])
+    conversaciones = list(Conversation.objects.all())
+    Message.objects.bulk_create([
+        Message(
+            conversation=conversacion,
+            message_id=f'wamid.prueba.{conversacion.id}.{j}',
+            direction='incoming' if j % 2 else 'outgoing',
+            content=f'Mensaje {j}',
+        )
+        for conversacion in conversaciones
+        for j in range(50)
+    ], batch_size=1000)
+
+    invalidar_indices()
+
+    return {
+        'negocios': len(negocio_ids),
+        'conversaciones': len(conversaciones),
+        'eventos': cantidad,
+        'negocio': Negocio.objects.filter(activo=True, latitud__isnull=False).order_by('id').first(),
+        'evento_id': EventoDeportivo.objects.filter(activo=True).values_list('id', flat=True).first(),
+        'conversacion': conversaciones[0],
+    }
+
+
+def analizar_tablas():
+    """Actualizar estadísticas para que el planificador elija índices"""
+    tablas = [
+        modelo._meta.db_table for modelo in (
+            Negocio, HorarioAtencion, ProductoNegocio, ResenaNegocio,
+            ResumenCalificacion, EventoDeportivo, Conversation, Message
+        )
+    ]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f"ANALYZE TABLE {', '.join(tablas)}")
+            cursor.fetchall()
+        elif connection.vendor in ('sqlite', 'postgresql'):
+            cursor.execute('ANALYZE')
+
+
+def evaluar(resultado):
+    """Forzar la evaluación de querysets perezosos"""
+    if isinstance(resultado, QuerySet):
+        return list(resultado)
+    if isinstance(resultado, dict):
+        for valor in resultado.values():
+            evaluar(valor)
+    return resultado
+
+
+def tablas_recorridas(sql):
+    """Tablas que el plan de ejecución recorre completas"""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return []
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}')
+            columnas = [c[0] for c in cursor.description]
+            filas = [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+            return [fila['table'] for fila in filas if fila.get('type') == 'ALL']
+
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            recorridas = []
+            for fila in cursor.fetchall():
+                detalle = fila[-1]
+                # "SCAN tabla" sin "USING ... INDEX" es un recorrido completo
+                if detalle.startswith('SCAN ') and 'USING' not in detalle:
+                    recorridas.append(detalle.split()[1])
+            return recorridas
+
+    return []
@@ -0,0 +1,169 @@
+"""
+Fragmentos de contexto pre-renderizados por negocio
+
+El texto de un negocio en el prompt (encabezado y dirección, ubicación,
+horario semanal, perfil, productos) solo cambia cuando cambia el negocio, sus
+horarios o sus productos. Se renderiza una vez, se guarda aquí y armar el
+prompt es concatenar fragmentos; lo que depende de la hora (abierto/cerrado)
+se agrega al momento.
+
+La caché completa se descarta cuando cambia la versión de las etiquetas
+Negocio/HorarioAtencion/ProductoNegocio/PerfilNegocio de la caché de consultas, que
+chatbot/signals.py incrementa en cada escritura; así también se enteran los
+demás workers.
+"""
+import logging
+import threading
+
+from .query_cache import cache_consultas, etiqueta
+
+logger = logging.getLogger('chatbot')
+
+# Productos que se pre-renderizan por negocio (el contexto usa 5 u 8)
+MAX_PRODUCTOS = 8
+
+
+def resumir_horarios(horarios, dias):
+    """Agrupar días consecutivos con el mismo horario: 'lunes a viernes 08:00 AM-06:00 PM'"""
+    por_dia = {h.dia_semana: h for h in horarios}
+
+    tramos = []
+    for i, dia in enumerate(dias):
+        h = por_dia.get(dia)
+        if h is None:
+            continue
+        if h.cerrado:
+            texto = "cerrado"
+        else:
+            texto = f"{h.hora_apertura.strftime('%I:%M %p')}-{h.hora_cierre.strftime('%I:%M %p')}"
+            if h.notas:
+                texto += f" ({h.notas})"
+        if tramos and tramos[-1][2] == texto and tramos[-1][3] == i - 1:
+            tramos[-1][1] = dia
+            tramos[-1][3] = i
+        else:
+            tramos.append([dia, dia, texto, i])
+
+    return "; ".join(
+        f"{inicio} {texto}" if inicio == fin else f"{inicio} a {fin} {texto}"
+        for inicio, fin, texto, _ in tramos
+    )
+
+
+def renderizar_producto(producto, con_descripcion=True):
+    texto = f"{producto.nombre} {producto.get_precio_display()}"
+    if producto.destacado:
+        texto += " (destacado)"
+    if con_descripcion and producto.descripcion:
+        texto += f" - {producto.descripcion[:60]}"
+    return texto
+
+
+class FragmentosNegocio:
+    """Textos ya renderizados de un negocio"""
+
+    __slots__ = ('resumen', 'ubicacion', 'horario', 'perfil', 'productos')
+
+    def __init__(self, negocio, horarios, productos, dias, perfil=None):
+        titulo = f"- {negocio.nombre}"
+        if negocio.verificado:
+            titulo += " (verificado)"
+        if negocio.categoria:
+            titulo += f" | {negocio.categoria}"
+        direccion = negocio.direccion + (f", {negocio.barrio}" if negocio.barrio else "")
+        self.resumen = f"{titulo}\n  Dirección: {direccion} | Tel: {negocio.telefono or 'sin teléfono'}"
+
+        ubicacion = []
+        if negocio.referencia_ubicacion:
+            ubicacion.append(f"  Referencia: {negocio.referencia_ubicacion}")
+        if negocio.latitud and negocio.longitud:
+            ubicacion.append(f"  Coordenadas: {negocio.latitud}, {negocio.longitud} (se puede enviar la ubicación)")
+        self.ubicacion = "\n".join(ubicacion)
+
+        self.horario = f"  Horario: {resumir_horarios(horarios, dias)}" if horarios else ""
+        # Con perfil, las descripciones de productos ya están resumidas en él
+        self.perfil = f"  Perfil: {perfil}" if perfil else ""
+        self.productos = [renderizar_producto(p, con_descripcion=not perfil) for p in productos[:MAX_PRODUCTOS]]
+
+    def menu(self, limit):
+        """Línea de productos con los primeros `limit`"""
+        if not self.productos:
+            return ""
+        return "  Productos: " + "; ".join(self.productos[:limit])
+
+
+class CacheFragmentos:
+
+    def __init__(self):
+        self._datos = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidar(self):
+        with self._lock:
+            self._datos = {}
+
+    def _etiquetas(self):
+        from ..models import Negocio, HorarioAtencion, ProductoNegocio, PerfilNegocio
+        return tuple(etiqueta(m) for m in (Negocio, HorarioAtencion, ProductoNegocio, PerfilNegocio))
+
+    def obtener(self, negocio_ids):
+        """
+        Fragmentos de varios negocios; los que falten se construyen juntos
+        (cuatro consultas en total)
+
+        Returns:
+            Dict {negocio_id: FragmentosNegocio} (sin los negocios inexistentes)
+        """
+        version = cache_consultas.versiones(self._etiquetas())
+        with self._lock:
+            if version != self._version:
+                self._datos = {}
+                self._version = version
+            datos = self._datos
+
+        faltantes = [i for i in negocio_ids if i not in datos]
+        if faltantes:
+            nuevos = self._construir(faltantes)
+            with self._lock:
+                if self._version == version:
+                    self._datos.update(nuevos)
+            datos = {**datos, **nuevos}
+
+        return {i: datos[i] for i in negocio_ids if i in datos}
+
+    def _construir(self, negocio_ids):
+        from ..models import Negocio, HorarioAtencion, ProductoNegocio, PerfilNegocio
+
+        dias = [d for d, _ in HorarioAtencion.DIAS_SEMANA]
+        negocios = Negocio.objects.in_bulk(negocio_ids)
+
+        horarios = {}
+        for h in HorarioAtencion.objects.filter(negocio_id__in=negocio_ids):
+            horarios.setdefault(h.negocio_id, []).append(h)
+
+        productos = {}
+        filas = ProductoNegocio.objects.filter(
+            negocio_id__in=negocio_ids, activo=True, disponible=True
+        ).order_by('negocio_id', '-destacado', 'orden', 'nombre')
+        for p in filas:
+            lista = productos.setdefault(p.negocio_id, [])
+            if len(lista) < MAX_PRODUCTOS:
+                lista.append(p)
+
+        perfiles = dict(
+            PerfilNegocio.objects.filter(negocio_id__in=negocio_ids).values_list('negocio_id', 'texto')
+        )
+
+        fragmentos = {
+            negocio_id: FragmentosNegocio(
+                negocio, horarios.get(negocio_id, []), productos.get(negocio_id, []), dias,
+                perfil=perfiles.get(negocio_id)
+            )
+            for negocio_id, negocio in negocios.items()
+        }
+        logger.debug(f"Fragmentos de contexto renderizados: {len(fragmentos)} negocios")
+        return fragmentos
+
+
+fragmentos_negocio = CacheFragmentos()
@@ -2,14 +2,23 @@
 Servicio MEJORADO para consultar la base de datos de Negocios
 """
 import logging
+from django.conf import settings
 from django.db import connection
 from django.db.models import Q, Count, Sum, Avg
-from datetime import datetime, time
+from django.utils import timezone
+from datetime import datetime, time, timedelta
 from ..models import (
     Negocio, HorarioAtencion, ProductoNegocio, CategoriaNegocio, ResenaNegocio,
-    EventoDeportivo,
+    ResumenCalificacion, EventoDeportivo,
     Cliente, Producto, Pedido, DetallePedido
 )
+from .search_index import indice_catalogo, normalizar_texto
+from .gazetteer import gazetteer
+from .horarios_index import indice_horarios
+from .geo_index import indice_geografico
+from .ranking import RankingService, tabla_atributos
+from .query_cache import cacheado, no_cachear, vence_en
+from .identity_map import por_mensaje, mapa_actual
 
 logger = logging.getLogger('chatbot')
 
@@ -20,6 +29,8 @@ class DatabaseService:
     # ==================== MÉTODOS PARA NEGOCIOS ====================
     
     @staticmethod
+    @por_mensaje
+    @cacheado(Negocio)
     def buscar_negocios(query=None, categoria=None, ciudad='Quibdó', activos=True, limit=1000):
         """
         Buscar negocios por nombre, categoría o ciudad
@@ -30,11 +41,13 @@ class DatabaseService:
             if activos:
                 negocios = negocios.filter(activo=True)
             
+            # Igualdad (no icontains) para usar negocios_activo_ciudad_idx; la
+            # colación _ci de MySQL ya ignora mayúsculas y tildes
             if ciudad:
-                negocios = negocios.filter(ciudad__icontains=ciudad)
+                negocios = negocios.filter(ciudad=ciudad)
             
             if categoria:
-                negocios = negocios.filter(categoria__icontains=categoria)
+                negocios = negocios.filter(categoria=categoria)
             
             if query:
                 negocios = negocios.filter(
@@ -46,21 +59,158 @@ class DatabaseService:
             
             return negocios.order_by('-verificado', 'nombre')[:limit]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error buscando negocios: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    def buscar_negocios_rankeados(query=None, categoria=None, ciudad='Quibdó', ubicacion=None,
+                                  texto=None, limit=5, pesos=None):
+        """
+        Buscar negocios y ordenarlos por relevancia, apertura, calificación,
+        verificación, cercanía y productos disponibles
+
+        Args:
+            ubicacion: Tupla (latitud, longitud) del usuario, si se conoce
+            texto: Texto para la relevancia (por defecto, query)
+            pesos: Pesos que sobrescriben settings.RANKING_WEIGHTS
+        """
+        try:
+            candidatos = DatabaseService.buscar_negocios(
+                query=query,
+                categoria=categoria,
+                ciudad=ciudad,
+                limit=settings.RANKING_CANDIDATES
+            )
+            return RankingService(pesos).rankear(
+                candidatos,
+                texto=texto or query or categoria,
+                ubicacion=ubicacion,
+                limit=limit
+            )
+        except Exception as e:
+            logger.error(f"Error rankeando negocios: {e}")
+            return []
+
+    @staticmethod
+    @por_mensaje
+    def buscar_negocios_difuso(texto, umbral=None, limit=5):
+        """
+        Buscar negocios tolerando errores de escritura ("pandería", "drogeria")
+        usando el índice de trigramas en memoria
+        """
+        try:
+            coincidencias = indice_catalogo.buscar_palabras(texto, umbral=umbral)
+
+            # Conservar el orden por similitud, sin repetir negocios
+            negocio_ids = []
+            for coincidencia in coincidencias:
+                for negocio_id in sorted(coincidencia['negocio_ids']):
+                    if negocio_id not in negocio_ids:
+                        negocio_ids.append(negocio_id)
+            negocio_ids = negocio_ids[:limit]
+
+            if not negocio_ids:
+                return []
+
+            negocios = Negocio.objects.in_bulk(negocio_ids)
+            return [negocios[i] for i in negocio_ids if i in negocios and negocios[i].activo]
+        except Exception as e:
+            logger.error(f"Error en búsqueda difusa de negocios: {e}")
+            return []
+
+    @staticmethod
+    @por_mensaje
+    def sugerir_correcciones(texto, umbral=None):
+        """
+        Sugerencias tipo "¿quisiste decir...?" para palabras del mensaje que
+        no coinciden exactamente con el catálogo
+
+        Returns:
+            Lista de dicts con 'palabra', 'sugerencia', 'similitud' y 'tipo'
+        """
+        try:
+            sugerencias = []
+            vistas = set()
+            for coincidencia in indice_catalogo.buscar_palabras(texto, umbral=umbral):
+                palabra = coincidencia['palabra']
+                sugerencia = coincidencia['sugerencia']
+                if palabra in vistas:
+                    continue
+                vistas.add(palabra)
+                # Coincidencia exacta: no hay nada que corregir
+                if normalizar_texto(sugerencia) == palabra:
+                    continue
+                sugerencias.append({
+                    'palabra': palabra,
+                    'sugerencia': sugerencia,
+                    'similitud': coincidencia['similitud'],
+                    'tipo': coincidencia['tipo'],
+                })
+            return sugerencias
+        except Exception as e:
+            logger.error(f"Error sugiriendo correcciones: {e}")
+            return []
+
+    @staticmethod
+    @por_mensaje
+    def detectar_entidades(texto):
+        """
+        Detectar barrios, nombres de negocios y referencias mencionados en el
+        texto con un solo recorrido del gazetteer (sin consultar la BD)
+
+        Returns:
+            Lista de dicts con 'tipo', 'texto', 'valor', 'inicio' y 'fin'
+        """
+        try:
+            return gazetteer.buscar(texto)
+        except Exception as e:
+            logger.error(f"Error detectando entidades: {e}")
+            return []
+
+    @staticmethod
+    @por_mensaje
+    def obtener_negocios_mencionados(texto, limit=5):
+        """Obtener los negocios cuyo nombre o referencia aparece en el texto"""
+        try:
+            negocio_ids = []
+            for mencion in gazetteer.buscar(texto):
+                if mencion['tipo'] in ('negocio', 'referencia') and mencion['valor'] not in negocio_ids:
+                    negocio_ids.append(mencion['valor'])
+            negocio_ids = negocio_ids[:limit]
+
+            if not negocio_ids:
+                return []
+
+            negocios = Negocio.objects.in_bulk(negocio_ids)
+            return [negocios[i] for i in negocio_ids if i in negocios and negocios[i].activo]
+        except Exception as e:
+            logger.error(f"Error obteniendo negocios mencionados: {e}")
+            return []
+
+    @staticmethod
+    @por_mensaje
+    @cacheado(Negocio)
     def obtener_negocio_por_id(negocio_id):
         """Obtener negocio específico por ID"""
         try:
+            # Reutilizar el negocio si otra consulta de este mensaje ya lo cargó
+            mapa = mapa_actual()
+            negocio = mapa.instancia(Negocio, negocio_id) if mapa else None
+            if negocio is not None and negocio.activo:
+                return negocio
             return Negocio.objects.get(id=negocio_id, activo=True)
         except Negocio.DoesNotExist:
             return None
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo negocio: {e}")
             return None
     
     @staticmethod
+    @por_mensaje
+    @cacheado(Negocio)
     def obtener_negocio_por_nombre(nombre):
         """Buscar negocio por nombre exacto o similar"""
         try:
@@ -81,61 +231,48 @@ class DatabaseService:
             
             return negocio
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo negocio por nombre: {e}")
             return None
     
     @staticmethod
+    @por_mensaje
+    @cacheado(HorarioAtencion)
     def obtener_horarios_negocio(negocio_id):
         """Obtener horarios de atención de un negocio"""
         try:
             return HorarioAtencion.objects.filter(negocio_id=negocio_id).order_by('dia_semana')
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo horarios: {e}")
             return []
     
     @staticmethod
-    def verificar_negocio_abierto(negocio_id):
-        """Verificar si un negocio está abierto en el momento actual"""
+    @por_mensaje
+    def verificar_negocio_abierto(negocio_id, momento=None):
+        """
+        Verificar si un negocio está abierto en el momento actual (hora de
+        Bogotá), incluyendo horarios que cierran después de medianoche
+        """
         try:
-            dias_map = {
-                0: 'lunes', 1: 'martes', 2: 'miercoles', 3: 'jueves',
-                4: 'viernes', 5: 'sabado', 6: 'domingo'
-            }
-            
-            ahora = datetime.now()
-            dia_actual = dias_map[ahora.weekday()]
-            hora_actual = ahora.time()
-            
-            horario = HorarioAtencion.objects.filter(
-                negocio_id=negocio_id,
-                dia_semana=dia_actual
-            ).first()
-            
-            if not horario:
-                return {'abierto': None, 'mensaje': 'No hay información de horario para hoy'}
-            
-            if horario.cerrado:
-                return {'abierto': False, 'mensaje': f'Cerrado los {dia_actual}s'}
-            
-            abierto = horario.hora_apertura <= hora_actual <= horario.hora_cierre
-            
-            if abierto:
-                return {
-                    'abierto': True,
-                    'mensaje': f'Abierto hasta las {horario.hora_cierre.strftime("%I:%M %p")}',
-                    'horario': horario
-                }
-            else:
-                return {
-                    'abierto': False,
-                    'mensaje': f'Abre a las {horario.hora_apertura.strftime("%I:%M %p")}',
-                    'horario': horario
-                }
+            return indice_horarios.estado(negocio_id, momento)
         except Exception as e:
             logger.error(f"Error verificando apertura: {e}")
             return {'abierto': None, 'mensaje': 'Error al verificar horario'}
     
     @staticmethod
+    @por_mensaje
+    def obtener_proxima_apertura(negocio_id, momento=None):
+        """Fecha y hora de la próxima apertura de un negocio"""
+        try:
+            return indice_horarios.proxima_apertura(negocio_id, momento)
+        except Exception as e:
+            logger.error(f"Error calculando próxima apertura: {e}")
+            return None
+    
+    @staticmethod
+    @por_mensaje
+    @cacheado(ProductoNegocio)
     def obtener_productos_negocio(negocio_id, disponibles=True, limit=1000):
         """Obtener productos/servicios de un negocio"""
         try:
@@ -149,10 +286,13 @@ class DatabaseService:
             
             return productos.order_by('-destacado', 'orden', 'nombre')[:limit]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo productos: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(ProductoNegocio)
     def buscar_productos_negocio(negocio_id, query):
         """Buscar productos específicos en un negocio"""
         try:
@@ -166,10 +306,13 @@ class DatabaseService:
                 Q(categoria__icontains=query)
             )
         except Exception as e:
+            no_cachear()
             logger.error(f"Error buscando productos: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(ProductoNegocio, Negocio)
     def buscar_productos_globalmente(query, limit=20):
         """Buscar productos en todos los negocios"""
         try:
@@ -181,10 +324,13 @@ class DatabaseService:
                 disponible=True
             ).select_related('negocio').order_by('-destacado', 'nombre')[:limit]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error buscando productos globalmente: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(CategoriaNegocio, Negocio)
     def obtener_categorias_negocios():
         """Obtener lista de categorías de negocios"""
         try:
@@ -201,10 +347,13 @@ class DatabaseService:
             
             return [c for c in categorias if c]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo categorías: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(ResenaNegocio)
     def obtener_resenas_negocio(negocio_id, aprobadas=True, limit=1000):
         """Obtener reseñas de un negocio"""
         try:
@@ -215,23 +364,46 @@ class DatabaseService:
             
             return resenas.order_by('-fecha')[:limit]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo reseñas: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(ResumenCalificacion)
     def obtener_calificacion_promedio(negocio_id):
-        """Obtener calificación promedio de un negocio"""
+        """Obtener calificación promedio de un negocio (desde el resumen materializado)"""
         try:
-            resultado = ResenaNegocio.objects.filter(
-                negocio_id=negocio_id,
-                aprobado=True
-            ).aggregate(Avg('calificacion'))
-            
-            return resultado['calificacion__avg']
+            resumen = ResumenCalificacion.objects.filter(negocio_id=negocio_id).first()
+            return resumen.promedio if resumen else None
         except Exception as e:
+            no_cachear()
             logger.error(f"Error calculando calificación: {e}")
             return None
     
+    @staticmethod
+    def obtener_calificaciones(negocio_ids):
+        """
+        Promedio y cantidad de reseñas de varios negocios, sin consultar la BD
+        (tabla de atributos del ranking)
+        
+        Returns:
+            Dict {negocio_id: (promedio, total)} solo con los negocios con reseñas
+        """
+        try:
+            tabla = tabla_atributos.obtener()
+            calificaciones = {}
+            for negocio_id in negocio_ids:
+                fila = tabla.get(negocio_id)
+                if fila and fila['resenas']:
+                    calificaciones[negocio_id] = (
+                        round(fila['suma_calificaciones'] / fila['resenas'], 1), fila['resenas']
+                    )
+            return calificaciones
+        except Exception as e:
+            logger.error(f"Error obteniendo calificaciones: {e}")
+            return {}
+    
     @staticmethod
     def crear_resena(negocio_id, telefono_cliente, calificacion, comentario='', nombre_cliente=''):
         """Crear una nueva reseña"""
@@ -251,10 +423,12 @@ class DatabaseService:
             return None
     
     @staticmethod
+    @por_mensaje
+    @cacheado(Negocio, ProductoNegocio, ResumenCalificacion)
     def obtener_estadisticas_negocio(negocio_id):
         """Obtener estadísticas completas de un negocio"""
         try:
-            negocio = Negocio.objects.get(id=negocio_id)
+            negocio = Negocio.objects.select_related('resumen_calificacion').get(id=negocio_id)
             
             # Cantidad de productos
             total_productos = ProductoNegocio.objects.filter(
@@ -262,35 +436,27 @@ class DatabaseService:
                 activo=True
             ).count()
             
-            # Cantidad de reseñas
-            total_resenas = ResenaNegocio.objects.filter(
-                negocio_id=negocio_id,
-                aprobado=True
-            ).count()
-            
-            # Calificación promedio
-            calificacion_promedio = DatabaseService.obtener_calificacion_promedio(negocio_id)
-            
-            # Distribución de calificaciones
-            distribucion = ResenaNegocio.objects.filter(
-                negocio_id=negocio_id,
-                aprobado=True
-            ).values('calificacion').annotate(
-                cantidad=Count('id')
-            ).order_by('-calificacion')
+            # Reseñas: conteo, promedio y distribución salen del resumen materializado
+            try:
+                resumen = negocio.resumen_calificacion
+            except ResumenCalificacion.DoesNotExist:
+                resumen = ResumenCalificacion(negocio=negocio)
             
             return {
                 'negocio': negocio,
                 'total_productos': total_productos,
-                'total_resenas': total_resenas,
-                'calificacion_promedio': calificacion_promedio,
-                'distribucion_calificaciones': list(distribucion)
+                'total_resenas': resumen.total,
+                'calificacion_promedio': resumen.promedio,
+                'distribucion_calificaciones': resumen.distribucion()
             }
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo estadísticas: {e}")
             return None
     
     @staticmethod
+    @por_mensaje
+    @cacheado(Negocio)
     def buscar_negocios_cercanos(barrio=None, referencia=None, limit=1000):
         """Buscar negocios por ubicación aproximada"""
         try:
@@ -307,10 +473,48 @@ class DatabaseService:
             
             return negocios.order_by('-verificado', 'nombre')[:limit]
         except Exception as e:
+            no_cachear()
             logger.error(f"Error buscando negocios cercanos: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
+    def buscar_negocios_mas_cercanos(latitud, longitud, k=5, categoria=None, abiertos=False, radio_max_km=None):
+        """
+        Buscar los k negocios más cercanos a unas coordenadas
+
+        Returns:
+            Lista de tuplas (negocio, distancia_km) ordenada por distancia
+        """
+        try:
+            return indice_geografico.mas_cercanos(
+                float(latitud), float(longitud), k=k,
+                categoria=categoria, abiertos=abiertos, radio_max_km=radio_max_km
+            )
+        except Exception as e:
+            logger.error(f"Error buscando negocios más cercanos: {e}")
+            return []
+    
+    @staticmethod
+    @por_mensaje
+    def buscar_negocios_en_radio(latitud, longitud, radio_km, categoria=None, abiertos=False):
+        """
+        Buscar negocios dentro de un radio (en km) alrededor de unas coordenadas
+
+        Returns:
+            Lista de tuplas (negocio, distancia_km) ordenada por distancia
+        """
+        try:
+            return indice_geografico.en_radio(
+                float(latitud), float(longitud), radio_km,
+                categoria=categoria, abiertos=abiertos
+            )
+        except Exception as e:
+            logger.error(f"Error buscando negocios en radio: {e}")
+            return []
+    
+    @staticmethod
+    @por_mensaje
     def obtener_info_completa_negocio(negocio_id):
         """Obtener información completa de un negocio"""
         try:
@@ -340,72 +544,58 @@ class DatabaseService:
             return None
     
     @staticmethod
+    @por_mensaje
+    @cacheado(Negocio, HorarioAtencion)
     def obtener_negocios_abiertos_ahora(categoria=None):
         """Obtener lista de negocios que están abiertos en este momento"""
         try:
-            dias_map = {
-                0: 'lunes', 1: 'martes', 2: 'miercoles', 3: 'jueves',
-                4: 'viernes', 5: 'sabado', 6: 'domingo'
-            }
-            
-            ahora = datetime.now()
-            dia_actual = dias_map[ahora.weekday()]
-            hora_actual = ahora.time()
-            
-            # Obtener horarios de hoy
-            horarios_hoy = HorarioAtencion.objects.filter(
-                dia_semana=dia_actual,
-                cerrado=False,
-                hora_apertura__lte=hora_actual,
-                hora_cierre__gte=hora_actual
-            ).select_related('negocio')
-            
-            # Filtrar por categoría si se especifica
-            if categoria:
-                horarios_hoy = horarios_hoy.filter(
-                    negocio__categoria__icontains=categoria
-                )
-            
-            # Extraer negocios únicos
-            negocios_abiertos = []
-            negocios_ids = set()
-            
-            for horario in horarios_hoy:
-                if horario.negocio.activo and horario.negocio.id not in negocios_ids:
-                    negocios_abiertos.append(horario.negocio)
-                    negocios_ids.add(horario.negocio.id)
-            
-            return negocios_abiertos
+            ahora = timezone.now()
+            # La lista vale hasta que algún negocio abra o cierre
+            cambio = indice_horarios.proximo_cambio(ahora)
+            if cambio is not None:
+                vence_en(cambio)
+            return indice_horarios.abiertos(categoria=categoria, momento=ahora)
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo negocios abiertos: {e}")
             return []
     
     # ==================== MÉTODOS PARA EVENTOS DEPORTIVOS ====================
     
     @staticmethod
+    @por_mensaje
+    @cacheado(EventoDeportivo)
     def obtener_eventos_proximos(dias=7, tipo_evento=None, limit=10):
         """Obtener eventos deportivos próximos"""
         try:
-            from datetime import datetime, timedelta
-            
-            ahora = datetime.now()
-            fecha_limite = ahora + timedelta(days=dias)
+            ahora = timezone.now()
+            ventana = timedelta(days=dias)
             
             eventos = EventoDeportivo.objects.filter(
                 activo=True,
-                fecha_evento__gte=ahora,
-                fecha_evento__lte=fecha_limite
+                fecha_evento__gte=ahora
             )
             
             if tipo_evento:
                 eventos = eventos.filter(tipo_evento__icontains=tipo_evento)
             
-            return eventos.order_by('fecha_evento')[:limit]
+            # Un evento de más (sin tope de fecha en SQL) dice cuándo cambia la lista:
+            # cuando empieza el primero o cuando el siguiente entra en la ventana
+            siguientes = list(eventos.order_by('fecha_evento')[:limit + 1])
+            resultado = [e for e in siguientes[:limit] if e.fecha_evento <= ahora + ventana]
+            
+            if resultado:
+                vence_en(resultado[0].fecha_evento)
+            if len(resultado) < limit and len(siguientes) > len(resultado):
+                vence_en(siguientes[len(resultado)].fecha_evento - ventana)
+            return resultado
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo eventos próximos: {e}")
             return []
     
     @staticmethod
+    @por_mensaje
     def buscar_eventos(query=None, tipo_evento=None, limit=10):
         """Buscar eventos deportivos"""
         try:
@@ -434,6 +624,8 @@ class DatabaseService:
             return []
     
     @staticmethod
+    @por_mensaje
+    @cacheado(EventoDeportivo)
     def obtener_evento_por_id(evento_id):
         """Obtener evento específico por ID"""
         try:
@@ -441,6 +633,7 @@ class DatabaseService:
         except EventoDeportivo.DoesNotExist:
             return None
         except Exception as e:
+            no_cachear()
             logger.error(f"Error obteniendo evento: {e}")
             return None
     
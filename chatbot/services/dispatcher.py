@@ -0,0 +1,529 @@
+"""
+Despachador de mensajes salientes
+
+Antes, un envío fallido (incluido un 429 por límite de tasa) devolvía None y
+la respuesta se perdía sin dejar rastro. Ahora cada respuesta se guarda
+primero como Message saliente con status='pending' y un message_id
+provisional, y el despachador la envía desde una cola:
+
+- Un cubo de tokens limita el ritmo de envío del número (OUTBOUND_RATE_PER_SECOND).
+- Ante límites de tasa (HTTP 429, códigos 130429, 131056 y 80007) respeta
+  Retry-After o espera con backoff exponencial y reintenta.
+- Reintenta los errores transitorios (5xx, servicio no disponible) solo si
+  es seguro: con un timeout de lectura Meta pudo haber aceptado el mensaje y
+  reintentar lo duplicaría.
+- Registra el resultado en Message.status/error_message; el webhook de
+  estados (sent/delivered/read/failed) lo sigue actualizando después.
+
+Los mensajes de un mismo destinatario van siempre a la misma cola, así que
+salen en orden. Las partes de una respuesta larga (services/reply_segmenter.py)
+se encolan juntas y se envían una tras otra por la misma conexión; si una
+falla, las siguientes no se envían. El cubo es por proceso: con varios
+workers, reparte el límite del número entre ellos.
+
+Los hilos de las colas no duermen para reintentar: un envío que debe esperar
+(backoff o límite por usuario) se aparta con su momento de reintento y el
+hilo sigue con los demás destinatarios de su cola; los mensajes posteriores
+del mismo destinatario quedan retenidos detrás para conservar el orden.
+
+La cola vive en memoria: lo que estaba encolado cuando el proceso se reinició
+o se cayó queda en status='pending'. El comando `recuperar_salientes` (para
+correr periódicamente) reenvía o marca como fallidas esas respuestas.
+"""
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .reply_segmenter import segmentar
+from .whatsapp_service import WhatsAppService
+
+logger = logging.getLogger('chatbot')
+
+# Límites de tasa de la Graph API: 130429 rendimiento del número,
+# 131056 demasiados mensajes al mismo usuario, 80007 límite de la cuenta
+CODIGOS_LIMITE_TASA = {4, 80007, 130429, 131056}
+# Errores temporales del lado de Meta
+CODIGOS_TRANSITORIOS = {1, 2, 131000, 131016}
+
+PREFIJO_PROVISIONAL = 'pendiente-'
+
+
+def id_provisional():
+    """message_id único para el Message saliente mientras no tiene el wamid de Meta"""
+    return f"{PREFIJO_PROVISIONAL}{uuid.uuid4().hex}"
+
+
+class CuboTokens:
+    """Cubo de tokens seguro entre hilos, con pausa global para Retry-After"""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def pausar(self, segundos):
+        with self._lock:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+
+    def esperar(self):
+        """Bloquear hasta poder enviar un mensaje"""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                if ahora < self._pausa_hasta:
+                    espera = self._pausa_hasta - ahora
+                else:
+                    self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                    self._ultimo = ahora
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+class EnvioSaliente:
+    """
+    Un mensaje por enviar: el Message ya guardado y su payload
+
+    `siguiente` encadena la parte que sigue de una respuesta dividida.
+    """
+
+    __slots__ = ('message_pk', 'destinatario', 'payload', 'intentos', 'siguiente')
+
+    def __init__(self, message_pk, destinatario, payload, siguiente=None):
+        self.message_pk = message_pk
+        self.destinatario = destinatario
+        self.payload = payload
+        self.intentos = 0
+        self.siguiente = siguiente
+
+
+class DespachadorSalida:
+    """
+    Args:
+        tasa, rafaga: Ritmo del cubo de tokens (por defecto, OUTBOUND_RATE_PER_SECOND/OUTBOUND_BURST)
+        asincrono: Enviar desde colas en hilos de fondo (por defecto, OUTBOUND_DISPATCH_ASYNC)
+    """
+
+    def __init__(self, tasa=None, rafaga=None, asincrono=None):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.asincrono = asincrono
+        self._colas = None
+        self._retenidos = []     # por cola: envíos apartados a la espera de su reintento
+        self._cubo = None
+        self._whatsapp = None
+        self._lock = threading.Lock()
+        self._no_antes_de = {}   # destinatario -> momento (límite por usuario, 131056)
+
+    def _iniciar(self):
+        with self._lock:
+            if self._colas is not None:
+                return
+            self._cubo = CuboTokens(
+                self.tasa or settings.OUTBOUND_RATE_PER_SECOND,
+                self.rafaga or settings.OUTBOUND_BURST
+            )
+            self._whatsapp = WhatsAppService()
+            asincrono = settings.OUTBOUND_DISPATCH_ASYNC if self.asincrono is None else self.asincrono
+            colas = []
+            if asincrono:
+                self._retenidos = [0] * settings.OUTBOUND_WORKERS
+                for i in range(settings.OUTBOUND_WORKERS):
+                    cola = queue.Queue()
+                    hilo = threading.Thread(
+                        target=self._trabajar, args=(cola, i), name=f'despachador-{i}', daemon=True
+                    )
+                    hilo.start()
+                    colas.append(cola)
+            self._colas = colas
+
+    # ==================== ENCOLAR ====================
+
+    def encolar_texto(self, conversation, to_number, text, **campos):
+        """
+        Guardar la respuesta como pendiente y encolarla, dividida en partes
+        si supera el largo máximo de un mensaje
+
+        Returns:
+            Los Message salientes, uno por parte (status='pending' hasta que se
+            envíen); ninguno si el texto está vacío
+        """
+        from ..models import Message
+
+        partes = segmentar(text)
+        if not partes:
+            logger.warning(f"Respuesta vacía para {to_number}: no se envía")
+            return []
+        mensajes = [
+            Message.objects.create(
+                conversation=conversation,
+                message_id=id_provisional(),
+                direction='outgoing',
+                message_type='text',
+                content=parte,
+                status='pending',
+                parte=numero,
+                **campos
+            )
+            for numero, parte in enumerate(partes, 1)
+        ]
+
+        envio = None
+        for mensaje in reversed(mensajes):
+            envio = EnvioSaliente(
+                mensaje.pk, to_number, WhatsAppService.payload_texto(to_number, mensaje.content), siguiente=envio
+            )
+        transaction.on_commit(lambda: self.encolar_envio(envio))
+        return mensajes
+
+    def encolar(self, conversation, to_number, payload, content, message_type='text', **campos):
+        from ..models import Message
+
+        mensaje = Message.objects.create(
+            conversation=conversation,
+            message_id=id_provisional(),
+            direction='outgoing',
+            message_type=message_type,
+            content=content,
+            status='pending',
+            **campos
+        )
+        envio = EnvioSaliente(mensaje.pk, to_number, payload)
+        # El hilo de envío actualiza la fila: que exista para él antes de encolar
+        transaction.on_commit(lambda: self.encolar_envio(envio))
+        return mensaje
+
+    def encolar_envio(self, envio):
+        self._iniciar()
+        if not self._colas:
+            # Modo síncrono (OUTBOUND_DISPATCH_ASYNC=False): enviar en este hilo
+            self._procesar(envio)
+            return
+        self._colas[hash(envio.destinatario) % len(self._colas)].put(envio)
+
+    def pendientes(self):
+        """Envíos en cola (o apartados para reintentar) en este proceso"""
+        return sum(c.qsize() for c in self._colas or []) + sum(self._retenidos)
+
+    # ==================== RECUPERACIÓN ====================
+
+    def recuperar_pendientes(self, antiguedad, marcar_fallidos=False, simular=False):
+        """
+        Reenviar (o marcar como fallidas) las respuestas que siguen pendientes
+        con más de `antiguedad` (timedelta): su envío se perdió con el proceso
+
+        Cada fila se reclama cambiando su message_id provisional con un UPDATE
+        condicionado, así que dos recuperaciones simultáneas no la envían dos
+        veces. Solo los textos se pueden reconstruir; el resto se marca como
+        fallido. Si el proceso cayó justo después de que Meta aceptara el
+        mensaje, el reenvío lo duplica.
+
+        Returns:
+            Tupla (reencolados, fallidos)
+        """
+        from ..models import Message
+
+        pendientes = Message.objects.filter(
+            direction='outgoing',
+            status='pending',
+            message_id__startswith=PREFIJO_PROVISIONAL,
+            created_at__lt=timezone.now() - antiguedad,
+        ).select_related('conversation').order_by('conversation_id', 'created_at', 'pk')
+
+        reencolados = fallidos = 0
+        cadenas = []
+        ultimo = None
+        for mensaje in pendientes:
+            if simular:
+                if marcar_fallidos or mensaje.message_type != 'text':
+                    fallidos += 1
+                else:
+                    reencolados += 1
+                continue
+
+            reclamado = Message.objects.filter(
+                pk=mensaje.pk, message_id=mensaje.message_id, status='pending'
+            ).update(message_id=id_provisional())
+            if not reclamado:
+                continue
+
+            if marcar_fallidos or mensaje.message_type != 'text':
+                Message.objects.filter(pk=mensaje.pk).update(
+                    status='failed', error_message="No enviado: el proceso se detuvo antes del envío"
+                )
+                fallidos += 1
+                continue
+
+            envio = EnvioSaliente(
+                mensaje.pk, mensaje.conversation.phone_number,
+                WhatsAppService.payload_texto(mensaje.conversation.phone_number, mensaje.content)
+            )
+            # Las partes consecutivas de una misma respuesta se vuelven a encadenar
+            if (ultimo is not None and ultimo[0].conversation_id == mensaje.conversation_id
+                    and mensaje.parte == ultimo[0].parte + 1):
+                ultimo[1].siguiente = envio
+            else:
+                cadenas.append(envio)
+            ultimo = (mensaje, envio)
+            reencolados += 1
+
+        for envio in cadenas:
+            self.encolar_envio(envio)
+        if not simular and (reencolados or fallidos):
+            logger.warning(f"Salientes pendientes recuperados: {reencolados} reencolados, {fallidos} fallidos")
+        return reencolados, fallidos
+
+    # ==================== ENVÍO ====================
+
+    def _trabajar(self, cola, indice):
+        """
+        Hilo de una cola: los envíos que deben esperar no lo bloquean, se
+        apartan por destinatario en `retenidos` y se agenda su reintento
+        """
+        agenda = []        # heap de (momento, turno, destinatario)
+        turno = itertools.count()
+        retenidos = {}     # destinatario -> deque de envíos, el primero es el apartado
+
+        def despachar(destinatario, envios):
+            while envios:
+                envio = envios.popleft()
+                try:
+                    close_old_connections()
+                    pendiente = self._procesar(envio, diferir=True)
+                except Exception as e:
+                    logger.error(f"Error en el despachador de salida: {e}", exc_info=True)
+                    continue
+                finally:
+                    close_old_connections()
+                if pendiente is not None:
+                    espera, resto = pendiente
+                    envios.appendleft(resto)
+                    retenidos[destinatario] = envios
+                    heapq.heappush(agenda, (time.monotonic() + espera, next(turno), destinatario))
+                    break
+            self._retenidos[indice] = sum(len(e) for e in retenidos.values())
+
+        while True:
+            while agenda and agenda[0][0] <= time.monotonic():
+                _, _, destinatario = heapq.heappop(agenda)
+                despachar(destinatario, retenidos.pop(destinatario))
+
+            try:
+                envio = cola.get(timeout=max(0, agenda[0][0] - time.monotonic()) if agenda else None)
+            except queue.Empty:
+                continue
+            try:
+                if envio.destinatario in retenidos:
+                    retenidos[envio.destinatario].append(envio)
+                    self._retenidos[indice] += 1
+                else:
+                    despachar(envio.destinatario, deque([envio]))
+            finally:
+                cola.task_done()
+
+    def _procesar(self, envio, diferir=False):
+        """
+        Enviar y registrar el resultado en el Message; las partes encadenadas
+        salen en orden, cada una apenas Meta acepta la anterior
+
+        Con `diferir`, en lugar de dormir hasta el reintento se devuelve lo
+        que falta por enviar.
+
+        Returns:
+            None si la cadena terminó, o (segundos, envío) para reintentar
+        """
+        while envio is not None:
+            if diferir:
+                espera = self._espera_destinatario(envio.destinatario)
+                if espera > 0:
+                    return espera, envio
+                resultado, espera = self._intentar(envio)
+                if espera is not None:
+                    return espera, envio
+            else:
+                resultado = self.enviar_con_reintentos(envio)
+
+            if resultado.ok:
+                self._registrar(envio, 'sent', message_id=resultado.message_id)
+                envio = envio.siguiente
+                continue
+
+            self._registrar(envio, 'failed', error=f"{resultado.error} (intentos: {envio.intentos})")
+            # Sin la parte anterior, las siguientes llegarían fuera de contexto
+            restante = envio.siguiente
+            while restante is not None:
+                self._registrar(restante, 'failed', error="No enviado: falló una parte anterior de la respuesta")
+                restante = restante.siguiente
+            return None
+        return None
+
+    def enviar_con_reintentos(self, envio):
+        """
+        Enviar respetando el ritmo y reintentando hasta tener un resultado
+        definitivo; duerme entre intentos (seguro para llamar desde varios hilos)
+
+        Returns:
+            ResultadoEnvio del último intento
+        """
+        self._iniciar()
+        while True:
+            espera = self._espera_destinatario(envio.destinatario)
+            if espera > 0:
+                time.sleep(espera)
+
+            resultado, espera = self._intentar(envio)
+            if espera is None:
+                return resultado
+            time.sleep(espera)
+
+    def _intentar(self, envio):
+        """
+        Un intento de envío respetando el ritmo
+
+        Returns:
+            Tupla (ResultadoEnvio, segundos antes de reintentar o None si es definitivo)
+        """
+        self._cubo.esperar()
+
+        envio.intentos += 1
+        resultado = self._whatsapp.enviar(envio.payload)
+        if resultado.ok:
+            logger.info(f"Mensaje enviado: {resultado.message_id} (intentos: {envio.intentos})")
+            return resultado, None
+
+        espera = self._espera_reintento(envio, resultado)
+        if espera is None or envio.intentos > settings.OUTBOUND_MAX_RETRIES:
+            logger.error(f"Envío a {envio.destinatario} fallido: {resultado.error}")
+            return resultado, None
+
+        logger.warning(
+            f"Envío a {envio.destinatario} reintentado en {espera:.1f} s "
+            f"(intento {envio.intentos}): {resultado.error}"
+        )
+        return resultado, espera
+
+    def _espera_destinatario(self, destinatario):
+        """Segundos que faltan para poder escribirle (límite por usuario); las entradas vencidas se descartan"""
+        with self._lock:
+            momento = self._no_antes_de.get(destinatario)
+            if momento is None:
+                return 0
+            espera = momento - time.monotonic()
+            if espera <= 0:
+                del self._no_antes_de[destinatario]
+                return 0
+            return espera
+
+    def _espera_reintento(self, envio, resultado):
+        """Segundos antes de reintentar, o None si el error es definitivo"""
+        backoff = min(
+            settings.OUTBOUND_BACKOFF_MAX,
+            settings.OUTBOUND_BACKOFF_BASE * 2 ** (envio.intentos - 1)
+        ) * random.uniform(0.8, 1.2)
+
+        codigos = {resultado.codigo, resultado.subcodigo}
+        if resultado.status_code == 429 or codigos & CODIGOS_LIMITE_TASA:
+            espera = resultado.retry_after or backoff
+            if 131056 in codigos:
+                # Límite por usuario: solo se frena a este destinatario
+                with self._lock:
+                    self._no_antes_de[envio.destinatario] = time.monotonic() + espera
+            else:
+                self._cubo.pausar(espera)
+            return espera
+
+        if not resultado.entregado_a_meta:
+            return backoff
+        if resultado.status_code is None:
+            # Timeout o conexión cortada tras enviar: reintentar podría duplicar
+            return None
+        if resultado.status_code >= 500 or codigos & CODIGOS_TRANSITORIOS:
+            # Meta respondió con error: el mensaje no se aceptó
+            return resultado.retry_after or backoff
+        return None
+
+    def _registrar(self, envio, status, message_id=None, error=None):
+        from ..models import Message
+
+        campos = {'status': status, 'error_message': error}
+        if message_id:
+            campos['message_id'] = message_id
+        try:
+            Message.objects.filter(pk=envio.message_pk).update(**campos)
+        except Exception as e:
+            logger.error(f"Error registrando el resultado del envío {envio.message_pk}: {e}")
+
+
+despachador = DespachadorSalida()
+
+
+# Orden de los estados que informa Meta: nunca se retrocede
+ORDEN_ESTADOS = {'pending': 0, 'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+def registrar_estados(statuses):
+    """
+    Aplicar los estados del webhook (value['statuses']) a los Message salientes
+    y a los envíos de campañas
+
+    Returns:
+        Cantidad de mensajes actualizados
+    """
+    from ..models import Message, EnvioCampana
+
+    por_id = {}
+    for estado in statuses:
+        if estado.get('id') and estado.get('status') in ORDEN_ESTADOS:
+            anterior = por_id.get(estado['id'])
+            if anterior is None or ORDEN_ESTADOS[estado['status']] >= ORDEN_ESTADOS[anterior['status']]:
+                por_id[estado['id']] = estado
+    if not por_id:
+        return 0
+
+    actualizados = 0
+    try:
+        for mensaje in Message.objects.filter(message_id__in=list(por_id), direction='outgoing'):
+            estado = por_id[mensaje.message_id]
+            if ORDEN_ESTADOS.get(mensaje.status, 0) >= ORDEN_ESTADOS[estado['status']]:
+                continue
+            mensaje.status = estado['status']
+            if estado['status'] == 'failed':
+                mensaje.error_message = _describir_errores(estado)
+            mensaje.save(update_fields=['status', 'error_message'])
+            actualizados += 1
+
+        for envio in EnvioCampana.objects.filter(message_id__in=list(por_id)):
+            estado = por_id[envio.message_id]
+            if ORDEN_ESTADOS.get(envio.estado, 0) >= ORDEN_ESTADOS[estado['status']]:
+                continue
+            envio.estado = estado['status']
+            if estado['status'] == 'failed':
+                envio.error = _describir_errores(estado)
+                envio.codigo_error = (estado.get('errors') or [{}])[0].get('code')
+            envio.save(update_fields=['estado', 'error', 'codigo_error', 'fecha_actualizacion'])
+            actualizados += 1
+    except Exception as e:
+        logger.error(f"Error registrando estados de entrega: {e}")
+    return actualizados
+
+
+def _describir_errores(estado):
+    return "; ".join(
+        f"código {e.get('code')}: {(e.get('error_data') or {}).get('details') or e.get('title', '')}"
+        for e in estado.get('errors') or [{}]
+    )
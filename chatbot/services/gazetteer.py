@@ -0,0 +1,156 @@
+"""
+Gazetteer de entidades del catálogo (barrios, nombres de negocios y referencias)
+
+Las entidades se compilan en un autómata Aho-Corasick sobre palabras, de modo
+que todas las menciones de un mensaje (incluidas las de varias palabras, como
+"Villa España") se encuentran en un solo recorrido y sin consultar la BD.
+"""
+import logging
+from collections import deque
+
+from .query_cache import IndiceVersionado
+from .search_index import extraer_palabras
+
+logger = logging.getLogger('chatbot')
+
+
+class AutomataEntidades:
+    """Autómata Aho-Corasick cuyo alfabeto son palabras normalizadas"""
+
+    def __init__(self):
+        self._transiciones = [{}]
+        self._fallos = [0]
+        self._salidas = [[]]
+        self._entidades = []   # [(tipo, texto, valor, cantidad_palabras)]
+        self._compilado = False
+
+    def __len__(self):
+        return len(self._entidades)
+
+    def agregar(self, tipo, texto, valor):
+        """Agregar una entidad; debe llamarse antes de compilar()"""
+        palabras = extraer_palabras(texto)
+        if not palabras:
+            return
+
+        estado = 0
+        for palabra in palabras:
+            siguiente = self._transiciones[estado].get(palabra)
+            if siguiente is None:
+                siguiente = len(self._transiciones)
+                self._transiciones.append({})
+                self._fallos.append(0)
+                self._salidas.append([])
+                self._transiciones[estado][palabra] = siguiente
+            estado = siguiente
+
+        self._salidas[estado].append(len(self._entidades))
+        self._entidades.append((tipo, texto.strip(), valor, len(palabras)))
+
+    def compilar(self):
+        """Calcular los enlaces de fallo (recorrido en anchura)"""
+        cola = deque()
+        for estado in self._transiciones[0].values():
+            self._fallos[estado] = 0
+            cola.append(estado)
+
+        while cola:
+            actual = cola.popleft()
+            for palabra, siguiente in self._transiciones[actual].items():
+                cola.append(siguiente)
+                fallo = self._fallos[actual]
+                while fallo and palabra not in self._transiciones[fallo]:
+                    fallo = self._fallos[fallo]
+                destino = self._transiciones[fallo].get(palabra, 0)
+                self._fallos[siguiente] = destino if destino != siguiente else 0
+                self._salidas[siguiente] = self._salidas[siguiente] + self._salidas[self._fallos[siguiente]]
+
+        self._compilado = True
+
+    def buscar(self, texto):
+        """
+        Encontrar todas las menciones de entidades en el texto
+
+        Returns:
+            Lista de dicts con 'tipo', 'texto', 'valor', 'inicio' y 'fin'
+            (posiciones en palabras, fin exclusivo)
+        """
+        if not self._compilado:
+            self.compilar()
+
+        menciones = []
+        estado = 0
+        for posicion, palabra in enumerate(extraer_palabras(texto)):
+            while estado and palabra not in self._transiciones[estado]:
+                estado = self._fallos[estado]
+            estado = self._transiciones[estado].get(palabra, 0)
+
+            for entidad_id in self._salidas[estado]:
+                tipo, texto_entidad, valor, largo = self._entidades[entidad_id]
+                menciones.append({
+                    'tipo': tipo,
+                    'texto': texto_entidad,
+                    'valor': valor,
+                    'inicio': posicion + 1 - largo,
+                    'fin': posicion + 1,
+                })
+
+        return menciones
+
+
+def seleccionar_mas_largas(menciones):
+    """Quedarse con las menciones más largas que no se solapan"""
+    ordenadas = sorted(menciones, key=lambda m: (m['inicio'] - m['fin'], m['inicio']))
+    ocupadas = set()
+    resultado = []
+    for mencion in ordenadas:
+        posiciones = set(range(mencion['inicio'], mencion['fin']))
+        if posiciones & ocupadas:
+            # Misma frase, otra entidad (p.ej. dos negocios en el mismo barrio)
+            if any(m['inicio'] == mencion['inicio'] and m['fin'] == mencion['fin'] for m in resultado):
+                resultado.append(mencion)
+            continue
+        ocupadas |= posiciones
+        resultado.append(mencion)
+    resultado.sort(key=lambda m: m['inicio'])
+    return resultado
+
+
+class Gazetteer(IndiceVersionado):
+    """
+    Gazetteer del catálogo: se compila perezosamente con una sola consulta y
+    se recompila cuando cambian los negocios en cualquier worker (ver
+    IndiceVersionado).
+    """
+
+    def modelos(self):
+        from ..models import Negocio
+        return (Negocio,)
+
+    def _construir(self):
+        from ..models import Negocio
+
+        automata = AutomataEntidades()
+        barrios = set()
+
+        negocios = Negocio.objects.filter(activo=True).values_list(
+            'id', 'nombre', 'barrio', 'referencia_ubicacion'
+        )
+        for negocio_id, nombre, barrio, referencia in negocios:
+            automata.agregar('negocio', nombre, negocio_id)
+            if referencia:
+                automata.agregar('referencia', referencia, negocio_id)
+            if barrio and barrio.strip().lower() not in barrios:
+                barrios.add(barrio.strip().lower())
+                automata.agregar('barrio', barrio, barrio.strip())
+
+        automata.compilar()
+        logger.info(f"Gazetteer compilado: {len(automata)} entidades")
+        return automata
+
+    def buscar(self, texto):
+        """Menciones de entidades en el texto, sin solapamientos"""
+        return seleccionar_mas_largas(self.obtener().buscar(texto))
+
+
+gazetteer = Gazetteer()
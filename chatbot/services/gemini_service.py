@@ -1,15 +1,48 @@
 """
 Servicio para interactuar con Google Gemini AI - ESPECIALIZADO EN NEGOCIOS
 """
+import asyncio
 import logging
+import re
+import weakref
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, timedelta
+from ..models import BotContext
 from .db_service import DatabaseService
-from datetime import datetime
+from .context_fragments import fragmentos_negocio
 
 logger = logging.getLogger('chatbot')
 
 
+def estimar_tokens(texto):
+    """Estimación aproximada de tokens: palabras más signos y emojis sueltos"""
+    return len(re.findall(r"\w+|[^\w\s]", texto))
+
+
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def cliente_async_gemini(api_key):
+    """
+    Cliente gRPC asíncrono de Gemini del event loop actual
+
+    El que crea google-generativeai es uno solo por proceso y queda ligado al
+    primer loop; bajo WSGI cada petición async corre en un loop nuevo.
+    """
+    loop = asyncio.get_running_loop()
+    cliente = _clientes_async.get(loop)
+    if cliente is None:
+        # Los clientes guardan una referencia a su loop: descartar los de loops ya cerrados
+        for cerrado in [l for l in _clientes_async if l.is_closed()]:
+            del _clientes_async[cerrado]
+        cliente = glm.GenerativeServiceAsyncClient(client_options={'api_key': api_key})
+        _clientes_async[loop] = cliente
+    return cliente
+
+
 class GeminiService: 
     
     def __init__(self):
@@ -60,230 +93,445 @@ class GeminiService:
 
 
     
-    def _extraer_informacion_negocios(self, message):
+    def _extraer_informacion_negocios(self, message, ubicacion=None):
         """
         Extraer información relevante de negocios según el mensaje
-        
+
+        Primero se reúnen, por negocio, todas las facetas que pide el mensaje
+        (ubicación, horarios, estado, productos, calificación) y luego cada
+        negocio se escribe una sola vez en formato compacto.
+
+        Args:
+            message: Mensaje del usuario
+            ubicacion: Tupla (latitud, longitud) del usuario, si se conoce
+
         Returns:
             String con contexto de negocios
         """
-        context = ""
+        try:
+            datos = self._recolectar_informacion(message, ubicacion=ubicacion)
+        except Exception as e:
+            logger.error(f"Error extrayendo información de negocios: {e}")
+            return ""
+
+        context = self._renderizar_contexto(datos)
+        if settings.CONTEXT_TOKEN_REPORT:
+            self._reportar_ahorro_contexto(datos, context)
+        return context
+
+    def _recolectar_informacion(self, message, ubicacion=None):
+        """
+        Reunir los datos del contexto agrupados por negocio
+
+        Returns:
+            Dict con 'fichas' (negocio_id -> facetas), 'secciones' (IDs de
+            negocio en el orden en que los pidió cada sección), 'sugerencias',
+            'categorias', 'barrios', 'eventos' y 'resenas'
+        """
         message_lower = message.lower()
-        
+
+        # Palabras clave para búsqueda de negocios
+        keywords_negocios = ['negocio', 'tienda', 'local', 'restaurante', 'farmacia',
+                            'panadería', 'supermercado', 'ferretería', 'dónde', 'donde',
+                            'panaderia', 'ferreteria']
+
+        keywords_horarios = ['horario', 'abierto', 'cerrado', 'abre', 'cierra', 'hora',
+                           'atiende', 'atención', 'atencion', 'funciona']
+
+        keywords_ubicacion = ['ubicación', 'ubicacion', 'dirección', 'direccion', 'queda',
+                            'está', 'esta', 'como llego', 'donde queda', 'barrio', 'cerca']
+
+        keywords_productos = ['producto', 'vende', 'venden', 'precio', 'cuánto cuesta',
+                            'cuanto cuesta', 'tiene', 'hay', 'servicio', 'venta']
+
+        keywords_resenas = ['reseña', 'resena', 'calificar', 'calificación', 'calificacion',
+                           'opinión', 'opinion', 'comentario', 'valorar', 'valoración',
+                           'estrellas', 'review']
+
+        keywords_eventos = ['evento', 'partido', 'juego', 'campeonato', 'torneo',
+                           'futbol', 'fútbol', 'baloncesto', 'basquet', 'voleibol',
+                           'deporte', 'deportivo', 'estadio', 'cancha']
+
+        # Detectar categoría específica
+        categorias_map = {
+            'restaurante': ['restaurante', 'comida', 'comer', 'almuerzo', 'desayuno', 'comedor'],
+            'farmacia': ['farmacia', 'droguería', 'drogueria', 'medicina', 'medicamento'],
+            'supermercado': ['supermercado', 'mercado', 'tienda', 'viveres', 'víveres'],
+            'panadería': ['panadería', 'panaderia', 'pan', 'pandería'],
+            'ferretería': ['ferretería', 'ferreteria', 'herramienta', 'ferreteria'],
+            'ropa': ['ropa', 'boutique', 'vestido', 'zapato', 'calzado'],
+            'tecnología': ['celular', 'computador', 'tecnología', 'tecnologia', 'electrónica']
+        }
+
+        datos = {
+            'fichas': {},
+            'secciones': {'general': [], 'horarios': [], 'ubicacion': [], 'productos': []},
+            'sugerencias': [],
+            'categorias': [],
+            'barrios': [],
+            'eventos': [],
+            'resenas': any(kw in message_lower for kw in keywords_resenas),
+        }
+        quiere_productos = any(kw in message_lower for kw in keywords_productos)
+
+        # Facetas por negocio: qué partes de sus fragmentos van en el contexto
+        def ficha(negocio, seccion):
+            f = datos['fichas'].setdefault(negocio.id, {
+                'negocio': negocio,
+                'estado': None,
+                'horarios': False,
+                'productos': 0,
+                'ubicacion': False,
+                'calificacion': None,
+            })
+            if seccion and negocio.id not in datos['secciones'][seccion]:
+                datos['secciones'][seccion].append(negocio.id)
+            return f
+
+        # Entidades conocidas del catálogo (barrios, nombres de negocios)
+        entidades = self.db_service.detectar_entidades(message)
+        negocios_mencionados = self.db_service.obtener_negocios_mencionados(message)
+
+        categoria_detectada = None
+        for cat, keywords in categorias_map.items():
+            if any(kw in message_lower for kw in keywords):
+                categoria_detectada = cat
+                break
+
+        # Buscar negocios - SIEMPRE buscar si hay palabras clave o categoría
+        negocios = None
+        if any(kw in message_lower for kw in keywords_negocios) or categoria_detectada:
+            negocios = self.db_service.buscar_negocios_rankeados(
+                query=message if len(message.split()) < 10 else None,
+                categoria=categoria_detectada,
+                ubicacion=ubicacion,
+                texto=message,
+                limit=5
+            )
+        # También buscar si pregunta por algo específico sin palabras clave obvias
+        elif len(message.split()) <= 5 and len(message) > 3:
+            negocios = self.db_service.buscar_negocios_rankeados(
+                query=message,
+                ubicacion=ubicacion,
+                limit=5
+            )
+
+        if not negocios and negocios_mencionados:
+            negocios = negocios_mencionados[:5]
+
+        # Si la búsqueda exacta no encontró nada, tolerar errores de escritura
+        # ("pandería", "drogeria", "restorante")
+        if not negocios:
+            datos['sugerencias'] = self.db_service.sugerir_correcciones(message)[:3]
+            negocios = self.db_service.buscar_negocios_difuso(message, limit=5)
+
+        for neg in negocios or []:
+            f = ficha(neg, 'general')
+            f['estado'] = self.db_service.verificar_negocio_abierto(neg.id)
+            f['productos'] = max(f['productos'], 8 if quiere_productos else 5)
+
+        # Horarios
+        if any(kw in message_lower for kw in keywords_horarios):
+            candidatos = negocios_mencionados[:3] or self._buscar_negocios_por_palabras(message_lower, limit=3)
+            fragmentos = fragmentos_negocio.obtener([n.id for n in candidatos])
+            for negocio in candidatos:
+                if negocio.id in fragmentos and fragmentos[negocio.id].horario:
+                    f = ficha(negocio, 'horarios')
+                    f['horarios'] = True
+                    f['estado'] = self.db_service.verificar_negocio_abierto(negocio.id)
+
+        # Ubicación
+        if any(kw in message_lower for kw in keywords_ubicacion):
+            for negocio in negocios_mencionados[:2] or self._buscar_negocios_por_palabras(message_lower, limit=2):
+                ficha(negocio, 'ubicacion')['ubicacion'] = True
+
+        # Productos/servicios
+        if quiere_productos:
+            candidatos = negocios_mencionados[:2] or self._buscar_negocios_por_palabras(message_lower, limit=2)
+            fragmentos = fragmentos_negocio.obtener([n.id for n in candidatos])
+            for negocio in candidatos:
+                if negocio.id in fragmentos and fragmentos[negocio.id].productos:
+                    ficha(negocio, 'productos')['productos'] = 8
+
+        # Categorías disponibles
+        if 'categoría' in message_lower or 'categoria' in message_lower or 'tipos de negocio' in message_lower:
+            datos['categorias'] = self.db_service.obtener_categorias_negocios()
+
+        # Búsqueda por barrio (barrios detectados por el gazetteer)
+        barrios = []
+        for mencion in entidades:
+            if mencion['tipo'] == 'barrio' and mencion['valor'] not in barrios:
+                barrios.append(mencion['valor'])
+        for barrio in barrios[:2]:
+            negocios_barrio = list(self.db_service.buscar_negocios_cercanos(barrio=barrio, limit=3))
+            if negocios_barrio:
+                datos['barrios'].append((barrio, negocios_barrio))
+
+        # Eventos deportivos
+        if any(kw in message_lower for kw in keywords_eventos):
+            datos['eventos'] = list(self.db_service.obtener_eventos_proximos(dias=14, limit=5))
+
+        # Calificaciones de los negocios que van en el contexto (sin consultas)
+        calificaciones = self.db_service.obtener_calificaciones(list(datos['fichas']))
+        for negocio_id, calificacion in calificaciones.items():
+            datos['fichas'][negocio_id]['calificacion'] = calificacion
+
+        datos['fragmentos'] = fragmentos_negocio.obtener(list(datos['fichas']))
+        return datos
+
+    def _renderizar_contexto(self, datos):
+        """Escribir el contexto: cada negocio una sola vez, con todas sus facetas"""
+        lineas = []
+
+        if datos['sugerencias']:
+            correcciones = "; ".join(f"\"{s['palabra']}\" → {s['sugerencia']}" for s in datos['sugerencias'])
+            lineas.append(f"Quizás el usuario quiso decir: {correcciones}")
+
+        # Orden: lista general y luego los que solo pidieron horario/ubicación/productos
+        orden = []
+        for seccion in ('general', 'horarios', 'ubicacion', 'productos'):
+            orden.extend(i for i in datos['secciones'][seccion] if i not in orden)
+
+        if orden:
+            lineas.append("NEGOCIOS:")
+            for negocio_id in orden:
+                fragmentos = datos['fragmentos'].get(negocio_id)
+                if fragmentos is not None:
+                    lineas.extend(self._renderizar_ficha(datos['fichas'][negocio_id], fragmentos))
+
+        # Los negocios ya descritos arriba se nombran sin repetir la dirección
+        for barrio, negocios_barrio in datos['barrios']:
+            lista = "; ".join(n.nombre if n.id in orden else f"{n.nombre} ({n.direccion})" for n in negocios_barrio)
+            lineas.append(f"En {barrio}: {lista}")
+
+        categorias = datos['categorias']
+        if categorias:
+            if isinstance(categorias[0], str):
+                lineas.append("Categorías: " + ", ".join(categorias))
+            else:
+                lineas.append("Categorías: " + ", ".join(c.nombre for c in categorias))
+
+        if datos['eventos']:
+            lineas.append("EVENTOS DEPORTIVOS PRÓXIMOS:")
+            for evento in datos['eventos']:
+                lineas.append(self._renderizar_evento(evento))
+
+        if datos['resenas']:
+            lineas.append(
+                "Reseñas: el usuario puede calificar un negocio diciendo 'Quiero calificar "
+                "[negocio]' o 'Dejar reseña de [negocio]'; se le pide la calificación "
+                "(1-5 estrellas) y un comentario."
+            )
+
+        return "\n" + "\n".join(lineas) if lineas else ""
+
+    def _renderizar_ficha(self, ficha, fragmentos):
+        """
+        Líneas de un negocio: fragmentos pre-renderizados más lo que depende
+        del momento (estado de apertura) y la calificación
+        """
+        lineas = [fragmentos.resumen]
+        if ficha['ubicacion'] and fragmentos.ubicacion:
+            lineas.append(fragmentos.ubicacion)
+
+        estado = ficha['estado']
+        if estado and estado['abierto'] is not None:
+            lineas.append(f"  Ahora: {'abierto' if estado['abierto'] else 'cerrado'} - {estado['mensaje']}")
+        if ficha['horarios'] and fragmentos.horario:
+            lineas.append(fragmentos.horario)
+        if fragmentos.perfil:
+            lineas.append(fragmentos.perfil)
+        if ficha['calificacion']:
+            promedio, total = ficha['calificacion']
+            lineas.append(f"  Calificación: {promedio}/5 ({total} reseñas)")
+        if ficha['productos'] and fragmentos.productos:
+            lineas.append(fragmentos.menu(ficha['productos']))
+        return lineas
+
+    def _renderizar_evento(self, evento):
+        partes = [evento.nombre]
+        if evento.equipo_local and evento.equipo_visitante:
+            partes.append(f"{evento.equipo_local} vs {evento.equipo_visitante}")
+        partes.append(evento.fecha_evento.strftime('%A %d de %B, %I:%M %p'))
+        lugar = evento.lugar + (f", {evento.barrio}" if evento.barrio else "")
+        partes.append(lugar)
+        if evento.entrada_gratis:
+            partes.append("entrada gratis")
+        elif evento.precio_entrada:
+            partes.append(f"entrada ${evento.precio_entrada:,.0f}")
+        if evento.descripcion:
+            partes.append(evento.descripcion[:100])
+        return "- " + " | ".join(partes)
+
+    def _reportar_ahorro_contexto(self, datos, context):
+        """Comparar los tokens del contexto con el formato anterior (por secciones)"""
         try:
-            # Palabras clave para búsqueda de negocios
-            keywords_negocios = ['negocio', 'tienda', 'local', 'restaurante', 'farmacia', 
-                                'panadería', 'supermercado', 'ferretería', 'dónde', 'donde',
-                                'panaderia', 'ferreteria']
-            
-            keywords_horarios = ['horario', 'abierto', 'cerrado', 'abre', 'cierra', 'hora', 
-                               'atiende', 'atención', 'atencion', 'funciona']
-            
-            keywords_ubicacion = ['ubicación', 'ubicacion', 'dirección', 'direccion', 'queda', 
-                                'está', 'esta', 'como llego', 'donde queda', 'barrio', 'cerca']
-            
-            keywords_productos = ['producto', 'vende', 'venden', 'precio', 'cuánto cuesta', 
-                                'cuanto cuesta', 'tiene', 'hay', 'servicio', 'venta']
-            
-            # NUEVO: Palabras clave para reseñas
-            keywords_resenas = ['reseña', 'resena', 'calificar', 'calificación', 'calificacion',
-                               'opinión', 'opinion', 'comentario', 'valorar', 'valoración',
-                               'estrellas', 'review']
-            
-            # NUEVO: Palabras clave para eventos deportivos
-            keywords_eventos = ['evento', 'partido', 'juego', 'campeonato', 'torneo',
-                               'futbol', 'fútbol', 'baloncesto', 'basquet', 'voleibol',
-                               'deporte', 'deportivo', 'estadio', 'cancha']
-            
-            # Detectar categoría específica
-            categorias_map = {
-                'restaurante': ['restaurante', 'comida', 'comer', 'almuerzo', 'desayuno', 'comedor'],
-                'farmacia': ['farmacia', 'droguería', 'drogueria', 'medicina', 'medicamento'],
-                'supermercado': ['supermercado', 'mercado', 'tienda', 'viveres', 'víveres'],
-                'panadería': ['panadería', 'panaderia', 'pan', 'pandería'],
-                'ferretería': ['ferretería', 'ferreteria', 'herramienta', 'ferreteria'],
-                'ropa': ['ropa', 'boutique', 'vestido', 'zapato', 'calzado'],
-                'tecnología': ['celular', 'computador', 'tecnología', 'tecnologia', 'electrónica']
+            anterior = self._renderizar_contexto_anterior(datos)
+            tokens = estimar_tokens(context)
+            tokens_anterior = estimar_tokens(anterior)
+            ahorro = 1 - tokens / tokens_anterior if tokens_anterior else 0
+            self.ultimo_reporte_contexto = {
+                'tokens': tokens,
+                'tokens_anterior': tokens_anterior,
+                'ahorro': round(ahorro, 3),
             }
-            
-            categoria_detectada = None
-            for cat, keywords in categorias_map.items():
-                if any(kw in message_lower for kw in keywords):
-                    categoria_detectada = cat
-                    break
-            
-            # Buscar negocios - SIEMPRE buscar si hay palabras clave o categoría
-            negocios = None
-            if any(kw in message_lower for kw in keywords_negocios) or categoria_detectada:
-                negocios = self.db_service.buscar_negocios(
-                    query=message if len(message.split()) < 10 else None,
-                    categoria=categoria_detectada,
-                    limit=5
-                )
-            # También buscar si pregunta por algo específico sin palabras clave obvias
-            elif len(message.split()) <= 5 and len(message) > 3:
-                negocios = self.db_service.buscar_negocios(
-                    query=message,
-                    limit=5
-                )
-            
-            if negocios and len(negocios) > 0:
-                context += "\n\n🏪 **NEGOCIOS QUE TE PUEDEN SERVIR, PARCE:**\n"
-                for neg in negocios:
-                    verificado = "✅" if neg.verificado else ""
-                    context += f"\n**{neg.nombre}** {verificado}\n"
-                    context += f"📍 {neg.direccion}"
-                    if neg.barrio:
-                        context += f" - {neg.barrio}"
-                    context += f"\n📞 {neg.telefono if neg.telefono else 'Sin teléfono'}\n"
-                    
-                    if neg.categoria:
-                        context += f"🏷️ {neg.categoria}\n"
-                    
-                    # Verificar si está abierto
-                    estado = self.db_service.verificar_negocio_abierto(neg.id)
-                    if estado['abierto'] is not None:
-                        emoji = "🟢" if estado['abierto'] else "🔴"
-                        context += f"{emoji} {estado['mensaje']}\n"
-                    
-                    # NUEVO: Agregar productos/menú automáticamente
-                    productos = self.db_service.obtener_productos_negocio(neg.id, limit=5)
-                    if productos and len(productos) > 0:
-                        context += f"\n🍽️ **Menú/Productos:**\n"
-                        for p in productos[:5]:  # Máximo 5 productos
-                            destacado = "⭐" if p.destacado else "•"
-                            context += f"  {destacado} {p.nombre} - {p.get_precio_display()}\n"
-                            if p.descripcion and len(p.descripcion) > 0:
-                                desc_corta = p.descripcion[:60] + "..." if len(p.descripcion) > 60 else p.descripcion
-                                context += f"    ({desc_corta})\n"
-                    context += "\n"  # Espacio entre negocios
-            
-            # Información de horarios
-            if any(kw in message_lower for kw in keywords_horarios):
-                # Buscar negocio mencionado
-                palabras = message_lower.split()
-                for palabra in palabras:
-                    if len(palabra) > 4:
-                        negocios = self.db_service.buscar_negocios(query=palabra, limit=3)
-                        if negocios:
-                            for negocio in negocios:
-                                horarios = self.db_service.obtener_horarios_negocio(negocio.id)
-                                if horarios:
-                                    context += f"\n\n🕐 **HORARIOS DE {negocio.nombre.upper()}:**\n"
-                                    for h in horarios:
-                                        if h.cerrado:
-                                            context += f"• {h.dia_semana.capitalize()}: Cerrado\n"
-                                        else:
-                                            context += f"• {h.dia_semana.capitalize()}: {h.hora_apertura.strftime('%I:%M %p')} - {h.hora_cierre.strftime('%I:%M %p')}\n"
-                                            if h.notas:
-                                                context += f"  ℹ️ {h.notas}\n"
-                                    
-                                    # Estado actual
-                                    estado = self.db_service.verificar_negocio_abierto(negocio.id)
-                                    emoji = "🟢" if estado['abierto'] else "🔴"
-                                    context += f"\n{emoji} Ahora: {estado['mensaje']}\n"
-                            break
-            
-            # Información de ubicación
-            if any(kw in message_lower for kw in keywords_ubicacion):
-                palabras = message_lower.split()
-                for palabra in palabras:
-                    if len(palabra) > 4:
-                        negocios = self.db_service.buscar_negocios(query=palabra, limit=2)
-                        if negocios:
-                            context += "\n\n📍 **UBICACIONES:**\n"
-                            for neg in negocios:
-                                context += f"\n**{neg.nombre}**\n"
-                                context += f"• Dirección: {neg.direccion}\n"
-                                if neg.barrio:
-                                    context += f"• Barrio: {neg.barrio}\n"
-                                if neg.referencia_ubicacion:
-                                    context += f"• Referencia: {neg.referencia_ubicacion}\n"
-                                if neg.telefono:
-                                    context += f"• Teléfono: {neg.telefono}\n"
-                                # Agregar coordenadas si están disponibles
-                                if neg.latitud and neg.longitud:
-                                    context += f"• Coordenadas: {neg.latitud}, {neg.longitud}\n"
-                                    context += f"📌 [Puedo enviarte la ubicación exacta si lo deseas]\n"
-                            break
-            
-            # Información de productos/servicios
-            if any(kw in message_lower for kw in keywords_productos):
-                # Buscar primero el negocio
-                palabras = message_lower.split()
-                for palabra in palabras:
-                    if len(palabra) > 4:
-                        negocios = self.db_service.buscar_negocios(query=palabra, limit=2)
-                        if negocios:
-                            for negocio in negocios:
-                                productos = self.db_service.obtener_productos_negocio(negocio.id, limit=8)
-                                if productos:
-                                    context += f"\n\n🛍️ **PRODUCTOS/SERVICIOS DE {negocio.nombre.upper()}:**\n"
-                                    for p in productos:
-                                        destacado = "⭐" if p.destacado else "•"
-                                        context += f"{destacado} {p.nombre} - {p.get_precio_display()}\n"
-                                        if p.descripcion:
-                                            context += f"  {p.descripcion[:80]}...\n"
-                            break
-            
-            # Categorías disponibles
-            if 'categoría' in message_lower or 'categoria' in message_lower or 'tipos de negocio' in message_lower:
-                categorias = self.db_service.obtener_categorias_negocios()
-                if categorias:
-                    context += "\n\n🏷️ **CATEGORÍAS DISPONIBLES:**\n"
-                    if isinstance(categorias[0], str):
-                        context += ", ".join(categorias)
-                    else:
-                        for cat in categorias:
-                            emoji = cat.icono if hasattr(cat, 'icono') and cat.icono else "•"
-                            context += f"{emoji} {cat.nombre}\n"
-            
-            # Búsqueda por barrio
-            for palabra in message_lower.split():
-                if len(palabra) > 4:
-                    negocios_barrio = self.db_service.buscar_negocios_cercanos(barrio=palabra, limit=3)
-                    if negocios_barrio:
-                        context += f"\n\n🗺️ **NEGOCIOS EN {palabra.upper()}:**\n"
-                        for neg in negocios_barrio:
-                            context += f"• {neg.nombre} - {neg.direccion}\n"
-                        break
-            
-            # NUEVO: Información de eventos deportivos
-            if any(kw in message_lower for kw in keywords_eventos):
-                eventos = self.db_service.obtener_eventos_proximos(dias=14, limit=5)
-                if eventos:
-                    context += "\n\n⚽ **EVENTOS DEPORTIVOS PRÓXIMOS:**\n"
-                    for evento in eventos:
-                        context += f"\n**{evento.nombre}**\n"
-                        if evento.equipo_local and evento.equipo_visitante:
-                            context += f"🏆 {evento.equipo_local} vs {evento.equipo_visitante}\n"
-                        context += f"📅 {evento.fecha_evento.strftime('%A %d de %B, %I:%M %p')}\n"
-                        context += f"📍 {evento.lugar}"
-                        if evento.barrio:
-                            context += f" - {evento.barrio}"
-                        context += "\n"
-                        if evento.entrada_gratis:
-                            context += "💰 Entrada GRATIS\n"
-                        elif evento.precio_entrada:
-                            context += f"💰 Entrada: ${evento.precio_entrada:,.0f}\n"
-                        if evento.descripcion:
-                            desc_corta = evento.descripcion[:100] + "..." if len(evento.descripcion) > 100 else evento.descripcion
-                            context += f"ℹ️ {desc_corta}\n"
-            
-            # NUEVO: Información sobre reseñas
-            if any(kw in message_lower for kw in keywords_resenas):
-                context += "\n\n⭐ **SOBRE RESEÑAS:**\n"
-                context += "Puedes dejar tu reseña de un negocio diciendo:\n"
-                context += "• 'Quiero calificar [nombre del negocio]'\n"
-                context += "• 'Dejar reseña de [nombre del negocio]'\n"
-                context += "Te pediré tu calificación (1-5 estrellas) y tu comentario.\n"
-        
+            logger.info(
+                f"Contexto de negocios: ~{tokens} tokens (formato anterior ~{tokens_anterior}, "
+                f"ahorro {ahorro:.0%})"
+            )
         except Exception as e:
-            logger.error(f"Error extrayendo información de negocios: {e}")
-        
+            logger.error(f"Error comparando el contexto con el formato anterior: {e}")
+
+    def _renderizar_contexto_anterior(self, datos):
+        """
+        Formato anterior, una sección por tipo de dato y los negocios repetidos
+        en cada una. Solo se usa para medir el ahorro del formato actual: se
+        escribe con los datos ya reunidos (productos y horario de los
+        fragmentos), sin consultas, así que el tamaño es aproximado.
+        """
+        context = ""
+        fichas = datos['fichas']
+        secciones = datos['secciones']
+        fragmentos = datos['fragmentos']
+
+        if datos['sugerencias']:
+            context += "\n\n🔎 **QUIZÁS EL USUARIO QUISO DECIR:**\n"
+            for s in datos['sugerencias']:
+                context += f"• \"{s['palabra']}\" → {s['sugerencia']}\n"
+
+        if secciones['general']:
+            context += "\n\n🏪 **NEGOCIOS QUE TE PUEDEN SERVIR, PARCE:**\n"
+            for negocio_id in secciones['general']:
+                f = fichas[negocio_id]
+                neg = f['negocio']
+                verificado = "✅" if neg.verificado else ""
+                context += f"\n**{neg.nombre}** {verificado}\n"
+                context += f"📍 {neg.direccion}"
+                if neg.barrio:
+                    context += f" - {neg.barrio}"
+                context += f"\n📞 {neg.telefono if neg.telefono else 'Sin teléfono'}\n"
+                if neg.categoria:
+                    context += f"🏷️ {neg.categoria}\n"
+                estado = f['estado']
+                if estado and estado['abierto'] is not None:
+                    emoji = "🟢" if estado['abierto'] else "🔴"
+                    context += f"{emoji} {estado['mensaje']}\n"
+                productos = fragmentos[negocio_id].productos[:5] if negocio_id in fragmentos else []
+                if productos:
+                    context += f"\n🍽️ **Menú/Productos:**\n"
+                    for producto in productos:
+                        context += f"  • {producto}\n"
+                context += "\n"
+
+        for negocio_id in secciones['horarios']:
+            f = fichas[negocio_id]
+            context += f"\n\n🕐 **HORARIOS DE {f['negocio'].nombre.upper()}:**\n"
+            if negocio_id in fragmentos:
+                context += f"{fragmentos[negocio_id].horario}\n"
+            emoji = "🟢" if f['estado']['abierto'] else "🔴"
+            context += f"\n{emoji} Ahora: {f['estado']['mensaje']}\n"
+
+        if secciones['ubicacion']:
+            context += "\n\n📍 **UBICACIONES:**\n"
+            for negocio_id in secciones['ubicacion']:
+                neg = fichas[negocio_id]['negocio']
+                context += f"\n**{neg.nombre}**\n"
+                context += f"• Dirección: {neg.direccion}\n"
+                if neg.barrio:
+                    context += f"• Barrio: {neg.barrio}\n"
+                if neg.referencia_ubicacion:
+                    context += f"• Referencia: {neg.referencia_ubicacion}\n"
+                if neg.telefono:
+                    context += f"• Teléfono: {neg.telefono}\n"
+                if neg.latitud and neg.longitud:
+                    context += f"• Coordenadas: {neg.latitud}, {neg.longitud}\n"
+                    context += f"📌 [Puedo enviarte la ubicación exacta si lo deseas]\n"
+
+        for negocio_id in secciones['productos']:
+            f = fichas[negocio_id]
+            context += f"\n\n🛍️ **PRODUCTOS/SERVICIOS DE {f['negocio'].nombre.upper()}:**\n"
+            for producto in (fragmentos[negocio_id].productos[:8] if negocio_id in fragmentos else []):
+                context += f"• {producto}\n"
+
+        categorias = datos['categorias']
+        if categorias:
+            context += "\n\n🏷️ **CATEGORÍAS DISPONIBLES:**\n"
+            if isinstance(categorias[0], str):
+                context += ", ".join(categorias)
+            else:
+                for cat in categorias:
+                    emoji = cat.icono if hasattr(cat, 'icono') and cat.icono else "•"
+                    context += f"{emoji} {cat.nombre}\n"
+
+        for barrio, negocios_barrio in datos['barrios']:
+            context += f"\n\n🗺️ **NEGOCIOS EN {barrio.upper()}:**\n"
+            for neg in negocios_barrio:
+                context += f"• {neg.nombre} - {neg.direccion}\n"
+
+        if datos['eventos']:
+            context += "\n\n⚽ **EVENTOS DEPORTIVOS PRÓXIMOS:**\n"
+            for evento in datos['eventos']:
+                context += f"\n**{evento.nombre}**\n"
+                if evento.equipo_local and evento.equipo_visitante:
+                    context += f"🏆 {evento.equipo_local} vs {evento.equipo_visitante}\n"
+                context += f"📅 {evento.fecha_evento.strftime('%A %d de %B, %I:%M %p')}\n"
+                context += f"📍 {evento.lugar}"
+                if evento.barrio:
+                    context += f" - {evento.barrio}"
+                context += "\n"
+                if evento.entrada_gratis:
+                    context += "💰 Entrada GRATIS\n"
+                elif evento.precio_entrada:
+                    context += f"💰 Entrada: ${evento.precio_entrada:,.0f}\n"
+                if evento.descripcion:
+                    desc_corta = evento.descripcion[:100] + "..." if len(evento.descripcion) > 100 else evento.descripcion
+                    context += f"ℹ️ {desc_corta}\n"
+
+        if datos['resenas']:
+            context += "\n\n⭐ **SOBRE RESEÑAS:**\n"
+            context += "Puedes dejar tu reseña de un negocio diciendo:\n"
+            context += "• 'Quiero calificar [nombre del negocio]'\n"
+            context += "• 'Dejar reseña de [nombre del negocio]'\n"
+            context += "Te pediré tu calificación (1-5 estrellas) y tu comentario.\n"
+
         return context
+
+    def _buscar_negocios_por_palabras(self, message_lower, limit=3):
+        """Buscar negocios con la primera palabra larga del mensaje que dé resultados"""
+        for palabra in message_lower.split():
+            if len(palabra) > 4:
+                negocios = self.db_service.buscar_negocios(query=palabra, limit=limit)
+                if negocios:
+                    return negocios
+        return []
+    
+    def _obtener_ubicacion_usuario(self, phone_number):
+        """Última ubicación reciente compartida por el usuario, como (latitud, longitud)"""
+        if not phone_number:
+            return None
+        try:
+            bot_context = BotContext.objects.filter(conversation__phone_number=phone_number).first()
+            ubicacion = bot_context.context_data.get('ultima_ubicacion') if bot_context else None
+            if not ubicacion:
+                return None
+            
+            antiguedad = timezone.now() - datetime.fromisoformat(ubicacion['fecha'])
+            if antiguedad > timedelta(minutes=settings.GEO_LOCATION_MAX_AGE_MINUTES):
+                return None
+            return (ubicacion['latitud'], ubicacion['longitud'])
+        except Exception as e:
+            logger.error(f"Error obteniendo ubicación del usuario: {e}")
+            return None
     
-    def get_response(self, message, context=None, phone_number=None):
+    def construir_contexto_negocios(self, message, phone_number=None):
+        """
+        Contexto de negocios para el prompt (no llama al LLM, así que puede
+        armarse en paralelo con otras etapas del mensaje)
+        """
+        ubicacion = self._obtener_ubicacion_usuario(phone_number)
+        return self._extraer_informacion_negocios(message, ubicacion=ubicacion)
+    
+    def get_response(self, message, context=None, phone_number=None, db_context=None):
         """
         Generar respuesta usando Gemini con contexto de negocios
         
@@ -291,6 +539,7 @@ class GeminiService:
             message: Mensaje del usuario
             context: Contexto de conversación previo
             phone_number: Número de teléfono del usuario
+            db_context: Contexto de negocios ya armado (si no, se arma aquí)
         
         Returns:
             Respuesta generada por Gemini
@@ -300,19 +549,64 @@ class GeminiService:
         
         try:
             # Extraer información de la base de datos de negocios
-            db_context = self._extraer_informacion_negocios(message)
+            if db_context is None:
+                db_context = self.construir_contexto_negocios(message, phone_number)
             
-            # Información adicional
-            hora_actual = datetime.now().strftime("%I:%M %p")
-            dia_actual = datetime.now().strftime("%A")
-            dias_es = {
-                'Monday': 'lunes', 'Tuesday': 'martes', 'Wednesday': 'miércoles',
-                'Thursday': 'jueves', 'Friday': 'viernes', 'Saturday': 'sábado', 'Sunday': 'domingo'
-            }
-            dia_actual = dias_es.get(dia_actual, dia_actual)
+            prompt = self._construir_prompt(message, context, db_context)
+            
+            # Generar respuesta
+            return self._texto_respuesta(self.model.generate_content(prompt))
+        
+        except Exception as e:
+            logger.error(f"Error generando respuesta con Gemini: {str(e)}", exc_info=True)
+            return "Lo siento, hubo un error al procesar tu mensaje. Por favor intenta de nuevo."
+    
+    async def get_response_async(self, message, context=None, phone_number=None, db_context=None):
+        """
+        Versión asyncio de get_response para el webhook ASGI: mientras Gemini
+        genera, el proceso sigue atendiendo otros mensajes
+        """
+        from .message_pipeline import en_bd
+        
+        if not self.api_key:
+            return "Lo siento, el servicio de IA no está configurado correctamente."
+        
+        try:
+            if db_context is None:
+                db_context = await en_bd(self.construir_contexto_negocios, message, phone_number)
+            
+            prompt = self._construir_prompt(message, context, db_context)
             
-            # Construir prompt con contexto - LENGUAJE BARRIAL DE QUIBDÓ
-            system_prompt = """Eres Luisa, una parcera de barrio de Quibdó que ayuda a la gente a encontrar negocios y servicios.
+            self.model._async_client = cliente_async_gemini(self.api_key)
+            return self._texto_respuesta(await self.model.generate_content_async(prompt))
+        
+        except Exception as e:
+            logger.error(f"Error generando respuesta con Gemini: {str(e)}", exc_info=True)
+            return "Lo siento, hubo un error al procesar tu mensaje. Por favor intenta de nuevo."
+    
+    def _texto_respuesta(self, response):
+        if response.text:
+            logger.info(f"Respuesta de Gemini generada con contexto de negocios")
+            return response.text.strip()
+        else:
+            logger.warning("Gemini no generó respuesta de texto")
+            return "Lo siento, no pude generar una respuesta en este momento."
+    
+    def _construir_prompt(self, message, context, db_context):
+        """Prompt completo: personalidad, fecha y hora, contexto de negocios, historial y mensaje"""
+        # Información adicional
+        # Hora local del proyecto (America/Bogota), no la del servidor
+        ahora = timezone.localtime()
+        hora_actual = ahora.strftime("%I:%M %p")
+        dia_actual = ahora.strftime("%A")
+        dias_es = {
+            'Monday': 'lunes', 'Tuesday': 'martes', 'Wednesday': 'miércoles',
+            'Thursday': 'jueves', 'Friday': 'viernes', 'Saturday': 'sábado', 'Sunday': 'domingo'
+        }
+        dia_actual = dias_es.get(dia_actual, dia_actual)
+        
+        # Construir prompt con contexto - LENGUAJE BARRIAL DE QUIBDÓ
+        system_prompt = """Eres Luisa, una parcera de barrio de Quibdó que ayuda a la gente a encontrar negocios y servicios.
 
 **CÓMO HABLAS:**
 - Hablas bien barrial, como la gente del barrio en Quibdó
@@ -456,28 +750,14 @@ Siempre he dicho: aquí no se trata de pelear, sino de trabajar.
 
 
 **RESPONDE COMO PARCERA DE BARRIO:**"""
-            
-            prompt = system_prompt.format(
-                dia_actual=dia_actual,
-                hora_actual=hora_actual,
-                db_context=db_context if db_context else "No hay información específica de la base de datos para esta consulta.",
-                context=context if context else "No hay conversación previa",
-                message=message
-            )
-            
-            # Generar respuesta
-            response = self.model.generate_content(prompt)
-            
-            if response.text:
-                logger.info(f"Respuesta de Gemini generada con contexto de negocios")
-                return response.text.strip()
-            else:
-                logger.warning("Gemini no generó respuesta de texto")
-                return "Lo siento, no pude generar una respuesta en este momento."
         
-        except Exception as e:
-            logger.error(f"Error generando respuesta con Gemini: {str(e)}", exc_info=True)
-            return "Lo siento, hubo un error al procesar tu mensaje. Por favor intenta de nuevo."
+        return system_prompt.format(
+            dia_actual=dia_actual,
+            hora_actual=hora_actual,
+            db_context=db_context if db_context else "No hay información específica de la base de datos para esta consulta.",
+            context=context if context else "No hay conversación previa",
+            message=message
+        )
     
     def get_response_with_history(self, messages_history, phone_number=None):
         """
@@ -0,0 +1,206 @@
+"""
+Índice espacial de negocios a partir de Negocio.latitud / Negocio.longitud
+
+Los negocios se agrupan en una grilla de celdas de tamaño fijo (en grados).
+Las consultas de radio recorren solo las celdas que tocan el círculo y las
+de k vecinos más cercanos se expanden en anillos alrededor de la celda del
+usuario hasta que ninguna celda pendiente pueda mejorar el resultado.
+"""
+import logging
+import math
+
+from django.conf import settings
+
+from .horarios_index import indice_horarios
+from .query_cache import IndiceVersionado
+from .search_index import normalizar_texto
+
+logger = logging.getLogger('chatbot')
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+# Anillos a recorrer en mas_cercanos antes de pasar a calcular todas las distancias
+MAX_ANILLOS = 64
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Distancia haversine en kilómetros"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+class IndiceGeografico(IndiceVersionado):
+    """
+    Grilla en memoria con los negocios activos que tienen coordenadas; se
+    reconstruye cuando cambian los negocios en cualquier worker
+    """
+
+    def __init__(self, tamano_celda=None):
+        super().__init__()
+        self._tamano_celda = tamano_celda
+
+    @property
+    def tamano_celda(self):
+        return self._tamano_celda or settings.GEO_GRID_CELL_DEGREES
+
+    def modelos(self):
+        from ..models import Negocio
+        return (Negocio,)
+
+    def _celda(self, latitud, longitud):
+        return (math.floor(latitud / self.tamano_celda), math.floor(longitud / self.tamano_celda))
+
+    def _construir(self):
+        from ..models import Negocio
+
+        celdas = {}
+        total = 0
+        negocios = Negocio.objects.filter(
+            activo=True,
+            latitud__isnull=False,
+            longitud__isnull=False
+        )
+        for negocio in negocios:
+            latitud = float(negocio.latitud)
+            longitud = float(negocio.longitud)
+            entrada = (negocio, latitud, longitud, normalizar_texto(negocio.categoria))
+            celdas.setdefault(self._celda(latitud, longitud), []).append(entrada)
+            total += 1
+
+        logger.info(f"Índice geográfico construido: {total} negocios en {len(celdas)} celdas")
+        filas = [fila for fila, _ in celdas]
+        columnas = [columna for _, columna in celdas]
+        return {
+            'celdas': celdas,
+            'total': total,
+            'limites': (min(filas), max(filas), min(columnas), max(columnas)) if celdas else None,
+        }
+
+    def _aceptar(self, entrada, categoria, abiertos):
+        negocio, _, _, categoria_negocio = entrada
+        if categoria and normalizar_texto(categoria) not in categoria_negocio:
+            return False
+        if abiertos and not indice_horarios.esta_abierto(negocio.id):
+            return False
+        return True
+
+    def _anillo(self, centro, radio, limites):
+        """
+        Celdas a distancia de Chebyshev exactamente `radio` de la celda centro,
+        recortadas a los límites de la grilla (fuera de ellos no hay negocios)
+        """
+        fila, columna = centro
+        fila_min, fila_max, col_min, col_max = limites
+        desde_col = max(columna - radio, col_min)
+        hasta_col = min(columna + radio, col_max)
+        for fila_borde in {fila - radio, fila + radio}:
+            if fila_min <= fila_borde <= fila_max:
+                for col in range(desde_col, hasta_col + 1):
+                    yield (fila_borde, col)
+        desde_fila = max(fila - radio + 1, fila_min)
+        hasta_fila = min(fila + radio - 1, fila_max)
+        for col_borde in ({columna - radio, columna + radio} if radio else ()):
+            if col_min <= col_borde <= col_max:
+                for f in range(desde_fila, hasta_fila + 1):
+                    yield (f, col_borde)
+
+    def _recorrido_lineal(self, datos, latitud, longitud, k, categoria, abiertos, radio_max_km):
+        """Distancia a todos los negocios; para puntos lejos de la grilla"""
+        candidatos = []
+        for entradas in datos['celdas'].values():
+            for entrada in entradas:
+                distancia = distancia_km(latitud, longitud, entrada[1], entrada[2])
+                if radio_max_km is not None and distancia > radio_max_km:
+                    continue
+                if self._aceptar(entrada, categoria, abiertos):
+                    candidatos.append((entrada[0], distancia))
+        candidatos.sort(key=lambda c: c[1])
+        return candidatos[:k]
+
+    def mas_cercanos(self, latitud, longitud, k=5, categoria=None, abiertos=False, radio_max_km=None):
+        """
+        Los k negocios más cercanos a un punto
+
+        La expansión por anillos empieza en el primero que toca la grilla y
+        cada anillo se recorta a sus límites; si harían falta más de
+        MAX_ANILLOS anillos se calcula la distancia a todos los negocios.
+
+        Returns:
+            Lista de tuplas (negocio, distancia_km) ordenada por distancia
+        """
+        datos = self.obtener()
+        if not datos['total']:
+            return []
+
+        celdas = datos['celdas']
+        limites = datos['limites']
+        centro = self._celda(latitud, longitud)
+        # Un anillo de radio r garantiza que todo lo que está fuera queda al
+        # menos a r celdas de distancia (en longitud escalada por la latitud)
+        km_celda = self.tamano_celda * KM_POR_GRADO * max(math.cos(math.radians(latitud)), 0.01)
+        fila_min, fila_max, col_min, col_max = limites
+        # Anillo desde el que empieza la grilla (0 si el punto está dentro) y el que la cubre entera
+        primer_anillo = max(fila_min - centro[0], centro[0] - fila_max, col_min - centro[1], centro[1] - col_max, 0)
+        max_anillos = max(
+            abs(fila_min - centro[0]), abs(fila_max - centro[0]),
+            abs(col_min - centro[1]), abs(col_max - centro[1])
+        )
+
+        if radio_max_km is not None and (primer_anillo - 1) * km_celda > radio_max_km:
+            return []
+        if max_anillos - primer_anillo >= MAX_ANILLOS:
+            return self._recorrido_lineal(datos, latitud, longitud, k, categoria, abiertos, radio_max_km)
+
+        candidatos = []
+        for radio in range(primer_anillo, max_anillos + 1):
+            for celda in self._anillo(centro, radio, limites):
+                for entrada in celdas.get(celda, ()):
+                    if self._aceptar(entrada, categoria, abiertos):
+                        distancia = distancia_km(latitud, longitud, entrada[1], entrada[2])
+                        candidatos.append((entrada[0], distancia))
+
+            cota = radio * km_celda
+            if radio_max_km is not None and cota > radio_max_km:
+                break
+            if len(candidatos) >= k:
+                candidatos.sort(key=lambda c: c[1])
+                if candidatos[k - 1][1] <= cota:
+                    break
+
+        if radio_max_km is not None:
+            candidatos = [c for c in candidatos if c[1] <= radio_max_km]
+        candidatos.sort(key=lambda c: c[1])
+        return candidatos[:k]
+
+    def en_radio(self, latitud, longitud, radio_km, categoria=None, abiertos=False):
+        """
+        Negocios dentro de un radio
+
+        Returns:
+            Lista de tuplas (negocio, distancia_km) ordenada por distancia
+        """
+        datos = self.obtener()
+        celdas = datos['celdas']
+
+        delta_lat = radio_km / KM_POR_GRADO
+        delta_lon = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(latitud)), 0.01))
+        fila_min, col_min = self._celda(latitud - delta_lat, longitud - delta_lon)
+        fila_max, col_max = self._celda(latitud + delta_lat, longitud + delta_lon)
+
+        resultados = []
+        for fila in range(fila_min, fila_max + 1):
+            for columna in range(col_min, col_max + 1):
+                for entrada in celdas.get((fila, columna), ()):
+                    distancia = distancia_km(latitud, longitud, entrada[1], entrada[2])
+                    if distancia <= radio_km and self._aceptar(entrada, categoria, abiertos):
+                        resultados.append((entrada[0], distancia))
+
+        resultados.sort(key=lambda r: r[1])
+        return resultados
+
+
+indice_geografico = IndiceGeografico()
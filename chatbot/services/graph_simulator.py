@@ -0,0 +1,364 @@
+"""
+Servidor local que imita la Graph API de Meta para pruebas de carga sin red
+
+Con META_GRAPH_BASE_URL apuntando aquí (p. ej. http://127.0.0.1:8765/v22.0)
+toda la aplicación corre sin tocar graph.facebook.com. Implementa:
+
+- POST /{phone_number_id}/messages   envíos y confirmaciones de lectura
+- POST /{phone_number_id}/media      subida de archivos
+- GET  /{media_id}                   datos del archivo (url, sha256, tamaño)
+- GET  /descargas/{media_id}         el archivo en sí
+- GET  /_simulador/registro          resumen de lo recibido (JSON)
+
+La latencia, la tasa de errores 5xx y los límites de tasa (429 con código
+130429 y Retry-After) son configurables. Cada mensaje aceptado puede
+devolver al webhook los estados sent/delivered/read, firmados con
+X-Hub-Signature-256 como lo hace Meta.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger('chatbot')
+
+# /v22.0/123/messages -> 123/messages (la versión es opcional)
+PREFIJO_VERSION = re.compile(r'^/v\d+(\.\d+)?(?=/)')
+ESTADOS_WEBHOOK = ('sent', 'delivered', 'read')
+
+
+class ConfigSimulador:
+    """
+    Args:
+        latencia_ms, variacion_ms: Demora de cada respuesta (uniforme en latencia ± variación)
+        tasa_error: Fracción de peticiones que responden 500 (código 131000)
+        tasa_429: Fracción de envíos que responden 429 (código 130429)
+        limite_rps: Envíos por segundo antes de responder 429 (0 = sin límite)
+        webhook_url: Adónde devolver los estados de los mensajes aceptados
+        secreto: Clave para firmar los webhooks (META_WEBHOOK_SECRET)
+        demora_estados_ms: Tiempo entre un estado y el siguiente
+        media_bytes: Tamaño de los archivos sintéticos
+        archivo_registro: Ruta de un JSONL con cada petición recibida
+    """
+
+    def __init__(self, latencia_ms=50, variacion_ms=20, tasa_error=0.0, tasa_429=0.0, limite_rps=0,
+                 webhook_url=None, secreto='', demora_estados_ms=200, media_bytes=64 * 1024,
+                 archivo_registro=None):
+        self.latencia_ms = latencia_ms
+        self.variacion_ms = variacion_ms
+        self.tasa_error = tasa_error
+        self.tasa_429 = tasa_429
+        self.limite_rps = limite_rps
+        self.webhook_url = webhook_url
+        self.secreto = secreto
+        self.demora_estados_ms = demora_estados_ms
+        self.media_bytes = media_bytes
+        self.archivo_registro = archivo_registro
+
+
+def firmar(cuerpo, secreto):
+    """Encabezado X-Hub-Signature-256 de un cuerpo de webhook"""
+    return 'sha256=' + hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+
+
+def payload_estados(phone_number_id, estados):
+    """
+    Cuerpo de webhook con estados de entrega
+
+    Args:
+        estados: Lista de (wamid, estado, destinatario)
+    """
+    ahora = str(int(time.time()))
+    return {
+        'object': 'whatsapp_business_account',
+        'entry': [{
+            'id': 'simulador',
+            'changes': [{
+                'field': 'messages',
+                'value': {
+                    'messaging_product': 'whatsapp',
+                    'metadata': {'display_phone_number': '000000', 'phone_number_id': phone_number_id},
+                    'statuses': [
+                        {'id': wamid, 'status': estado, 'timestamp': ahora, 'recipient_id': destinatario}
+                        for wamid, estado, destinatario in estados
+                    ],
+                },
+            }],
+        }],
+    }
+
+
+class SimuladorGraph:
+    """
+    Graph API falsa servida en hilos de fondo
+
+    Args:
+        observador: Función llamada con (wamid, cuerpo) por cada mensaje
+            aceptado, desde el hilo que atiende la petición
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', puerto=8765, observador=None):
+        self.config = config or ConfigSimulador()
+        self.host = host
+        self.puerto = puerto
+        self.observador = observador
+        self.contador = Counter()         # "POST messages 200" -> n
+        self.recibidos = Counter()        # tipo de mensaje -> n
+        self.webhooks = Counter()         # "enviados" / "fallidos"
+        self.medios = {}                  # media_id -> (bytes, mime_type)
+        self._ventana = (0, 0)            # (segundo, envíos en ese segundo) para limite_rps
+        self._lock = threading.Lock()
+        self._callbacks = queue.Queue()
+        self._registro = open(self.config.archivo_registro, 'a') if self.config.archivo_registro else None
+        self._servidor = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._servidor.server_port if self._servidor else self.puerto}/v22.0"
+
+    # ==================== CICLO DE VIDA ====================
+
+    def iniciar(self):
+        """Atender en hilos de fondo; devuelve la URL base para META_GRAPH_BASE_URL"""
+        manejador = type('Manejador', (ManejadorGraph,), {'simulador': self})
+        self._servidor = ServidorGraph((self.host, self.puerto), manejador)
+        threading.Thread(target=self._servidor.serve_forever, name='simulador-graph', daemon=True).start()
+        if self.config.webhook_url:
+            threading.Thread(target=self._enviar_callbacks, name='simulador-webhooks', daemon=True).start()
+        return self.base_url
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+        if self._registro is not None:
+            self._registro.close()
+
+    # ==================== RESPUESTAS ====================
+
+    def demorar(self):
+        config = self.config
+        ms = config.latencia_ms + random.uniform(-config.variacion_ms, config.variacion_ms)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def limitar(self):
+        """Respuesta de límite de tasa, o None si el envío pasa"""
+        if random.random() < self.config.tasa_429:
+            return 429, {'Retry-After': '1'}, _error(130429, 'Rate limit hit')
+        if self.config.limite_rps:
+            segundo = int(time.monotonic())
+            with self._lock:
+                inicio, envios = self._ventana
+                envios = envios + 1 if inicio == segundo else 1
+                self._ventana = (segundo, envios)
+            if envios > self.config.limite_rps:
+                return 429, {'Retry-After': '1'}, _error(130429, 'Rate limit hit')
+        return None
+
+    def mensaje(self, phone_number_id, cuerpo):
+        if cuerpo.get('status') == 'read':
+            self._contar_recibido('read' + ('+typing' if cuerpo.get('typing_indicator') else ''))
+            return 200, {}, {'success': True}
+
+        limitado = self.limitar()
+        if limitado:
+            return limitado
+        destinatario = cuerpo.get('to', '')
+        wamid = f"wamid.SIM{uuid.uuid4().hex[:24]}"
+        self._contar_recibido(cuerpo.get('type', 'desconocido'))
+        if self.config.webhook_url:
+            self._callbacks.put((time.monotonic(), phone_number_id, wamid, destinatario, 0))
+        if self.observador is not None:
+            self.observador(wamid, cuerpo)
+        return 200, {}, {
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': destinatario, 'wa_id': destinatario}],
+            'messages': [{'id': wamid}],
+        }
+
+    def subir_media(self, contenido, mime_type):
+        media_id = str(random.randint(10 ** 14, 10 ** 15))
+        with self._lock:
+            self.medios[media_id] = (contenido, mime_type)
+        return 200, {}, {'id': media_id}
+
+    def info_media(self, media_id):
+        contenido, mime_type = self.archivo(media_id)
+        return 200, {}, {
+            'messaging_product': 'whatsapp',
+            'url': f"http://{self.host}:{self._servidor.server_port}/descargas/{media_id}",
+            'mime_type': mime_type,
+            'sha256': hashlib.sha256(contenido).hexdigest(),
+            'file_size': len(contenido),
+            'id': media_id,
+        }
+
+    def archivo(self, media_id):
+        """Contenido subido, o uno sintético y determinista para cualquier otro ID"""
+        with self._lock:
+            if media_id in self.medios:
+                return self.medios[media_id]
+        semilla = hashlib.sha256(media_id.encode()).digest()
+        repeticiones = self.config.media_bytes // len(semilla) + 1
+        return (semilla * repeticiones)[:self.config.media_bytes], 'image/jpeg'
+
+    def resumen(self):
+        with self._lock:
+            return {
+                'peticiones': dict(self.contador),
+                'mensajes': dict(self.recibidos),
+                'webhooks': dict(self.webhooks),
+                'medios_subidos': len(self.medios),
+            }
+
+    def registrar(self, metodo, ruta, estado, cuerpo):
+        with self._lock:
+            self.contador[f"{metodo} {_endpoint(ruta)} {estado}"] += 1
+            if self._registro is not None:
+                self._registro.write(json.dumps({
+                    'hora': time.time(), 'metodo': metodo, 'ruta': ruta, 'estado': estado, 'cuerpo': cuerpo,
+                }, ensure_ascii=False) + '\n')
+
+    def _contar_recibido(self, tipo):
+        with self._lock:
+            self.recibidos[tipo] += 1
+
+    # ==================== WEBHOOKS ====================
+
+    def _enviar_callbacks(self):
+        """Devolver sent, delivered y read de cada mensaje, con demora entre uno y otro"""
+        sesion = requests.Session()
+        demora = self.config.demora_estados_ms / 1000
+        while True:
+            momento, phone_number_id, wamid, destinatario, indice = self._callbacks.get()
+            espera = momento + demora - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+
+            cuerpo = json.dumps(payload_estados(
+                phone_number_id, [(wamid, ESTADOS_WEBHOOK[indice], destinatario)]
+            )).encode()
+            encabezados = {'Content-Type': 'application/json'}
+            if self.config.secreto:
+                encabezados['X-Hub-Signature-256'] = firmar(cuerpo, self.config.secreto)
+            try:
+                sesion.post(self.config.webhook_url, data=cuerpo, headers=encabezados, timeout=10)
+                resultado = 'enviados'
+            except requests.exceptions.RequestException as e:
+                resultado = 'fallidos'
+                logger.warning(f"Simulador: no se pudo entregar el webhook: {e}")
+            with self._lock:
+                self.webhooks[resultado] += 1
+
+            if indice + 1 < len(ESTADOS_WEBHOOK):
+                self._callbacks.put((time.monotonic(), phone_number_id, wamid, destinatario, indice + 1))
+
+
+class ServidorGraph(ThreadingHTTPServer):
+    daemon_threads = True
+    # Muchas conexiones a la vez durante una prueba de carga
+    request_queue_size = 1024
+
+
+class ManejadorGraph(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    simulador = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        simulador = self.simulador
+        ruta = PREFIJO_VERSION.sub('', self.path.split('?')[0])
+        partes = ruta.strip('/').split('/')
+
+        if ruta == '/_simulador/registro':
+            return self._json(200, {}, simulador.resumen())
+        simulador.demorar()
+        if len(partes) == 2 and partes[0] == 'descargas':
+            contenido, mime_type = simulador.archivo(partes[1])
+            simulador.registrar('GET', ruta, 200, None)
+            return self._responder(200, {'Content-Type': mime_type}, contenido)
+        if len(partes) == 1 and partes[0]:
+            estado, encabezados, cuerpo = simulador.info_media(partes[0])
+            simulador.registrar('GET', ruta, estado, None)
+            return self._json(estado, encabezados, cuerpo)
+        return self._json(404, {}, _error(100, 'Unknown path'))
+
+    def do_POST(self):
+        simulador = self.simulador
+        ruta = PREFIJO_VERSION.sub('', self.path.split('?')[0])
+        partes = ruta.strip('/').split('/')
+        datos = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        simulador.demorar()
+        if random.random() < simulador.config.tasa_error:
+            respuesta = 500, {}, _error(131000, 'Something went wrong')
+            cuerpo = None
+        elif len(partes) == 2 and partes[1] == 'messages':
+            try:
+                cuerpo = json.loads(datos or b'{}')
+            except ValueError:
+                cuerpo = None
+            if not isinstance(cuerpo, dict):
+                respuesta = 400, {}, _error(100, 'Invalid parameter')
+            else:
+                respuesta = simulador.mensaje(partes[0], cuerpo)
+        elif len(partes) == 2 and partes[1] == 'media':
+            cuerpo = None
+            respuesta = simulador.subir_media(*_archivo_multipart(self.headers.get('Content-Type', ''), datos))
+        else:
+            cuerpo = None
+            respuesta = 404, {}, _error(100, 'Unknown path')
+
+        simulador.registrar('POST', ruta, respuesta[0], cuerpo)
+        self._json(*respuesta)
+
+    def _json(self, estado, encabezados, cuerpo):
+        self._responder(estado, dict(encabezados, **{'Content-Type': 'application/json'}), json.dumps(cuerpo).encode())
+
+    def _responder(self, estado, encabezados, contenido):
+        self.send_response(estado)
+        for clave, valor in encabezados.items():
+            self.send_header(clave, valor)
+        self.send_header('Content-Length', str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+
+def _error(codigo, mensaje):
+    return {'error': {'message': mensaje, 'type': 'OAuthException', 'code': codigo, 'fbtrace_id': 'simulador'}}
+
+
+def _endpoint(ruta):
+    """Nombre del endpoint para los contadores, sin IDs"""
+    partes = ruta.strip('/').split('/')
+    if len(partes) == 2 and partes[1] in ('messages', 'media'):
+        return partes[1]
+    if partes[0] == 'descargas':
+        return 'descargas'
+    return 'media_info'
+
+
+def _archivo_multipart(content_type, datos):
+    """(contenido, mime_type) del campo `file` de un multipart/form-data"""
+    limite = re.search(r'boundary=([^;]+)', content_type)
+    if not limite:
+        return datos, 'application/octet-stream'
+    for parte in datos.split(b'--' + limite.group(1).strip('"').encode()):
+        cabecera, _, contenido = parte.partition(b'\r\n\r\n')
+        if b'name="file"' in cabecera:
+            tipo = re.search(rb'Content-Type: ([^\r\n]+)', cabecera)
+            return contenido.rstrip(b'\r\n'), tipo.group(1).decode() if tipo else 'application/octet-stream'
+    return b'', 'application/octet-stream'
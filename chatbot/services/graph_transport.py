@@ -0,0 +1,167 @@
+"""
+Transporte HTTP compartido para la Graph API de Meta
+
+Una sola `requests.Session` por proceso con un pool de conexiones keep-alive:
+los envíos reutilizan la conexión TLS abierta con graph.facebook.com en lugar
+de abrir una nueva (DNS, TCP y handshake TLS) en cada mensaje. La política de
+reintentos y timeouts es la misma para todos los métodos de WhatsAppService,
+y cada endpoint lleva sus métricas de latencia.
+
+Los POST solo se reintentan si la conexión falló antes de enviar la petición;
+reintentar un POST ya enviado podría duplicar el mensaje.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('chatbot')
+
+# Muestras por endpoint para calcular el percentil 95
+MUESTRAS_LATENCIA = 256
+
+
+class MetricasEndpoint:
+
+    def __init__(self):
+        self.peticiones = 0
+        self.errores = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.muestras = deque(maxlen=MUESTRAS_LATENCIA)
+
+    def registrar(self, ms, ok):
+        self.peticiones += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.muestras.append(ms)
+        if not ok:
+            self.errores += 1
+
+    def resumen(self):
+        ordenadas = sorted(self.muestras)
+        return {
+            'peticiones': self.peticiones,
+            'errores': self.errores,
+            'promedio_ms': round(self.total_ms / self.peticiones, 2) if self.peticiones else None,
+            'p95_ms': round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))], 2) if ordenadas else None,
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class TransporteGraph:
+
+    def __init__(self):
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._metricas = {}
+        self._pool_maxsize = None
+
+    @property
+    def session(self):
+        # Una sesión por proceso: tras un fork los sockets heredados no se comparten
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._crear_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    @property
+    def pool_maxsize(self):
+        return self._pool_maxsize or settings.GRAPH_HTTP_POOL_MAXSIZE
+
+    def asegurar_pool(self, tamano):
+        """Agrandar el pool para `tamano` hilos simultáneos (p. ej. `manage.py broadcast`)"""
+        with self._lock:
+            if tamano <= self.pool_maxsize:
+                return
+            self._pool_maxsize = tamano
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _crear_session(self):
+        reintentos = Retry(
+            total=settings.GRAPH_HTTP_RETRIES,
+            connect=settings.GRAPH_HTTP_RETRIES,
+            read=settings.GRAPH_HTTP_RETRIES,
+            status=settings.GRAPH_HTTP_RETRIES,
+            backoff_factor=settings.GRAPH_HTTP_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            # Errores de lectura y de estado solo se reintentan en GET
+            allowed_methods=frozenset({'GET'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adaptador = HTTPAdapter(
+            pool_connections=settings.GRAPH_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=reintentos,
+        )
+        session = requests.Session()
+        session.mount('https://', adaptador)
+        session.mount('http://', adaptador)
+        logger.info(
+            f"Transporte Graph API: pool de {self.pool_maxsize} conexiones por host, "
+            f"{settings.GRAPH_HTTP_RETRIES} reintentos"
+        )
+        return session
+
+    def request(self, metodo, url, endpoint, timeout=None, **kwargs):
+        """
+        Petición por la sesión compartida, medida bajo el nombre `endpoint`
+
+        Los errores (requests.exceptions.RequestException) se propagan igual
+        que con requests.post/get.
+        """
+        if timeout is None:
+            timeout = (settings.GRAPH_HTTP_CONNECT_TIMEOUT, settings.GRAPH_HTTP_READ_TIMEOUT)
+        inicio = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(metodo, url, timeout=timeout, **kwargs)
+            ok = response.ok
+            return response
+        finally:
+            self.registrar(endpoint, (time.perf_counter() - inicio) * 1000, ok)
+
+    def registrar(self, endpoint, ms, ok):
+        """Sumar una petición a las métricas (también las del cliente asíncrono)"""
+        with self._lock:
+            self._metricas.setdefault(endpoint, MetricasEndpoint()).registrar(ms, ok)
+
+    def post(self, url, endpoint, **kwargs):
+        return self.request('POST', url, endpoint, **kwargs)
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def resumen(self):
+        """Latencia por endpoint y conexiones abiertas frente a peticiones por host"""
+        with self._lock:
+            endpoints = {nombre: m.resumen() for nombre, m in sorted(self._metricas.items())}
+
+        hosts = {}
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            for adaptador in set(session.adapters.values()):
+                for clave in list(adaptador.poolmanager.pools.keys()):
+                    pool = adaptador.poolmanager.pools.get(clave)
+                    if pool is None:
+                        continue
+                    hosts[pool.host] = {
+                        'conexiones_abiertas': pool.num_connections,
+                        'peticiones': pool.num_requests,
+                    }
+        return {'endpoints': endpoints, 'hosts': hosts}
+
+
+transporte_graph = TransporteGraph()
@@ -0,0 +1,292 @@
+"""
+Índice semanal de horarios de atención con resolución de minutos
+
+Cada semana se representa como minutos 0..10079 (lunes 00:00 = 0) en la zona
+horaria del proyecto (America/Bogota). Los horarios que cierran después de
+medianoche (hora_cierre < hora_apertura) se extienden al día siguiente, y el
+domingo se enlaza con el lunes.
+"""
+import logging
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .query_cache import IndiceVersionado
+from .search_index import normalizar_texto
+
+logger = logging.getLogger('chatbot')
+
+MINUTOS_DIA = 24 * 60
+MINUTOS_SEMANA = 7 * MINUTOS_DIA
+
+DIAS_SEMANA = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+INDICE_DIA = {dia: i for i, dia in enumerate(DIAS_SEMANA)}
+
+
+def minuto_semana(momento):
+    """Convertir un datetime al minuto de la semana en la hora local"""
+    local = timezone.localtime(momento)
+    return local.weekday() * MINUTOS_DIA + local.hour * 60 + local.minute
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _formatear_minuto(minuto):
+    hora = (minuto % MINUTOS_DIA) // 60
+    minutos = minuto % 60
+    sufijo = 'AM' if hora < 12 else 'PM'
+    return f"{(hora % 12) or 12:02d}:{minutos:02d} {sufijo}"
+
+
+def intervalos_horario(dia, hora_apertura, hora_cierre):
+    """
+    Intervalos [inicio, fin) de la semana para un horario diario
+
+    Un cierre anterior a la apertura se interpreta como cierre al día
+    siguiente; apertura igual al cierre se interpreta como 24 horas.
+    """
+    inicio = INDICE_DIA[dia] * MINUTOS_DIA + _minutos(hora_apertura)
+    duracion = (_minutos(hora_cierre) - _minutos(hora_apertura)) % MINUTOS_DIA or MINUTOS_DIA
+    fin = inicio + duracion
+
+    if fin <= MINUTOS_SEMANA:
+        return [(inicio, fin)]
+    return [(inicio, MINUTOS_SEMANA), (0, fin - MINUTOS_SEMANA)]
+
+
+def fusionar_intervalos(intervalos):
+    """Ordenar y unir intervalos solapados o contiguos"""
+    fusionados = []
+    for inicio, fin in sorted(intervalos):
+        if fusionados and inicio <= fusionados[-1][1]:
+            fusionados[-1] = (fusionados[-1][0], max(fusionados[-1][1], fin))
+        else:
+            fusionados.append((inicio, fin))
+    return fusionados
+
+
+class HorarioCompilado:
+    """Semana compilada de un negocio"""
+
+    __slots__ = ('negocio', 'intervalos', 'inicios', 'horarios')
+
+    def __init__(self, negocio, horarios):
+        self.negocio = negocio
+        self.horarios = {h.dia_semana: h for h in horarios}
+
+        intervalos = []
+        for h in horarios:
+            if not h.cerrado and h.dia_semana in INDICE_DIA:
+                intervalos.extend(intervalos_horario(h.dia_semana, h.hora_apertura, h.hora_cierre))
+        self.intervalos = fusionar_intervalos(intervalos)
+        self.inicios = [inicio for inicio, _ in self.intervalos]
+
+    def intervalo_en(self, minuto):
+        """Intervalo abierto que contiene el minuto, o None"""
+        i = bisect_right(self.inicios, minuto) - 1
+        if i >= 0 and minuto < self.intervalos[i][1]:
+            return self.intervalos[i]
+        return None
+
+    def minuto_cierre(self, minuto):
+        """Minuto (absoluto desde el lunes, puede pasar de la semana) en que cierra"""
+        intervalo = self.intervalo_en(minuto)
+        if intervalo is None:
+            return None
+        fin = intervalo[1]
+        # Intervalo que cruza del domingo al lunes
+        if fin == MINUTOS_SEMANA and self.intervalos[0][0] == 0 and self.intervalos[0] != intervalo:
+            fin = MINUTOS_SEMANA + self.intervalos[0][1]
+        return fin
+
+    def minutos_hasta_apertura(self, minuto):
+        """Minutos que faltan para la próxima apertura, o None si nunca abre"""
+        if not self.intervalos:
+            return None
+        i = bisect_right(self.inicios, minuto)
+        if i < len(self.inicios):
+            return self.inicios[i] - minuto
+        return MINUTOS_SEMANA - minuto + self.inicios[0]
+
+
+class IndiceHorarios(IndiceVersionado):
+    """
+    Índice en memoria de los horarios de todos los negocios activos.
+
+    Además de la semana compilada de cada negocio guarda, para cada tramo
+    entre dos cambios de estado, una máscara de bits con los negocios abiertos,
+    de modo que "¿qué está abierto ahora?" es una búsqueda binaria. Se
+    reconstruye cuando cambian horarios o negocios en cualquier worker (ver
+    IndiceVersionado).
+    """
+
+    def modelos(self):
+        from ..models import HorarioAtencion, Negocio
+        return (HorarioAtencion, Negocio)
+
+    def _construir(self):
+        from ..models import HorarioAtencion
+
+        por_negocio = {}
+        negocios = {}
+        horarios = HorarioAtencion.objects.filter(negocio__activo=True).select_related('negocio')
+        for horario in horarios:
+            negocios[horario.negocio_id] = horario.negocio
+            por_negocio.setdefault(horario.negocio_id, []).append(horario)
+
+        compilados = {}
+        ids = []
+        altas = {}
+        bajas = {}
+        por_categoria = {}
+
+        for negocio_id, lista in por_negocio.items():
+            compilado = HorarioCompilado(negocios[negocio_id], lista)
+            compilados[negocio_id] = compilado
+
+            bit = 1 << len(ids)
+            ids.append(negocio_id)
+
+            categoria = normalizar_texto(compilado.negocio.categoria)
+            por_categoria[categoria] = por_categoria.get(categoria, 0) | bit
+
+            for inicio, fin in compilado.intervalos:
+                altas[inicio] = altas.get(inicio, 0) | bit
+                bajas[fin] = bajas.get(fin, 0) | bit
+
+        # Tramos de la semana con la máscara de negocios abiertos en cada uno
+        cortes = sorted({0, *altas, *bajas} - {MINUTOS_SEMANA})
+        mascaras = []
+        mascara = 0
+        for corte in cortes:
+            mascara = (mascara & ~bajas.get(corte, 0)) | altas.get(corte, 0)
+            mascaras.append(mascara)
+
+        logger.info(f"Índice de horarios construido: {len(ids)} negocios, {len(cortes)} tramos")
+        return {
+            'compilados': compilados,
+            'ids': ids,
+            'cortes': cortes,
+            'mascaras': mascaras,
+            'por_categoria': por_categoria,
+            'mascaras_categoria': {},
+        }
+
+    def _mascara_categoria(self, datos, categoria):
+        clave = normalizar_texto(categoria)
+        mascara = datos['mascaras_categoria'].get(clave)
+        if mascara is None:
+            mascara = 0
+            for nombre, bits in datos['por_categoria'].items():
+                if clave in nombre:
+                    mascara |= bits
+            datos['mascaras_categoria'][clave] = mascara
+        return mascara
+
+    # ==================== CONSULTAS ====================
+
+    def esta_abierto(self, negocio_id, momento=None):
+        """True/False según el horario, o None si el negocio no tiene horarios"""
+        compilado = self.obtener()['compilados'].get(negocio_id)
+        if compilado is None:
+            return None
+        return compilado.intervalo_en(minuto_semana(momento or timezone.now())) is not None
+
+    def estan_abiertos(self, negocio_ids, momento=None):
+        """Versión por lotes de esta_abierto: una lista de True/False/None"""
+        compilados = self.obtener()['compilados']
+        minuto = minuto_semana(momento or timezone.now())
+        resultado = []
+        for negocio_id in negocio_ids:
+            compilado = compilados.get(negocio_id)
+            resultado.append(None if compilado is None else compilado.intervalo_en(minuto) is not None)
+        return resultado
+
+    def proxima_apertura(self, negocio_id, momento=None):
+        """Datetime de la próxima apertura (o None si no abre en la semana)"""
+        momento = momento or timezone.now()
+        compilado = self.obtener()['compilados'].get(negocio_id)
+        if compilado is None:
+            return None
+        faltan = compilado.minutos_hasta_apertura(minuto_semana(momento))
+        if faltan is None:
+            return None
+        return timezone.localtime(momento).replace(second=0, microsecond=0) + timedelta(minutes=faltan)
+
+    def abiertos(self, categoria=None, momento=None):
+        """Negocios (instancias) abiertos en el momento dado, filtrando por categoría"""
+        datos = self.obtener()
+        cortes = datos['cortes']
+        if not cortes:
+            return []
+
+        i = bisect_right(cortes, minuto_semana(momento or timezone.now())) - 1
+        mascara = datos['mascaras'][i]
+        if categoria:
+            mascara &= self._mascara_categoria(datos, categoria)
+
+        negocios = []
+        ids = datos['ids']
+        compilados = datos['compilados']
+        while mascara:
+            bit = mascara & -mascara
+            negocios.append(compilados[ids[bit.bit_length() - 1]].negocio)
+            mascara ^= bit
+        negocios.sort(key=lambda n: n.nombre)
+        return negocios
+
+    def proximo_cambio(self, momento=None):
+        """Datetime del próximo minuto en que algún negocio abre o cierra"""
+        momento = momento or timezone.now()
+        cortes = self.obtener()['cortes']
+        if not cortes:
+            return None
+        minuto = minuto_semana(momento)
+        i = bisect_right(cortes, minuto)
+        faltan = cortes[i] - minuto if i < len(cortes) else MINUTOS_SEMANA - minuto + cortes[0]
+        return timezone.localtime(momento).replace(second=0, microsecond=0) + timedelta(minutes=faltan)
+
+    def estado(self, negocio_id, momento=None):
+        """
+        Estado de apertura con el mismo formato que verificar_negocio_abierto
+
+        Returns:
+            Dict con 'abierto' (True/False/None), 'mensaje' y, si existe, el
+            'horario' del día
+        """
+        momento = momento or timezone.now()
+        compilado = self.obtener()['compilados'].get(negocio_id)
+        if compilado is None:
+            return {'abierto': None, 'mensaje': 'No hay información de horario para hoy'}
+
+        minuto = minuto_semana(momento)
+        dia_actual = DIAS_SEMANA[minuto // MINUTOS_DIA]
+        horario = compilado.horarios.get(dia_actual)
+
+        cierre = compilado.minuto_cierre(minuto)
+        if cierre is not None:
+            return {
+                'abierto': True,
+                'mensaje': f'Abierto hasta las {_formatear_minuto(cierre)}',
+                'horario': horario
+            }
+
+        if horario is None:
+            return {'abierto': None, 'mensaje': 'No hay información de horario para hoy'}
+
+        if horario.cerrado:
+            return {'abierto': False, 'mensaje': f'Cerrado los {dia_actual}s', 'horario': horario}
+
+        faltan = compilado.minutos_hasta_apertura(minuto)
+        apertura = (minuto + faltan) % MINUTOS_SEMANA
+        if apertura // MINUTOS_DIA == minuto // MINUTOS_DIA and faltan < MINUTOS_DIA:
+            mensaje = f'Abre a las {_formatear_minuto(apertura)}'
+        else:
+            mensaje = f'Abre el {DIAS_SEMANA[apertura // MINUTOS_DIA]} a las {_formatear_minuto(apertura)}'
+        return {'abierto': False, 'mensaje': mensaje, 'horario': horario}
+
+
+indice_horarios = IndiceHorarios()
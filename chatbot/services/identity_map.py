@@ -0,0 +1,95 @@
+"""
+Mapa de identidad con alcance de un mensaje
+
+Mientras se arma la respuesta a un mensaje, las mismas consultas se repiten
+en varias secciones del contexto (general, horarios, ubicación, productos).
+Dentro de `contexto_mensaje()` cada llamada a un método @por_mensaje se
+resuelve una sola vez y las instancias de modelos se comparten: dos
+resultados que contienen el mismo negocio devuelven el mismo objeto. El mapa
+vive en una ContextVar y se descarta al terminar el mensaje, así que nunca
+se reutiliza de un mensaje a otro.
+"""
+import functools
+import inspect
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import models
+
+from .query_cache import argumentos_normalizados, materializar
+
+logger = logging.getLogger('chatbot')
+
+
+class MapaIdentidad:
+
+    def __init__(self):
+        self.llamadas = {}     # (método, argumentos) -> resultado
+        self.instancias = {}   # (modelo, pk) -> instancia
+        self.aciertos = 0
+
+    def canonizar(self, valor):
+        """Reemplazar cada instancia por la primera cargada con la misma clave"""
+        if isinstance(valor, models.Model):
+            if valor.pk is None:
+                return valor
+            return self.instancias.setdefault((valor._meta.label_lower, valor.pk), valor)
+        if isinstance(valor, list):
+            return [self.canonizar(v) for v in valor]
+        if isinstance(valor, tuple):
+            return tuple(self.canonizar(v) for v in valor)
+        if isinstance(valor, dict):
+            return {k: self.canonizar(v) for k, v in valor.items()}
+        return valor
+
+    def instancia(self, modelo, pk):
+        """Instancia ya cargada en este mensaje, o None"""
+        return self.instancias.get((modelo._meta.label_lower, pk))
+
+
+_mapa_actual = ContextVar('mapa_identidad', default=None)
+
+
+def mapa_actual():
+    """Mapa del mensaje en curso, o None fuera de contexto_mensaje()"""
+    return _mapa_actual.get()
+
+
+@contextmanager
+def contexto_mensaje():
+    """Abrir un mapa de identidad nuevo (también sirve como decorador)"""
+    mapa = MapaIdentidad()
+    token = _mapa_actual.set(mapa)
+    try:
+        yield mapa
+    finally:
+        _mapa_actual.reset(token)
+        if mapa.aciertos:
+            logger.debug(
+                f"Mapa de identidad: {mapa.aciertos} llamadas repetidas evitadas, "
+                f"{len(mapa.instancias)} instancias"
+            )
+
+
+def por_mensaje(funcion):
+    """Resolver cada llamada idéntica una sola vez por mensaje"""
+    firma = inspect.signature(funcion)
+    nombre = funcion.__qualname__
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        mapa = _mapa_actual.get()
+        if mapa is None:
+            return funcion(*args, **kwargs)
+
+        clave = (nombre, argumentos_normalizados(firma, args, kwargs))
+        if clave in mapa.llamadas:
+            mapa.aciertos += 1
+            return mapa.llamadas[clave]
+
+        resultado = mapa.canonizar(materializar(funcion(*args, **kwargs)))
+        mapa.llamadas[clave] = resultado
+        return resultado
+
+    return envoltura
@@ -0,0 +1,253 @@
+"""
+Almacén local de medios direccionado por contenido
+
+Los archivos se guardan una sola vez bajo MEDIA_STORE_DIR/ab/cd/<sha256><ext>.
+Se escriben por partes mientras se descargan (nunca el archivo completo en
+memoria), con un tamaño máximo, en un temporal que se renombra al final: un
+archivo a medio escribir nunca queda con su nombre definitivo.
+
+Cada ArchivoMedia lleva un contador de referencias (mensajes que lo usan) y
+la fecha del último acceso; recolectar() borra los que nadie referencia, por
+antigüedad y luego por tamaño total (los menos usados primero).
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.db.models import F, Sum
+from django.utils import timezone
+
+logger = logging.getLogger('chatbot')
+
+
+class MediaDemasiadoGrande(Exception):
+    """El archivo supera MEDIA_MAX_BYTES"""
+
+
+class MediaCorrupto(Exception):
+    """El SHA-256 descargado no coincide con el informado por Meta"""
+
+
+class AlmacenMedia:
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def raiz(self):
+        return Path(settings.MEDIA_STORE_DIR)
+
+    def ruta_absoluta(self, archivo):
+        return self.raiz / archivo.ruta
+
+    # ==================== LECTURA ====================
+
+    def buscar(self, sha256):
+        """ArchivoMedia con ese contenido si está en disco (marca el acceso), o None"""
+        from ..models import ArchivoMedia
+
+        if not sha256:
+            return None
+        archivo = ArchivoMedia.objects.filter(sha256=sha256).first()
+        if archivo is None:
+            return None
+        if not self.ruta_absoluta(archivo).exists():
+            # Borrado a mano o por otra instancia: la fila ya no sirve
+            archivo.delete()
+            return None
+        ArchivoMedia.objects.filter(sha256=sha256).update(ultimo_acceso=timezone.now())
+        return archivo
+
+    # ==================== ESCRITURA ====================
+
+    def guardar_stream(self, partes, mime_type='', max_bytes=None, sha256_esperado=None):
+        """
+        Guardar un archivo a partir de un iterable de bytes
+
+        Args:
+            partes: Iterable de bloques (p. ej. response.iter_content())
+            mime_type: Tipo MIME, para la extensión
+            max_bytes: Tamaño máximo (por defecto, MEDIA_MAX_BYTES)
+            sha256_esperado: Si se conoce, se verifica al terminar
+
+        Returns:
+            ArchivoMedia (el existente si el contenido ya estaba)
+
+        Raises:
+            MediaDemasiadoGrande, MediaCorrupto
+        """
+        from ..models import ArchivoMedia
+
+        max_bytes = max_bytes or settings.MEDIA_MAX_BYTES
+        temporales = self.raiz / 'tmp'
+        temporales.mkdir(parents=True, exist_ok=True)
+
+        resumen = hashlib.sha256()
+        tamano = 0
+        fd, temporal = tempfile.mkstemp(dir=temporales)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for parte in partes:
+                    if not parte:
+                        continue
+                    tamano += len(parte)
+                    if tamano > max_bytes:
+                        raise MediaDemasiadoGrande(f"El archivo supera {max_bytes} bytes")
+                    resumen.update(parte)
+                    f.write(parte)
+
+            sha256 = resumen.hexdigest()
+            if sha256_esperado and sha256 != sha256_esperado:
+                raise MediaCorrupto(f"SHA-256 {sha256} distinto del esperado {sha256_esperado}")
+
+            existente = self.buscar(sha256)
+            if existente is not None:
+                return existente
+
+            mime_type = (mime_type or '').split(';')[0].strip()
+            extension = (mimetypes.guess_extension(mime_type) or '') if mime_type else ''
+            ruta = f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+            destino = self.raiz / ruta
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporal, destino)
+            temporal = None
+
+            try:
+                return ArchivoMedia.objects.create(sha256=sha256, ruta=ruta, mime_type=mime_type, tamano=tamano)
+            except IntegrityError:
+                # Otro proceso guardó el mismo contenido a la vez
+                return ArchivoMedia.objects.get(sha256=sha256)
+        finally:
+            if temporal is not None and os.path.exists(temporal):
+                os.remove(temporal)
+
+    # ==================== REFERENCIAS ====================
+
+    def adquirir(self, sha256):
+        from ..models import ArchivoMedia
+        ArchivoMedia.objects.filter(sha256=sha256).update(referencias=F('referencias') + 1, ultimo_acceso=timezone.now())
+
+    def liberar(self, sha256):
+        from ..models import ArchivoMedia
+        ArchivoMedia.objects.filter(sha256=sha256, referencias__gt=0).update(referencias=F('referencias') - 1)
+
+    def vincular(self, message, archivo):
+        """Asociar el archivo al mensaje y contar la referencia"""
+        from ..models import Message
+
+        Message.objects.filter(pk=message.pk).update(archivo=archivo)
+        message.archivo = archivo
+        self.adquirir(archivo.sha256)
+
+    def guardar_entrante(self, message_pk, media_id):
+        """
+        Descargar en segundo plano el medio de un mensaje entrante y vincularlo
+
+        Los hilos son pocos (MEDIA_DOWNLOAD_WORKERS): un video grande no
+        retrasa la respuesta del webhook ni ocupa un worker web.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.MEDIA_DOWNLOAD_WORKERS, thread_name_prefix='media'
+                )
+        self._executor.submit(self._guardar_entrante, message_pk, media_id)
+
+    def _guardar_entrante(self, message_pk, media_id):
+        from ..models import Message
+        from .whatsapp_service import WhatsAppService
+
+        close_old_connections()
+        try:
+            archivo = WhatsAppService().descargar_a_almacen(media_id)
+            message = Message.objects.filter(pk=message_pk).first()
+            if archivo is not None and message is not None:
+                self.vincular(message, archivo)
+        except Exception as e:
+            logger.error(f"Error guardando media {media_id}: {e}")
+        finally:
+            close_old_connections()
+
+    # ==================== RECOLECCIÓN ====================
+
+    def recolectar(self, max_bytes=None, max_edad=None, simular=False):
+        """
+        Borrar archivos sin referencias: primero los no usados en `max_edad`,
+        luego los menos usados hasta que el almacén quepa en `max_bytes`
+
+        Los usados en los últimos MEDIA_STORE_MIN_AGE_MINUTES nunca se borran:
+        un archivo recién guardado (o encontrado con buscar()) todavía no
+        tiene la referencia que le suma vincular().
+
+        Returns:
+            (archivos borrados, bytes liberados); con `simular`, los que se
+            borrarían
+        """
+        from ..models import ArchivoMedia
+
+        max_bytes = settings.MEDIA_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        max_edad = timedelta(days=settings.MEDIA_STORE_MAX_AGE_DAYS) if max_edad is None else max_edad
+        limite = timezone.now() - timedelta(minutes=settings.MEDIA_STORE_MIN_AGE_MINUTES)
+
+        libres = ArchivoMedia.objects.filter(referencias__lte=0, ultimo_acceso__lt=limite)
+        a_borrar = list(libres.filter(ultimo_acceso__lt=timezone.now() - max_edad))
+
+        total = (ArchivoMedia.objects.aggregate(total=Sum('tamano'))['total'] or 0)
+        total -= sum(a.tamano for a in a_borrar)
+        if total > max_bytes:
+            vistos = {a.sha256 for a in a_borrar}
+            for archivo in libres.order_by('ultimo_acceso').iterator():
+                if total <= max_bytes:
+                    break
+                if archivo.sha256 in vistos:
+                    continue
+                a_borrar.append(archivo)
+                total -= archivo.tamano
+
+        if simular:
+            return len(a_borrar), sum(a.tamano for a in a_borrar)
+
+        cantidad = liberados = 0
+        for archivo in a_borrar:
+            # La condición evita borrar un archivo referenciado o usado mientras tanto
+            borrados, _ = ArchivoMedia.objects.filter(
+                sha256=archivo.sha256, referencias__lte=0, ultimo_acceso__lt=limite
+            ).delete()
+            if not borrados:
+                continue
+            cantidad += 1
+            liberados += archivo.tamano
+            try:
+                self.ruta_absoluta(archivo).unlink()
+            except FileNotFoundError:
+                pass
+
+        self._limpiar_temporales()
+        if cantidad:
+            logger.info(f"Almacén de medios: {cantidad} archivos borrados, {liberados} bytes liberados")
+        return cantidad, liberados
+
+    def _limpiar_temporales(self):
+        """Descargas interrumpidas (un proceso que murió a mitad de escribir)"""
+        limite = timezone.now().timestamp() - 24 * 3600
+        temporales = self.raiz / 'tmp'
+        if not temporales.is_dir():
+            return
+        for ruta in temporales.iterdir():
+            try:
+                if ruta.stat().st_mtime < limite:
+                    ruta.unlink()
+            except FileNotFoundError:
+                pass
+
+
+almacen_media = AlmacenMedia()
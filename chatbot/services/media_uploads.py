@@ -0,0 +1,138 @@
+"""
+Caché de IDs de media subidos a WhatsApp para nuestras imágenes
+
+Enviar una imagen por `link` hace que Meta la descargue de nuestro origen en
+cada envío. Aquí cada URL (logo de negocio, imagen de producto) se sube una
+vez al endpoint /media y se guarda el ID devuelto (MediaSubida), con su
+vencimiento y el SHA-256 del contenido.
+
+Cada MEDIA_UPLOAD_REVALIDATE_SECONDS se revalida el origen con una petición
+condicional (If-None-Match / If-Modified-Since): un 304 o el mismo SHA-256
+mantienen el ID; solo un contenido distinto o un ID vencido provocan una
+nueva subida.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .graph_transport import transporte_graph
+from .media_store import almacen_media
+
+logger = logging.getLogger('chatbot')
+
+
+class CacheSubidas:
+
+    def obtener_media_id(self, whatsapp, url, forzar=False):
+        """
+        ID de media vigente para la imagen de `url`, subiéndola si hace falta
+
+        Args:
+            whatsapp: WhatsAppService con el que subir
+            url: URL de origen de la imagen
+            forzar: Subir de nuevo aunque el ID parezca vigente (p. ej. Meta lo rechazó)
+
+        Returns:
+            media_id o None si no se pudo obtener (el llamador envía por link)
+        """
+        from ..models import MediaSubida
+
+        try:
+            ahora = timezone.now()
+            subida = MediaSubida.objects.filter(url_origen=url).first()
+            margen = timedelta(hours=1)
+
+            if subida is not None and not forzar and subida.expira > ahora + margen:
+                revalidar = timedelta(seconds=settings.MEDIA_UPLOAD_REVALIDATE_SECONDS)
+                if subida.fecha_verificacion > ahora - revalidar:
+                    return subida.media_id
+                sin_cambios, archivo = self._revalidar(subida)
+                if sin_cambios:
+                    return subida.media_id
+                return self._subir(whatsapp, url, *archivo)
+
+            return self._subir(whatsapp, url, *self._descargar(url))
+        except Exception as e:
+            logger.error(f"Error obteniendo media subida para {url}: {e}")
+            return None
+
+    def _revalidar(self, subida):
+        """
+        Petición condicional al origen
+
+        Returns:
+            (True, None) si no cambió; (False, (archivo, etag, last_modified))
+            con el contenido nuevo ya descargado si cambió
+        """
+        from ..models import MediaSubida
+
+        encabezados = {}
+        if subida.etag:
+            encabezados['If-None-Match'] = subida.etag
+        if subida.last_modified:
+            encabezados['If-Modified-Since'] = subida.last_modified
+
+        with transporte_graph.get(subida.url_origen, endpoint='media_origen', timeout=self._timeout(),
+                                 headers=encabezados, stream=True) as response:
+            etag = response.headers.get('ETag', subida.etag)
+            last_modified = response.headers.get('Last-Modified', subida.last_modified)
+            if response.status_code != 304:
+                response.raise_for_status()
+                archivo = self._guardar(response)
+                if archivo.sha256 != subida.sha256:
+                    return False, (archivo, etag, last_modified)
+
+        # 304, o el origen no maneja validadores pero el contenido es el mismo
+        MediaSubida.objects.filter(pk=subida.pk).update(
+            fecha_verificacion=timezone.now(), etag=etag, last_modified=last_modified
+        )
+        return True, None
+
+    def _timeout(self):
+        return (settings.GRAPH_HTTP_CONNECT_TIMEOUT, settings.GRAPH_HTTP_DOWNLOAD_TIMEOUT)
+
+    def _guardar(self, response):
+        return almacen_media.guardar_stream(
+            response.iter_content(chunk_size=settings.MEDIA_CHUNK_SIZE),
+            mime_type=response.headers.get('Content-Type', ''),
+            max_bytes=settings.MEDIA_UPLOAD_MAX_BYTES,
+        )
+
+    def _descargar(self, url):
+        with transporte_graph.get(url, endpoint='media_origen', timeout=self._timeout(), stream=True) as response:
+            response.raise_for_status()
+            archivo = self._guardar(response)
+            return archivo, response.headers.get('ETag', ''), response.headers.get('Last-Modified', '')
+
+    def _subir(self, whatsapp, url, archivo, etag, last_modified):
+        from ..models import MediaSubida
+
+        with open(almacen_media.ruta_absoluta(archivo), 'rb') as f:
+            media_id = whatsapp.upload_media(f, archivo.mime_type, nombre=archivo.ruta.rsplit('/', 1)[-1])
+        if not media_id:
+            return None
+
+        ahora = timezone.now()
+        campos = {
+            'sha256': archivo.sha256,
+            'media_id': media_id,
+            'mime_type': archivo.mime_type,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fecha_subida': ahora,
+            'expira': ahora + timedelta(days=settings.MEDIA_UPLOAD_TTL_DAYS),
+            'fecha_verificacion': ahora,
+        }
+        try:
+            MediaSubida.objects.update_or_create(url_origen=url, defaults=campos)
+        except IntegrityError:
+            # Otro worker la subió a la vez: vale cualquiera de los dos IDs
+            MediaSubida.objects.filter(url_origen=url).update(**campos)
+        logger.info(f"Imagen subida a WhatsApp: {url} → {media_id}")
+        return media_id
+
+
+cache_subidas = CacheSubidas()
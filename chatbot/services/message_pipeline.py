@@ -0,0 +1,184 @@
+"""
+Etapas de un mensaje ejecutadas en paralelo, con sus tiempos
+
+process_message hacía todo en serie: conversación, mensaje, historial,
+contexto del catálogo, Gemini y envío. Ahora es una corrutina (webhook ASGI):
+las etapas que no dependen entre sí (confirmación de lectura con el indicador
+de escritura, contexto del catálogo) corren a la vez mientras se guarda el
+mensaje y se lee el historial, y la llamada al LLM empieza apenas están
+listos sus datos. Las esperas de red (Meta, Gemini) no ocupan hilos.
+
+El código síncrono (ORM, armado del contexto) corre con `en_bd()` en un pool
+acotado (MESSAGE_PIPELINE_WORKERS): el pool limita también las conexiones a
+la BD abiertas por el proceso. Cada tarea corre con una copia del contexto
+de quien la lanza (así ve el mismo mapa de identidad,
+services/identity_map.py) y su conexión se cierra o recicla igual que en una
+petición (CONN_MAX_AGE).
+
+Los tiempos de los últimos mensajes se acumulan en `metricas_etapas`
+(percentiles por etapa en /chatbot/status/ y en `manage.py bench_webhook`).
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger('chatbot')
+
+# Muestras por etapa para calcular percentiles
+MUESTRAS_ETAPAS = 1024
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.MESSAGE_PIPELINE_WORKERS, thread_name_prefix='etapas',
+                initializer=_iniciar_hilo
+            )
+    return _executor
+
+
+def _iniciar_hilo():
+    """Cada hilo del pool tiene sus propias conexiones: se abren al crearlo"""
+    if settings.DB_WARMUP_ON_START:
+        from ..db_backend.base import calentar_conexiones
+        calentar_conexiones()
+
+
+def calentar_pool():
+    """
+    Crear todos los hilos del pool (y abrir sus conexiones) antes del primer
+    mensaje; se llama al cargar la aplicación ASGI
+    """
+    total = settings.MESSAGE_PIPELINE_WORKERS
+    # Cada tarea espera a las demás: el pool no puede reusar un hilo y crea todos
+    barrera = threading.Barrier(total, timeout=60)
+
+    def esperar():
+        try:
+            barrera.wait()
+        except threading.BrokenBarrierError:
+            pass
+
+    pool = _pool()
+    for futuro in [pool.submit(esperar) for _ in range(total)]:
+        futuro.result()
+
+
+def _ejecutar(funcion, args, kwargs):
+    close_old_connections()
+    try:
+        return funcion(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def en_bd(funcion, *args, **kwargs):
+    """
+    Ejecutar código síncrono (ORM) desde una corrutina, como sync_to_async
+    pero en el pool acotado
+    """
+    contexto = contextvars.copy_context()
+    return await asyncio.wrap_future(_pool().submit(contexto.run, _ejecutar, funcion, args, kwargs))
+
+
+class EtapasMensaje:
+    """Tiempos de las etapas de un mensaje"""
+
+    def __init__(self):
+        self.tiempos = {}
+        self._inicio = time.perf_counter()
+
+    async def ejecutar(self, nombre, funcion, *args, **kwargs):
+        """Etapa síncrona, ejecutada en el pool con en_bd()"""
+        with self.medir(nombre):
+            return await en_bd(funcion, *args, **kwargs)
+
+    async def esperar(self, nombre, corrutina):
+        """Etapa asíncrona (petición a Meta o a Gemini)"""
+        with self.medir(nombre):
+            return await corrutina
+
+    @contextmanager
+    def medir(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tiempos[nombre] = (time.perf_counter() - inicio) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self._inicio) * 1000
+
+    def resumen(self):
+        etapas = " ".join(f"{nombre}={ms:.0f}ms" for nombre, ms in self.tiempos.items())
+        return f"{etapas} total={self.total_ms():.0f}ms"
+
+
+def percentil(ordenadas, p):
+    """Percentil `p` (0 a 100) de una lista ya ordenada, o None si está vacía"""
+    if not ordenadas:
+        return None
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))]
+
+
+def resumen_latencias(muestras):
+    """Dict serializable con promedio, p50, p95, p99 y máximo en milisegundos"""
+    ordenadas = sorted(muestras)
+    if not ordenadas:
+        return {'muestras': 0}
+    return {
+        'muestras': len(ordenadas),
+        'promedio_ms': round(sum(ordenadas) / len(ordenadas), 2),
+        'p50_ms': round(percentil(ordenadas, 50), 2),
+        'p95_ms': round(percentil(ordenadas, 95), 2),
+        'p99_ms': round(percentil(ordenadas, 99), 2),
+        'max_ms': round(ordenadas[-1], 2),
+    }
+
+
+class MetricasEtapas:
+    """Tiempos por etapa de los últimos mensajes del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self, muestras=MUESTRAS_ETAPAS):
+        """Vaciar las muestras (y guardar hasta `muestras` por etapa)"""
+        with self._lock:
+            self.mensajes = 0
+            self._maximo = muestras
+            self._muestras = {}
+
+    def registrar(self, etapas):
+        """Sumar los tiempos de un EtapasMensaje terminado"""
+        tiempos = dict(etapas.tiempos, total=etapas.total_ms())
+        with self._lock:
+            self.mensajes += 1
+            for nombre, ms in tiempos.items():
+                self._muestras.setdefault(nombre, deque(maxlen=self._maximo)).append(ms)
+
+    def resumen(self):
+        with self._lock:
+            muestras = {nombre: list(valores) for nombre, valores in self._muestras.items()}
+            mensajes = self.mensajes
+        return {
+            'mensajes': mensajes,
+            'etapas': {nombre: resumen_latencias(valores) for nombre, valores in muestras.items()},
+        }
+
+
+metricas_etapas = MetricasEtapas()
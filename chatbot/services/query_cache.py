@@ -0,0 +1,341 @@
+"""
+Caché de dos niveles para las consultas de DatabaseService
+
+Nivel 1: LRU acotado en memoria del proceso. Nivel 2: caché de Django
+compartida entre workers (settings.QUERY_CACHE_ALIAS, en disco por defecto).
+
+Cada método cacheado declara los modelos de los que depende (sus etiquetas).
+Cada etiqueta tiene una versión guardada en el nivel compartido; la clave de
+una entrada incluye las versiones vigentes, así que invalidar una etiqueta
+(ver chatbot/signals.py) deja obsoletas todas sus entradas en todos los
+workers sin tener que buscarlas.
+
+Los resultados que dependen de la hora (abiertos ahora, eventos próximos)
+marcan con vence_en() el momento en que dejan de valer: la entrada expira
+justo en ese límite aunque su TTL sea mayor.
+"""
+import functools
+import hashlib
+import inspect
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.query import QuerySet
+
+logger = logging.getLogger('chatbot')
+
+
+class CacheLRU:
+    """Diccionario acotado que descarta primero lo menos usado"""
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._datos)
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                self._datos.move_to_end(clave)
+            return entrada
+
+    def guardar(self, clave, entrada):
+        with self._lock:
+            self._datos[clave] = entrada
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+def etiqueta(modelo):
+    return modelo._meta.label_lower
+
+
+def _normalizar(valor):
+    """
+    Valor de argumento estable para la clave. Las búsquedas son insensibles a
+    mayúsculas (icontains/iexact con la colación de MySQL), así que "Pan" y
+    "pan" comparten entrada.
+    """
+    if isinstance(valor, str):
+        return valor.lower()
+    if isinstance(valor, (list, tuple)):
+        return tuple(_normalizar(v) for v in valor)
+    if isinstance(valor, dict):
+        return tuple(sorted((k, _normalizar(v)) for k, v in valor.items()))
+    if hasattr(valor, '_meta') and hasattr(valor, 'pk'):
+        return (etiqueta(valor), valor.pk)
+    return valor
+
+
+def argumentos_normalizados(firma, args, kwargs):
+    """Argumentos de una llamada (con valores por defecto) en forma hashable y estable"""
+    enlazados = firma.bind(*args, **kwargs)
+    enlazados.apply_defaults()
+    return tuple((k, _normalizar(v)) for k, v in enlazados.arguments.items())
+
+
+def materializar(valor):
+    """Los QuerySets perezosos no se pueden cachear: se convierten en listas"""
+    if isinstance(valor, QuerySet):
+        return list(valor)
+    if isinstance(valor, dict):
+        return {k: materializar(v) for k, v in valor.items()}
+    return valor
+
+
+class CacheConsultas:
+
+    def __init__(self):
+        self._local = None
+        self._versiones = {}      # etiqueta -> (versión, momento de lectura)
+        self._estadisticas = {}   # método -> Counter
+        self._lock = threading.Lock()
+        self._estado = threading.local()
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = CacheLRU(settings.QUERY_CACHE_LOCAL_SIZE)
+        return self._local
+
+    @property
+    def compartida(self):
+        alias = settings.QUERY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    # ==================== CONTROL ====================
+
+    @contextmanager
+    def desactivada(self):
+        """Ejecutar el bloque sin leer ni escribir la caché"""
+        anterior = getattr(self._estado, 'desactivada', False)
+        self._estado.desactivada = True
+        try:
+            yield
+        finally:
+            self._estado.desactivada = anterior
+
+    def no_guardar(self):
+        """Llamado desde el manejo de errores: el resultado de esta llamada no se cachea"""
+        self._estado.no_guardar = True
+
+    def vence(self, momento):
+        """El resultado de esta llamada deja de valer en `momento` (datetime)"""
+        actual = getattr(self._estado, 'vence', None)
+        marca = momento.timestamp()
+        self._estado.vence = marca if actual is None else min(actual, marca)
+
+    def limpiar(self):
+        self.local.limpiar()
+        with self._lock:
+            self._versiones.clear()
+
+    # ==================== VERSIONES ====================
+
+    def versiones(self, etiquetas):
+        """Versión vigente de cada etiqueta (releída del nivel compartido cada pocos segundos)"""
+        ahora = time.monotonic()
+        vigencia = settings.QUERY_CACHE_TAG_CHECK_SECONDS
+        pendientes = [
+            e for e in etiquetas
+            if e not in self._versiones or ahora - self._versiones[e][1] > vigencia
+        ]
+
+        if pendientes:
+            claves = {f'etiqueta:{e}': e for e in pendientes}
+            leidas = {}
+            try:
+                compartida = self.compartida
+                if compartida is not None:
+                    leidas = compartida.get_many(list(claves))
+                    nuevas = {c: time.time_ns() for c in claves if c not in leidas}
+                    if nuevas:
+                        # Una etiqueta sin versión (nueva o desalojada) arranca con una
+                        # versión única para no revalidar entradas antiguas
+                        for clave, version in nuevas.items():
+                            compartida.add(clave, version, timeout=None)
+                        leidas.update(compartida.get_many(list(nuevas)))
+            except Exception as e:
+                logger.warning(f"Caché compartida no disponible para versiones: {e}")
+
+            with self._lock:
+                for clave, nombre in claves.items():
+                    anterior = self._versiones.get(nombre, (0, 0))[0]
+                    self._versiones[nombre] = (leidas.get(clave, anterior), ahora)
+
+        return tuple(self._versiones[e][0] for e in etiquetas)
+
+    def invalidar(self, *etiquetas):
+        """Dejar obsoletas todas las entradas que dependen de estas etiquetas"""
+        version = time.time_ns()
+        with self._lock:
+            for nombre in etiquetas:
+                self._versiones[nombre] = (version, time.monotonic())
+        try:
+            compartida = self.compartida
+            if compartida is not None:
+                compartida.set_many({f'etiqueta:{nombre}': version for nombre in etiquetas}, timeout=None)
+        except Exception as e:
+            logger.warning(f"No se pudo invalidar la caché compartida: {e}")
+
+    # ==================== LECTURA ====================
+
+    def _contar(self, metodo, evento):
+        with self._lock:
+            self._estadisticas.setdefault(metodo, Counter())[evento] += 1
+
+    def obtener_o_calcular(self, metodo, argumentos, etiquetas, ttl, calcular):
+        if getattr(self._estado, 'desactivada', False):
+            return calcular()
+
+        versiones = self.versiones(etiquetas)
+        huella = hashlib.sha1(repr(argumentos).encode('utf-8')).hexdigest()
+        clave = f'consulta:{metodo}:{huella}'
+        ahora = time.time()
+
+        entrada = self.local.obtener(clave)
+        if entrada is not None and entrada[0] == versiones and entrada[1] > ahora:
+            self._contar(metodo, 'local')
+            return entrada[2]
+
+        compartida = None
+        try:
+            compartida = self.compartida
+            entrada = compartida.get(clave) if compartida is not None else None
+        except Exception as e:
+            logger.warning(f"Caché compartida no disponible: {e}")
+            entrada = None
+        if entrada is not None and entrada[0] == versiones and entrada[1] > ahora:
+            self.local.guardar(clave, entrada)
+            self._contar(metodo, 'compartida')
+            return entrada[2]
+
+        self._contar(metodo, 'bd')
+        anterior = (getattr(self._estado, 'no_guardar', False), getattr(self._estado, 'vence', None))
+        self._estado.no_guardar = False
+        self._estado.vence = None
+        try:
+            valor = materializar(calcular())
+            guardar = not self._estado.no_guardar
+            expira = ahora + ttl
+            if self._estado.vence is not None:
+                expira = min(expira, self._estado.vence)
+        finally:
+            self._estado.no_guardar, self._estado.vence = anterior
+
+        if guardar and expira > time.time():
+            entrada = (versiones, expira, valor)
+            self.local.guardar(clave, entrada)
+            try:
+                if compartida is not None:
+                    compartida.set(clave, entrada, timeout=math.ceil(expira - ahora))
+            except Exception as e:
+                logger.warning(f"No se pudo guardar en la caché compartida: {e}")
+        return valor
+
+    def estadisticas(self):
+        """Aciertos por nivel y tasa de acierto de cada método"""
+        with self._lock:
+            resultado = {}
+            for metodo, contador in sorted(self._estadisticas.items()):
+                total = sum(contador.values())
+                resultado[metodo] = {
+                    'local': contador['local'],
+                    'compartida': contador['compartida'],
+                    'bd': contador['bd'],
+                    'tasa_acierto': round((contador['local'] + contador['compartida']) / total, 3) if total else None,
+                }
+            return resultado
+
+
+cache_consultas = CacheConsultas()
+
+
+class IndiceVersionado:
+    """
+    Estructura en memoria derivada del catálogo (índices, tablas de ranking)
+
+    Se construye perezosamente y se reconstruye cuando cambia la versión de
+    las etiquetas de sus modelos. chatbot/signals.py incrementa esas versiones
+    al confirmar cada escritura y `sincronizar_replica` al copiar el catálogo,
+    así que se enteran todos los workers, no solo el que escribió.
+    """
+
+    def __init__(self):
+        self._estado = (None, None)   # (versiones, datos)
+        self._lock = threading.Lock()
+
+    def modelos(self):
+        """Modelos de los que depende la estructura"""
+        raise NotImplementedError
+
+    def _construir(self):
+        raise NotImplementedError
+
+    def invalidar(self):
+        """Descartar la estructura en este proceso; se reconstruye en la siguiente consulta"""
+        self._estado = (None, None)
+
+    def obtener(self):
+        """Obtener la estructura, construyéndola si falta o si cambió el catálogo"""
+        version = cache_consultas.versiones(tuple(etiqueta(m) for m in self.modelos()))
+        vigente, datos = self._estado
+        if datos is None or vigente != version:
+            with self._lock:
+                vigente, datos = self._estado
+                if datos is None or vigente != version:
+                    datos = self._construir()
+                    self._estado = (version, datos)
+        return datos
+
+
+def cacheado(*modelos, ttl=None):
+    """
+    Cachear el resultado de un método según sus argumentos normalizados
+
+    Args:
+        modelos: Modelos de los que depende el resultado; un cambio en
+            cualquiera de ellos invalida la entrada
+        ttl: Segundos de vida (por defecto, QUERY_CACHE_TTL)
+    """
+    etiquetas = tuple(etiqueta(m) for m in modelos)
+
+    def decorador(funcion):
+        firma = inspect.signature(funcion)
+        nombre = funcion.__qualname__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            return cache_consultas.obtener_o_calcular(
+                nombre, argumentos_normalizados(firma, args, kwargs), etiquetas, ttl or settings.QUERY_CACHE_TTL,
+                lambda: funcion(*args, **kwargs)
+            )
+
+        return envoltura
+
+    return decorador
+
+
+def no_cachear():
+    """Marcar el resultado de la llamada en curso como no cacheable (p. ej. tras un error)"""
+    cache_consultas.no_guardar()
+
+
+def vence_en(momento):
+    """Hacer expirar el resultado de la llamada en curso en `momento` (p. ej. el próximo cambio de horario)"""
+    cache_consultas.vence(momento)
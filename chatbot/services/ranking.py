@@ -0,0 +1,175 @@
+"""
+Motor de ranking de negocios con varias señales
+
+Cada candidato se puntúa con una suma ponderada de señales normalizadas a
+[0, 1]: relevancia textual, abierto ahora, calificación promedio, cantidad de
+reseñas, verificación, distancia al usuario y productos disponibles. Las
+señales se calculan por columnas sobre la lista de candidatos, a partir de
+una tabla de atributos en memoria, así que rankear cientos de candidatos no
+consulta la BD.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.db.models import Count
+
+from .geo_index import distancia_km
+from .horarios_index import indice_horarios
+from .query_cache import IndiceVersionado
+from .search_index import trigramas
+
+logger = logging.getLogger('chatbot')
+
+# Calificación a priori para el promedio bayesiano (evita que una sola
+# reseña de 5 estrellas supere a cincuenta de 4.8)
+CALIFICACION_PREVIA = 3.5
+PESO_PREVIO = 3
+
+
+def _contencion(consulta, termino):
+    """Fracción de los trigramas del término que aparecen en la consulta"""
+    if not termino:
+        return 0.0
+    return len(consulta & termino) / len(termino)
+
+
+class TablaAtributos(IndiceVersionado):
+    """
+    Atributos por negocio necesarios para el ranking, cargados con tres
+    consultas y reconstruidos cuando cambia el catálogo o las calificaciones
+    en cualquier worker
+    """
+
+    def modelos(self):
+        from ..models import Negocio, ProductoNegocio, ResumenCalificacion
+        return (Negocio, ProductoNegocio, ResumenCalificacion)
+
+    def _construir(self):
+        from ..models import Negocio, ProductoNegocio, ResumenCalificacion
+
+        atributos = {}
+        negocios = Negocio.objects.filter(activo=True).values_list(
+            'id', 'nombre', 'categoria', 'barrio', 'verificado', 'latitud', 'longitud'
+        )
+        for negocio_id, nombre, categoria, barrio, verificado, latitud, longitud in negocios:
+            atributos[negocio_id] = {
+                'nombre': trigramas(nombre),
+                'categoria': trigramas(categoria),
+                'barrio': trigramas(barrio),
+                'verificado': 1.0 if verificado else 0.0,
+                'coordenadas': (float(latitud), float(longitud)) if latitud is not None and longitud is not None else None,
+                'resenas': 0,
+                'suma_calificaciones': 0,
+                'productos': 0,
+            }
+
+        resumenes = ResumenCalificacion.objects.values_list('negocio_id', 'total', 'suma')
+        for negocio_id, total, suma in resumenes:
+            if negocio_id in atributos:
+                atributos[negocio_id]['resenas'] = total
+                atributos[negocio_id]['suma_calificaciones'] = suma
+
+        productos = ProductoNegocio.objects.filter(activo=True, disponible=True).values('negocio_id').annotate(
+            total=Count('id')
+        )
+        for fila in productos:
+            if fila['negocio_id'] in atributos:
+                atributos[fila['negocio_id']]['productos'] = fila['total']
+
+        logger.info(f"Tabla de ranking construida: {len(atributos)} negocios")
+        return atributos
+
+
+tabla_atributos = TablaAtributos()
+
+
+class RankingService:
+    """Ordena negocios candidatos según una combinación ponderada de señales"""
+
+    def __init__(self, pesos=None):
+        self.pesos = dict(settings.RANKING_WEIGHTS)
+        if pesos:
+            self.pesos.update(pesos)
+
+    def puntuar(self, negocio_ids, texto=None, ubicacion=None, momento=None):
+        """
+        Calcular el puntaje de cada candidato
+
+        Args:
+            negocio_ids: IDs de los negocios candidatos
+            texto: Texto de la consulta (para la relevancia)
+            ubicacion: Tupla (latitud, longitud) del usuario, si se conoce
+            momento: Momento para evaluar "abierto ahora" (por defecto, ahora)
+
+        Returns:
+            Lista de puntajes, en el mismo orden que negocio_ids
+        """
+        tabla = tabla_atributos.obtener()
+        vacio = {
+            'nombre': set(), 'categoria': set(), 'barrio': set(), 'verificado': 0.0,
+            'coordenadas': None, 'resenas': 0, 'suma_calificaciones': 0, 'productos': 0,
+        }
+        filas = [tabla.get(negocio_id, vacio) for negocio_id in negocio_ids]
+
+        columnas = {}
+
+        consulta = trigramas(texto) if texto else set()
+        if consulta:
+            columnas['relevancia'] = [
+                max(
+                    _contencion(consulta, f['nombre']),
+                    0.7 * _contencion(consulta, f['categoria']),
+                    0.5 * _contencion(consulta, f['barrio']),
+                )
+                for f in filas
+            ]
+
+        estados = indice_horarios.estan_abiertos(negocio_ids, momento)
+        columnas['abierto'] = [0.5 if e is None else float(e) for e in estados]
+
+        columnas['calificacion'] = [
+            ((f['suma_calificaciones'] + CALIFICACION_PREVIA * PESO_PREVIO) / (f['resenas'] + PESO_PREVIO) - 1) / 4
+            for f in filas
+        ]
+
+        max_resenas = max((f['resenas'] for f in filas), default=0)
+        if max_resenas:
+            escala = math.log1p(max_resenas)
+            columnas['resenas'] = [math.log1p(f['resenas']) / escala for f in filas]
+
+        columnas['verificado'] = [f['verificado'] for f in filas]
+
+        if ubicacion:
+            latitud, longitud = ubicacion
+            escala_km = settings.RANKING_DISTANCE_SCALE_KM
+            columnas['distancia'] = [
+                1 / (1 + distancia_km(latitud, longitud, *f['coordenadas']) / escala_km)
+                if f['coordenadas'] else 0.0
+                for f in filas
+            ]
+
+        columnas['productos'] = [min(f['productos'], 5) / 5 for f in filas]
+
+        puntajes = [0.0] * len(filas)
+        for senal, valores in columnas.items():
+            peso = self.pesos.get(senal, 0.0)
+            if peso:
+                puntajes = [p + peso * v for p, v in zip(puntajes, valores)]
+        return puntajes
+
+    def rankear(self, negocios, texto=None, ubicacion=None, momento=None, limit=None):
+        """
+        Ordenar negocios de mayor a menor puntaje
+
+        Returns:
+            Lista de negocios ordenada
+        """
+        negocios = list(negocios)
+        if not negocios:
+            return []
+
+        puntajes = self.puntuar([n.id for n in negocios], texto=texto, ubicacion=ubicacion, momento=momento)
+        orden = sorted(range(len(negocios)), key=lambda i: (-puntajes[i], negocios[i].nombre))
+        ordenados = [negocios[i] for i in orden]
+        return ordenados[:limit] if limit else ordenados
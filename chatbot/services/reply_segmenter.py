@@ -0,0 +1,121 @@
+"""
+División de respuestas largas en varios mensajes de WhatsApp
+
+El cuerpo de un mensaje de texto admite WHATSAPP_TEXT_MAX_CHARS caracteres
+(4096); una respuesta más larga hacía fallar el envío completo. Aquí se corta
+por párrafos, luego por líneas (listas), por oraciones y por palabras, solo
+cuando el nivel anterior no alcanza.
+
+El formato de WhatsApp (*negrita*, _cursiva_, ~tachado~, ```monoespaciado```
+y el **negrita** que a veces escribe Gemini) se mantiene balanceado: si un
+corte cae dentro de un marcador, se cierra al final de la parte y se vuelve
+a abrir al comienzo de la siguiente.
+"""
+import re
+
+from django.conf import settings
+
+# Marcadores de formato, el más largo primero
+MARCADORES = re.compile(r'```|\*\*|[*_~]')
+# Lo que ocupan, como máximo, los marcadores que se cierran y se reabren en un corte
+RESERVA_MARCADORES = 2 * len('```**_~*')
+
+# Separadores de mayor a menor: párrafos, líneas, oraciones, palabras
+NIVELES = [
+    (re.compile(r'\n\s*\n'), '\n\n'),
+    (re.compile(r'\n'), '\n'),
+    (re.compile(r'(?<=[.!?…:;])\s+'), ' '),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def segmentar(texto, limite=None):
+    """
+    Dividir un texto en partes de hasta `limite` caracteres
+
+    Args:
+        texto: Respuesta completa
+        limite: Largo máximo de cada parte (por defecto, WHATSAPP_TEXT_MAX_CHARS)
+
+    Returns:
+        Lista de partes, en orden (una sola si el texto cabe; ninguna si está vacío)
+
+    Raises:
+        ValueError: Si `limite` no deja lugar para el texto además de los marcadores
+    """
+    limite = limite or settings.WHATSAPP_TEXT_MAX_CHARS
+    if limite <= RESERVA_MARCADORES:
+        raise ValueError(f"El límite debe ser mayor que {RESERVA_MARCADORES} caracteres")
+    texto = (texto or '').strip()
+    if not texto:
+        return []
+    if len(texto) <= limite:
+        return [texto]
+
+    partes = []
+    abiertos = []
+    for trozo in _trozos(texto, limite - RESERVA_MARCADORES, 0):
+        parte = ''.join(abiertos) + trozo.strip()
+        abiertos = marcadores_abiertos(parte)
+        partes.append(parte + ''.join(reversed(abiertos)))
+    return partes
+
+
+def marcadores_abiertos(texto):
+    """
+    Marcadores de formato que quedan sin cerrar al final de `texto`, en el
+    orden en que se abrieron
+
+    Un marcador abre si le sigue un carácter que no es espacio y no va pegado
+    a una palabra (así no cuentan `snake_case`, `5 * 3` ni las viñetas `* `).
+    Dentro de ``` no se interpreta ningún otro.
+    """
+    abiertos = []
+    for m in MARCADORES.finditer(texto):
+        marca = m.group()
+        antes = texto[m.start() - 1] if m.start() else ' '
+        despues = texto[m.end()] if m.end() < len(texto) else ' '
+
+        if abiertos and abiertos[-1] == '```':
+            if marca == '```':
+                abiertos.pop()
+            continue
+        if marca in abiertos and not antes.isspace():
+            # Cierra este marcador y los que quedaron abiertos dentro de él
+            del abiertos[abiertos.index(marca):]
+        elif marca not in abiertos and not despues.isspace() and (marca == '```' or not antes.isalnum()):
+            abiertos.append(marca)
+    return abiertos
+
+
+def _trozos(texto, limite, nivel):
+    if len(texto) <= limite:
+        return [texto]
+    if nivel == len(NIVELES):
+        return [texto[i:i + limite] for i in range(0, len(texto), limite)]
+
+    patron, separador = NIVELES[nivel]
+    unidades = [u for u in patron.split(texto) if u.strip()]
+    if len(unidades) == 1:
+        return _trozos(texto, limite, nivel + 1)
+
+    trozos = []
+    actual = ''
+    for unidad in unidades:
+        if len(unidad) > limite:
+            # Demasiado larga: se divide con el separador siguiente
+            if actual:
+                trozos.append(actual)
+            subtrozos = _trozos(unidad, limite, nivel + 1)
+            trozos.extend(subtrozos[:-1])
+            actual = subtrozos[-1]
+        elif not actual:
+            actual = unidad
+        elif len(actual) + len(separador) + len(unidad) <= limite:
+            actual += separador + unidad
+        else:
+            trozos.append(actual)
+            actual = unidad
+    if actual:
+        trozos.append(actual)
+    return trozos
@@ -0,0 +1,188 @@
+"""
+Índice de trigramas para búsquedas tolerantes a errores de escritura
+"""
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+
+from .query_cache import IndiceVersionado
+
+logger = logging.getLogger('chatbot')
+
+
+# Palabras frecuentes en los mensajes que nunca deben buscarse en el catálogo
+PALABRAS_VACIAS = {
+    'donde', 'queda', 'tiene', 'tienen', 'para', 'esta', 'estan', 'cual', 'cuales',
+    'como', 'cuanto', 'cuesta', 'hola', 'buenas', 'buenos', 'gracias', 'quiero',
+    'necesito', 'busco', 'algun', 'alguna', 'abierto', 'abierta', 'cerca', 'aqui',
+    'ahora', 'hora', 'horario', 'precio', 'venden', 'vende', 'favor', 'porfa',
+}
+
+
+def normalizar_texto(texto):
+    """Pasar a minúsculas y quitar tildes: 'Panadería' -> 'panaderia'"""
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def extraer_palabras(texto):
+    """Separar un texto normalizado en palabras alfanuméricas"""
+    limpio = ''.join(c if c.isalnum() else ' ' for c in normalizar_texto(texto))
+    return limpio.split()
+
+
+def trigramas(texto):
+    """Trigramas por palabra, con relleno al inicio y al final (estilo pg_trgm)"""
+    resultado = set()
+    for palabra in extraer_palabras(texto):
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+class TrigramIndex:
+    """
+    Índice invertido de trigramas de caracteres.
+
+    Cada término indexado guarda un conjunto de "cargas" (payloads) que
+    identifican a qué elemento del catálogo pertenece.
+    """
+
+    def __init__(self):
+        self._terminos = []          # [(texto_original, cantidad_trigramas)]
+        self._cargas = []            # [set(payloads)]
+        self._por_normalizado = {}   # texto normalizado -> id de término
+        self._postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self._terminos)
+
+    def agregar(self, texto, carga):
+        """Indexar un término asociado a una carga"""
+        normalizado = ' '.join(extraer_palabras(texto))
+        if not normalizado:
+            return
+
+        termino_id = self._por_normalizado.get(normalizado)
+        if termino_id is None:
+            grams = trigramas(normalizado)
+            termino_id = len(self._terminos)
+            self._terminos.append((texto.strip(), len(grams)))
+            self._cargas.append(set())
+            self._por_normalizado[normalizado] = termino_id
+            for gram in grams:
+                self._postings[gram].append(termino_id)
+
+        self._cargas[termino_id].add(carga)
+
+    def buscar(self, texto, umbral=0.4, limit=10):
+        """
+        Buscar términos similares usando el coeficiente de Jaccard sobre trigramas
+
+        Returns:
+            Lista de tuplas (similitud, texto_termino, cargas) ordenada por similitud
+        """
+        grams = trigramas(texto)
+        if not grams:
+            return []
+
+        compartidos = defaultdict(int)
+        for gram in grams:
+            for termino_id in self._postings.get(gram, ()):
+                compartidos[termino_id] += 1
+
+        resultados = []
+        total_consulta = len(grams)
+        for termino_id, comunes in compartidos.items():
+            texto_termino, total_termino = self._terminos[termino_id]
+            similitud = comunes / (total_consulta + total_termino - comunes)
+            if similitud >= umbral:
+                resultados.append((similitud, texto_termino, self._cargas[termino_id]))
+
+        resultados.sort(key=lambda r: (-r[0], r[1]))
+        return resultados[:limit]
+
+
+class IndiceCatalogo(IndiceVersionado):
+    """
+    Índice difuso sobre nombres de negocios, barrios, categorías y productos.
+
+    Se construye perezosamente con dos consultas y se reconstruye cuando
+    cambia el catálogo en cualquier worker (ver IndiceVersionado).
+    """
+
+    def modelos(self):
+        from ..models import Negocio, ProductoNegocio, CategoriaNegocio
+        return (Negocio, ProductoNegocio, CategoriaNegocio)
+
+    def _construir(self):
+        from ..models import Negocio, ProductoNegocio
+
+        indice = TrigramIndex()
+
+        negocios = Negocio.objects.filter(activo=True).values_list(
+            'id', 'nombre', 'barrio', 'categoria'
+        )
+        for negocio_id, nombre, barrio, categoria in negocios:
+            indice.agregar(nombre, ('negocio', negocio_id))
+            # Palabras sueltas del nombre para que "pandería" encuentre "Panadería Don José"
+            for palabra in re.findall(r'\w+', nombre):
+                normalizada = normalizar_texto(palabra)
+                if len(normalizada) > 3 and normalizada not in PALABRAS_VACIAS:
+                    indice.agregar(palabra, ('negocio', negocio_id))
+            if barrio:
+                indice.agregar(barrio, ('barrio', negocio_id))
+            if categoria:
+                indice.agregar(categoria, ('categoria', negocio_id))
+
+        productos = ProductoNegocio.objects.filter(
+            activo=True,
+            disponible=True,
+            negocio__activo=True
+        ).values_list('negocio_id', 'nombre')
+        for negocio_id, nombre in productos:
+            indice.agregar(nombre, ('producto', negocio_id))
+
+        logger.info(f"Índice de trigramas construido: {len(indice)} términos")
+        return indice
+
+    def buscar_palabras(self, texto, umbral=None, limit=5):
+        """
+        Buscar cada palabra significativa del texto en el índice
+
+        Returns:
+            Lista de dicts con 'palabra', 'sugerencia', 'similitud', 'tipo' y 'negocio_ids'
+        """
+        if umbral is None:
+            umbral = settings.FUZZY_MATCH_THRESHOLD
+
+        indice = self.obtener()
+        coincidencias = []
+        vistas = set()
+
+        for palabra in extraer_palabras(texto):
+            if len(palabra) <= 3 or palabra in PALABRAS_VACIAS or palabra in vistas:
+                continue
+            vistas.add(palabra)
+
+            for similitud, sugerencia, cargas in indice.buscar(palabra, umbral=umbral, limit=limit):
+                por_tipo = defaultdict(set)
+                for tipo, negocio_id in cargas:
+                    por_tipo[tipo].add(negocio_id)
+                for tipo, negocio_ids in por_tipo.items():
+                    coincidencias.append({
+                        'palabra': palabra,
+                        'sugerencia': sugerencia,
+                        'similitud': similitud,
+                        'tipo': tipo,
+                        'negocio_ids': negocio_ids,
+                    })
+
+        coincidencias.sort(key=lambda c: -c['similitud'])
+        return coincidencias
+
+
+indice_catalogo = IndiceCatalogo()
@@ -0,0 +1,486 @@
+"""
+Carga sintética para el webhook y medición de sus latencias
+
+Lo usa `python manage.py bench_webhook`. Los payloads imitan los de Meta
+(textos tomados de un corpus de consultas reales del bot, imágenes,
+ubicaciones, lotes con varias entradas y estados de entrega) y entran por
+/chatbot/webhook/ a través del manejador ASGI completo, middleware incluido.
+
+La Graph API es el simulador de services/graph_simulator.py y el LLM una
+espera configurable (`llm_simulado`), así que el resultado mide el código
+del bot y la BD, no la red ni Gemini. Se reporta:
+
+- webhook: tiempo hasta que el webhook responde a Meta
+- extremo a extremo: desde que llega el mensaje hasta que la respuesta
+  llega a la Graph API (pasa por el despachador y su límite de tasa)
+- etapas: percentiles de EtapasMensaje (metricas_etapas)
+- consultas SQL de todos los hilos y errores (HTTP, registrados en el log,
+  mensajes sin respuesta)
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .dispatcher import despachador
+from .gemini_service import GeminiService
+from .graph_simulator import firmar, payload_estados
+from .message_pipeline import MUESTRAS_ETAPAS, en_bd, metricas_etapas, resumen_latencias
+
+logger = logging.getLogger('chatbot')
+
+RUTA_WEBHOOK = '/chatbot/webhook/'
+PHONE_NUMBER_ID = 'simulador'
+TIPOS = ('texto', 'imagen', 'ubicacion', 'lote', 'estados')
+MEZCLA_POR_DEFECTO = 'texto=70,imagen=8,ubicacion=7,lote=5,estados=10'
+
+CONSULTAS = [
+    'Hola, ¿qué panaderías hay abiertas ahora?',
+    'necesito una farmacia de turno cerca del centro',
+    'dónde venden pan de bono en Kennedy',
+    'ferretería que tenga cemento y varilla',
+    '¿a qué hora abre la peluquería de la Yesquita?',
+    'busco restaurante con almuerzo corriente barato',
+    'parce dónde puedo comer pescado frito',
+    'tienda que venda recargas y minutos',
+    'qué partidos hay este fin de semana',
+    'farmacia abierta 24 horas en Quibdó',
+    'quiero un corte de pelo para hoy, ¿dónde?',
+    'hay algún restaurante en Villa España que haga domicilios',
+    'cuánto vale el almuerzo en el restaurante del centro',
+    'necesito tornillos y pintura, ¿qué ferretería me recomiendas?',
+    'buenas, ¿me pasas el número de una panadería en El Poblado?',
+    '¿dónde queda la tienda de Niño Jesús?',
+    'qué negocios están abiertos el domingo',
+    'recomiéndame algo para cenar cerca',
+    'gracias manita',
+    'y esa farmacia tiene acetaminofén?',
+    '¿cuál es la mejor calificada?',
+    'dame la dirección exacta por favor',
+    'hay peluquerías que atiendan sin cita',
+    'venden arepas en alguna panadería de Istmina',
+    'ombe, ¿qué hay de bueno para hacer hoy en Tadó?',
+]
+LEYENDAS = ['¿Tienen este producto?', '¿Cuánto vale esto?', '', 'Mirá lo que encontré']
+NOMBRES = ['Yesenia', 'Jhon Fredy', 'Luz Marina', 'Deiner', 'Yuliana', 'Wilmer', 'Maryuri', 'Andrés']
+# Alrededor del centro de Quibdó, donde se siembra el catálogo de prueba
+LATITUD, LONGITUD = 5.69, -76.65
+
+
+def parsear_mezcla(texto):
+    """
+    'texto=70,imagen=10' -> {'texto': 70.0, 'imagen': 10.0}
+
+    Raises:
+        ValueError si un tipo no existe o un peso no es un número positivo
+    """
+    mezcla = {}
+    for parte in filter(None, (p.strip() for p in texto.split(','))):
+        tipo, _, peso = parte.partition('=')
+        tipo = tipo.strip()
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo desconocido '{tipo}' (válidos: {', '.join(TIPOS)})")
+        mezcla[tipo] = float(peso)
+        if mezcla[tipo] < 0:
+            raise ValueError(f"Peso negativo para '{tipo}'")
+    if not sum(mezcla.values()):
+        raise ValueError('La mezcla no tiene ningún tipo con peso')
+    return mezcla
+
+
+class GeneradorPayloads:
+    """
+    Payloads del webhook de Meta según una mezcla de tipos
+
+    Los usuarios se turnan (el mensaje i viene del usuario i % usuarios), así
+    que con más usuarios que concurrencia un usuario rara vez tiene dos
+    mensajes en curso. Los números coinciden con las conversaciones que
+    siembra services/catalogo_prueba.py: las primeras ya tienen historial.
+    """
+
+    def __init__(self, mezcla, usuarios=200, semilla=42):
+        self.tipos = list(mezcla)
+        self.pesos = [mezcla[t] for t in self.tipos]
+        self.usuarios = usuarios
+        self._aleatorio = random.Random(semilla)
+        self._siguiente_usuario = 0
+        self._enviados = deque(maxlen=2000)   # wamids aceptados por la Graph API, para los estados
+
+    def enviado(self, wamid):
+        self._enviados.append(wamid)
+
+    def siguiente(self):
+        """
+        Returns:
+            (tipo, payload, números que esperan respuesta)
+        """
+        tipo = self._aleatorio.choices(self.tipos, weights=self.pesos)[0]
+        if tipo == 'estados':
+            return tipo, self._estados(), []
+        if tipo == 'lote':
+            valores = [self._valor(self._texto) for _ in range(self._aleatorio.randint(2, 4))]
+        else:
+            constructor = {'texto': self._texto, 'imagen': self._imagen, 'ubicacion': self._ubicacion}[tipo]
+            valores = [self._valor(constructor)]
+        payload = {
+            'object': 'whatsapp_business_account',
+            'entry': [
+                {'id': 'bench', 'changes': [{'field': 'messages', 'value': valor}]}
+                for valor in valores
+            ],
+        }
+        return tipo, payload, [valor['messages'][0]['from'] for valor in valores]
+
+    def _usuario(self):
+        indice = self._siguiente_usuario % self.usuarios
+        self._siguiente_usuario += 1
+        return f'57310{indice:07d}', NOMBRES[indice % len(NOMBRES)]
+
+    def _valor(self, constructor):
+        numero, nombre = self._usuario()
+        mensaje = {
+            'from': numero,
+            'id': f'wamid.BENCH{uuid.uuid4().hex[:24]}',
+            'timestamp': str(int(time.time())),
+        }
+        mensaje.update(constructor())
+        return {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '000000', 'phone_number_id': PHONE_NUMBER_ID},
+            'contacts': [{'profile': {'name': nombre}, 'wa_id': numero}],
+            'messages': [mensaje],
+        }
+
+    def _texto(self):
+        return {'type': 'text', 'text': {'body': self._aleatorio.choice(CONSULTAS)}}
+
+    def _imagen(self):
+        imagen = {
+            'mime_type': 'image/jpeg',
+            'sha256': uuid.uuid4().hex,
+            'id': str(self._aleatorio.randint(10 ** 14, 10 ** 15)),
+        }
+        leyenda = self._aleatorio.choice(LEYENDAS)
+        if leyenda:
+            imagen['caption'] = leyenda
+        return {'type': 'image', 'image': imagen}
+
+    def _ubicacion(self):
+        return {'type': 'location', 'location': {
+            'latitude': round(LATITUD + self._aleatorio.uniform(-0.02, 0.02), 6),
+            'longitude': round(LONGITUD + self._aleatorio.uniform(-0.02, 0.02), 6),
+        }}
+
+    def _estados(self):
+        enviados = list(self._enviados)
+        if enviados:
+            wamids = self._aleatorio.sample(enviados, min(3, len(enviados)))
+        else:
+            wamids = [f'wamid.BENCH{uuid.uuid4().hex[:24]}']
+        estados = [(wamid, self._aleatorio.choice(('delivered', 'read')), '0') for wamid in wamids]
+        return payload_estados(PHONE_NUMBER_ID, estados)
+
+
+def respuesta_simulada(mensaje, caracteres):
+    """Texto de `caracteres` caracteres aprox. con el estilo del bot"""
+    frases = [
+        f'Ve pues, sobre "{mensaje[:40]}" te cuento.',
+        'Mirá, en el barrio hay varias opciones bacanas.',
+        'La *Panadería Prueba* abre de 8:00 a 18:00.',
+        'Queda en la Calle 12, por el Centro.',
+        '¿Te mando la ubicación exacta?',
+    ]
+    texto = ''
+    while len(texto) < caracteres:
+        texto += frases[len(texto) % len(frases)] + ' '
+    return texto[:caracteres].strip()
+
+
+@contextmanager
+def llm_simulado(latencia_ms=800, variacion_ms=300, caracteres=400):
+    """
+    Reemplazar Gemini por una espera dentro del bloque
+
+    El contexto de negocios y el prompt se arman igual que con Gemini: su
+    costo entra en la medición.
+    """
+    original = GeminiService.get_response_async
+
+    async def responder(servicio, message, context=None, phone_number=None, db_context=None):
+        if db_context is None:
+            db_context = await en_bd(servicio.construir_contexto_negocios, message, phone_number)
+        servicio._construir_prompt(message, context, db_context)
+        await asyncio.sleep(max(0.0, latencia_ms + random.uniform(-variacion_ms, variacion_ms)) / 1000)
+        return respuesta_simulada(message, caracteres)
+
+    GeminiService.get_response_async = responder
+    try:
+        yield
+    finally:
+        GeminiService.get_response_async = original
+
+
+class ContadorConsultas:
+    """Consultas SQL de todas las conexiones (de todos los hilos) mientras está activo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.activo = False
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.por_tipo = Counter()
+            self.total_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.activo:
+            return execute(sql, params, many, context)
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            tipo = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'OTRA'
+            with self._lock:
+                self.por_tipo[tipo] += 1
+                self.total_ms += ms
+
+    def _instalar(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def iniciar(self):
+        # Las conexiones de los hilos del pool y del despachador se abren después
+        connection_created.connect(self._instalar, dispatch_uid='bench_webhook')
+        for conexion in connections.all(initialized_only=True):
+            self._instalar(connection=conexion)
+        self.activo = True
+
+    def detener(self):
+        self.activo = False
+        connection_created.disconnect(dispatch_uid='bench_webhook')
+
+    def resumen(self, mensajes):
+        with self._lock:
+            total = sum(self.por_tipo.values())
+            return {
+                'consultas': total,
+                'consultas_por_mensaje': round(total / mensajes, 2) if mensajes else None,
+                'tiempo_ms': round(self.total_ms, 2),
+                'por_tipo': dict(self.por_tipo.most_common()),
+            }
+
+
+class ContadorErrores(logging.Handler):
+    """Errores registrados en el log 'chatbot' (los del procesamiento no llegan al HTTP)"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.errores = Counter()
+
+    def emit(self, record):
+        self.errores[record.getMessage().splitlines()[0][:100]] += 1
+
+
+class Medicion:
+    """Latencias y resultados de una tanda de peticiones"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.webhook_ms = defaultdict(list)     # tipo de payload -> ms
+        self.estados_http = Counter()
+        self.extremo_ms = []
+        self.mensajes = 0
+        self._pendientes = defaultdict(deque)   # número -> llegadas sin respuesta
+        self.ultima_respuesta = time.perf_counter()
+
+    def entrante(self, numeros, momento):
+        with self._lock:
+            self.mensajes += len(numeros)
+            for numero in numeros:
+                self._pendientes[numero].append(momento)
+
+    def webhook(self, tipo, ms, estado):
+        self.webhook_ms[tipo].append(ms)
+        self.estados_http[str(estado)] += 1
+
+    def respuesta(self, numero):
+        """La Graph API aceptó un mensaje para `numero` (llamado desde sus hilos)"""
+        ahora = time.perf_counter()
+        with self._lock:
+            llegadas = self._pendientes.get(numero)
+            if not llegadas:
+                # Parte siguiente de una respuesta larga, o una respuesta del calentamiento
+                return
+            self.extremo_ms.append((ahora - llegadas.popleft()) * 1000)
+            self.ultima_respuesta = ahora
+
+    def pendientes(self):
+        with self._lock:
+            return sum(len(llegadas) for llegadas in self._pendientes.values())
+
+    def resumen(self):
+        peticiones = sum(self.estados_http.values())
+        fallidas = sum(n for estado, n in self.estados_http.items() if estado != '200')
+        sin_respuesta = self.pendientes()
+        return {
+            'peticiones': peticiones,
+            'mensajes': self.mensajes,
+            'respuestas': len(self.extremo_ms),
+            'webhook': resumen_latencias([ms for valores in self.webhook_ms.values() for ms in valores]),
+            'webhook_por_tipo': {tipo: resumen_latencias(valores) for tipo, valores in sorted(self.webhook_ms.items())},
+            'extremo_a_extremo': resumen_latencias(self.extremo_ms),
+            'errores': {
+                'http': {estado: n for estado, n in self.estados_http.items() if estado != '200'},
+                'tasa_http': round(fallidas / peticiones, 4) if peticiones else None,
+                'sin_respuesta': sin_respuesta,
+                'tasa_sin_respuesta': round(sin_respuesta / self.mensajes, 4) if self.mensajes else None,
+            },
+        }
+
+
+class BancoWebhook:
+    """
+    Enviar carga al webhook con la Graph API simulada y medir
+
+    Args:
+        generador: GeneradorPayloads
+        simulador: SimuladorGraph ya iniciado (con META_GRAPH_BASE_URL apuntando a él)
+        concurrencia: Peticiones en curso a la vez (carga cerrada)
+        rps: Peticiones por segundo (carga abierta; tiene prioridad sobre concurrencia)
+        espera: Segundos máximos para esperar las respuestas al terminar
+    """
+
+    def __init__(self, generador, simulador, concurrencia=20, rps=None, espera=30):
+        self.generador = generador
+        self.simulador = simulador
+        self.concurrencia = concurrencia
+        self.rps = rps
+        self.espera = espera
+        self.medicion = Medicion()
+        self.consultas = ContadorConsultas()
+        self.errores = ContadorErrores()
+        simulador.observador = self._aceptado
+
+    def _aceptado(self, wamid, cuerpo):
+        self.generador.enviado(wamid)
+        self.medicion.respuesta(cuerpo.get('to'))
+
+    async def correr(self, mensajes, calentamiento=0):
+        """
+        Returns:
+            Dict serializable con el resultado (ver el docstring del módulo)
+        """
+        from django.test import AsyncClient
+        from ..models import Message
+
+        cliente = AsyncClient()
+        self.consultas.iniciar()
+        logger.addHandler(self.errores)
+        try:
+            if calentamiento:
+                await self._cargar(cliente, calentamiento)
+                await self._esperar_respuestas()
+
+            self.medicion = Medicion()
+            self.consultas.reiniciar()
+            self.errores.errores.clear()
+            metricas_etapas.reiniciar(muestras=max(mensajes * 4, MUESTRAS_ETAPAS))
+            graph_antes = self.simulador.resumen()
+            fallidos_antes = await en_bd(Message.objects.filter(direction='outgoing', status='failed').count)
+
+            inicio = time.perf_counter()
+            await self._cargar(cliente, mensajes)
+            carga_s = time.perf_counter() - inicio
+            await self._esperar_respuestas()
+            total_s = time.perf_counter() - inicio
+
+            fallidos = await en_bd(Message.objects.filter(direction='outgoing', status='failed').count)
+        finally:
+            logger.removeHandler(self.errores)
+            self.consultas.detener()
+
+        resultado = self.medicion.resumen()
+        resultado['errores']['envios_fallidos'] = fallidos - fallidos_antes
+        resultado['errores']['registrados'] = dict(self.errores.errores.most_common())
+        return {
+            'duracion_s': round(total_s, 3),
+            'carga_s': round(carga_s, 3),
+            'rendimiento': {
+                'peticiones_por_s': round(resultado['peticiones'] / carga_s, 2),
+                'mensajes_por_s': round(resultado['mensajes'] / carga_s, 2),
+                'respuestas_por_s': round(resultado['respuestas'] / total_s, 2),
+            },
+            **resultado,
+            'etapas': metricas_etapas.resumen(),
+            'bd': self.consultas.resumen(resultado['mensajes']),
+            'graph': _diferencia(self.simulador.resumen(), graph_antes),
+        }
+
+    async def _cargar(self, cliente, cantidad):
+        if self.rps:
+            # Carga abierta: las llegadas no esperan a que el webhook responda
+            inicio = time.perf_counter()
+            tareas = []
+            for i in range(cantidad):
+                espera = inicio + i / self.rps - time.perf_counter()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                tareas.append(asyncio.create_task(self._disparar(cliente)))
+            await asyncio.gather(*tareas)
+            return
+
+        restantes = iter(range(cantidad))
+
+        async def trabajador():
+            for _ in restantes:
+                await self._disparar(cliente)
+
+        await asyncio.gather(*(trabajador() for _ in range(self.concurrencia)))
+
+    async def _disparar(self, cliente):
+        tipo, payload, numeros = self.generador.siguiente()
+        medicion = self.medicion
+        inicio = time.perf_counter()
+        medicion.entrante(numeros, inicio)
+        try:
+            cuerpo = json.dumps(payload)
+            # Firmado como lo hace Meta: la verificación de la firma también se mide
+            encabezados = {}
+            if settings.META_WEBHOOK_SECRET:
+                encabezados['X-Hub-Signature-256'] = firmar(cuerpo.encode(), settings.META_WEBHOOK_SECRET)
+            respuesta = await cliente.post(
+                RUTA_WEBHOOK, data=cuerpo, content_type='application/json', headers=encabezados
+            )
+            estado = respuesta.status_code
+        except Exception as e:
+            estado = type(e).__name__
+        medicion.webhook(tipo, (time.perf_counter() - inicio) * 1000, estado)
+
+    async def _esperar_respuestas(self):
+        """Hasta que todo mensaje tenga respuesta, o el despachador esté vacío y quieto"""
+        limite = time.perf_counter() + self.espera
+        while time.perf_counter() < limite and self.medicion.pendientes():
+            quieto = time.perf_counter() - self.medicion.ultima_respuesta > 5
+            if quieto and not despachador.pendientes():
+                break
+            await asyncio.sleep(0.05)
+
+
+def _diferencia(despues, antes):
+    """Contadores del simulador acumulados entre dos resúmenes"""
+    return {
+        clave: {k: v - antes[clave].get(k, 0) for k, v in valor.items()} if isinstance(valor, dict)
+        else valor - antes[clave]
+        for clave, valor in despues.items()
+    }
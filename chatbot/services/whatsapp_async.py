@@ -0,0 +1,135 @@
+"""
+Cliente asyncio de WhatsApp Business API (httpx) para el webhook ASGI
+
+Mientras espera a Meta no ocupa un hilo: un mismo proceso atiende cientos de
+conversaciones a la vez. Usa la misma URL, los mismos timeouts y los mismos
+payloads que WhatsAppService, y sus latencias se suman a las métricas de
+transporte_graph (estado en /chatbot/status/).
+
+El cliente httpx se crea uno por event loop: con ASGI hay uno solo por
+proceso; bajo WSGI Django corre las vistas async en un loop por petición.
+"""
+import asyncio
+import logging
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+from .graph_transport import transporte_graph
+from .reply_segmenter import segmentar
+from .whatsapp_service import ResultadoEnvio, WhatsAppService
+
+logger = logging.getLogger('chatbot')
+
+_clientes = weakref.WeakKeyDictionary()
+
+
+def cliente_http():
+    """httpx.AsyncClient del event loop actual"""
+    loop = asyncio.get_running_loop()
+    cliente = _clientes.get(loop)
+    if cliente is None:
+        # Los clientes guardan una referencia a su loop: descartar los de loops ya cerrados
+        for cerrado in [l for l in _clientes if l.is_closed()]:
+            del _clientes[cerrado]
+        cliente = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.GRAPH_HTTP_READ_TIMEOUT, connect=settings.GRAPH_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GRAPH_HTTP_POOL_MAXSIZE,
+            ),
+            # Solo reintenta si no pudo conectar: un POST ya enviado no se repite
+            transport=httpx.AsyncHTTPTransport(retries=settings.GRAPH_HTTP_RETRIES),
+        )
+        _clientes[loop] = cliente
+    return cliente
+
+
+class WhatsAppServiceAsync:
+    """Versión asyncio de los envíos de WhatsAppService"""
+
+    def __init__(self):
+        self.base_url = settings.META_GRAPH_BASE_URL
+        self.phone_number_id = settings.META_PHONE_NUMBER_ID
+        self.access_token = settings.META_ACCESS_TOKEN
+
+    @property
+    def url_mensajes(self):
+        return f"{self.base_url}/{self.phone_number_id}/messages"
+
+    def _get_headers(self):
+        return {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+
+    async def _post(self, payload, endpoint='messages'):
+        inicio = time.perf_counter()
+        ok = False
+        try:
+            response = await cliente_http().post(self.url_mensajes, headers=self._get_headers(), json=payload)
+            ok = response.is_success
+            return response
+        finally:
+            transporte_graph.registrar(f"{endpoint}_async", (time.perf_counter() - inicio) * 1000, ok)
+
+    async def enviar(self, payload):
+        """
+        Enviar un payload ya armado a /messages
+
+        Returns:
+            ResultadoEnvio (mismas reglas de reintento que WhatsAppService.enviar)
+        """
+        try:
+            return ResultadoEnvio.desde_respuesta(await self._post(payload))
+        except httpx.HTTPError as e:
+            # Solo si no se pudo abrir la conexión es seguro que Meta no recibió nada
+            sin_enviar = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            return ResultadoEnvio(error=f"Error enviando mensaje: {e}", entregado_a_meta=not sin_enviar)
+
+    async def send_text_message(self, to_number, text):
+        """
+        Enviar mensaje de texto (en varias partes, en orden, si es muy largo)
+
+        Returns:
+            message_id (de la última parte) si tiene éxito, None en caso de error
+            o si el texto está vacío
+        """
+        partes = segmentar(text)
+        if not partes:
+            logger.warning("Mensaje vacío: no se envía")
+            return None
+        message_id = None
+        for parte in partes:
+            resultado = await self.enviar(WhatsAppService.payload_texto(to_number, parte))
+            if not resultado.ok:
+                logger.error(f"Error enviando mensaje: {resultado.error}")
+                return None
+            message_id = resultado.message_id
+            logger.info(f"Mensaje enviado exitosamente: {message_id}")
+        return message_id
+
+    async def mark_as_read(self, message_id, mostrar_escribiendo=False):
+        """
+        Marcar mensaje como leído (y mostrar "escribiendo..." si se pide)
+
+        Returns:
+            True si tiene éxito, False en caso de error
+        """
+        payload = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        if mostrar_escribiendo:
+            payload["typing_indicator"] = {"type": "text"}
+
+        try:
+            response = await self._post(payload)
+            response.raise_for_status()
+            return True
+        except httpx.HTTPError as e:
+            logger.error(f"Error marcando como leído: {str(e)}")
+            return False
@@ -2,20 +2,83 @@
 Servicio para interactuar con WhatsApp Business API
 """
 import logging
+import shutil
 import requests
 from django.conf import settings
+from django.core.cache import cache
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from .graph_transport import transporte_graph
+from .media_store import almacen_media, MediaDemasiadoGrande, MediaCorrupto
+from .reply_segmenter import segmentar
 
 logger = logging.getLogger('chatbot')
 
+# Errores de envío por un ID de media que Meta ya no tiene (vencido o borrado)
+CODIGOS_MEDIA_INVALIDA = {100, 131053}
+
+
+class ResultadoEnvio:
+    """
+    Resultado de un POST a /messages con lo necesario para decidir si reintentar
+    
+    `entregado_a_meta` es False solo cuando la petición no llegó a salir
+    (fallo de conexión); con un timeout de lectura Meta pudo haberla aceptado.
+    """
+    
+    __slots__ = ('message_id', 'status_code', 'codigo', 'subcodigo', 'error', 'retry_after', 'entregado_a_meta')
+    
+    def __init__(self, message_id=None, status_code=None, codigo=None, subcodigo=None,
+                 error='', retry_after=None, entregado_a_meta=True):
+        self.message_id = message_id
+        self.status_code = status_code
+        self.codigo = codigo
+        self.subcodigo = subcodigo
+        self.error = error
+        self.retry_after = retry_after
+        self.entregado_a_meta = entregado_a_meta
+    
+    @property
+    def ok(self):
+        return self.message_id is not None
+    
+    @classmethod
+    def desde_respuesta(cls, response):
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        
+        # status_code en lugar de .ok: sirve igual para respuestas de requests y de httpx
+        if response.status_code < 400:
+            message_id = (data.get('messages') or [{}])[0].get('id')
+            return cls(message_id=message_id, status_code=response.status_code,
+                       error='' if message_id else 'Respuesta sin id de mensaje')
+        
+        error = data.get('error') or {}
+        detalle = (error.get('error_data') or {}).get('details') or error.get('message') or response.text[:300]
+        retry_after = response.headers.get('Retry-After')
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return cls(
+            status_code=response.status_code,
+            codigo=error.get('code'),
+            subcodigo=error.get('error_subcode'),
+            error=f"HTTP {response.status_code} (código {error.get('code')}): {detalle}",
+            retry_after=retry_after,
+        )
+
 
 class WhatsAppService:
     """Cliente para WhatsApp Business API de Meta"""
     
-    BASE_URL = "https://graph.facebook.com/v22.0"
-    
     def __init__(self):
+        self.base_url = settings.META_GRAPH_BASE_URL
         self.phone_number_id = settings.META_PHONE_NUMBER_ID
         self.access_token = settings.META_ACCESS_TOKEN
+        # Sesión HTTP compartida por el proceso (conexiones keep-alive)
+        self.transporte = transporte_graph
         
         if not self.phone_number_id or not self.access_token:
             logger.warning("WhatsApp credentials not configured")
@@ -27,20 +90,38 @@ class WhatsAppService:
             'Content-Type': 'application/json'
         }
     
-    def send_text_message(self, to_number, text):
+    def enviar(self, payload):
         """
-        Enviar mensaje de texto
+        Enviar un payload ya armado a /messages sin ocultar el tipo de error
         
-        Args:
-            to_number: Número de teléfono del destinatario
-            text: Texto del mensaje
+        Lo usa el despachador de salida (services/dispatcher.py) para decidir
+        entre reintentar, esperar o dar el envío por fallido.
         
         Returns:
-            message_id si tiene éxito, None en caso de error
+            ResultadoEnvio
         """
-        url = f"{self.BASE_URL}/{self.phone_number_id}/messages"
-        
-        payload = {
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
+        try:
+            response = self.transporte.post(
+                url,
+                endpoint='messages',
+                headers=self._get_headers(),
+                json=payload
+            )
+            return ResultadoEnvio.desde_respuesta(response)
+        except requests.exceptions.RequestException as e:
+            # Solo si no se pudo abrir la conexión es seguro que Meta no recibió nada
+            causa = getattr(e.args[0], 'reason', None) if e.args else None
+            sin_enviar = (
+                isinstance(e, requests.exceptions.ConnectTimeout)
+                or isinstance(causa, (NewConnectionError, ConnectTimeoutError))
+            )
+            return ResultadoEnvio(error=f"Error enviando mensaje: {e}", entregado_a_meta=not sin_enviar)
+    
+    @staticmethod
+    def payload_texto(to_number, text):
+        """Payload de un mensaje de texto"""
+        return {
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
             "to": to_number,
@@ -50,29 +131,73 @@ class WhatsAppService:
                 "body": text
             }
         }
+    
+    def send_text_message(self, to_number, text):
+        """
+        Enviar mensaje de texto
         
-        try:
-            response = requests.post(
-                url,
-                headers=self._get_headers(),
-                json=payload,
-                timeout=10
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            message_id = data.get('messages', [{}])[0].get('id')
-            
-            logger.info(f"Mensaje enviado exitosamente: {message_id}")
-            return message_id
+        Un texto más largo que WHATSAPP_TEXT_MAX_CHARS se envía en varias
+        partes, en orden; si una falla, no se envían las siguientes.
         
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error enviando mensaje: {str(e)}")
-            if hasattr(e.response, 'text'):
-                logger.error(f"Respuesta de error: {e.response.text}")
+        Args:
+            to_number: Número de teléfono del destinatario
+            text: Texto del mensaje
+        
+        Returns:
+            message_id (de la última parte) si tiene éxito, None en caso de error
+            o si el texto está vacío
+        """
+        partes = segmentar(text)
+        if not partes:
+            logger.warning("Mensaje vacío: no se envía")
             return None
+        
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
+        
+        message_id = None
+        for parte in partes:
+            payload = self.payload_texto(to_number, parte)
+            
+            try:
+                response = self.transporte.post(
+                    url,
+                    endpoint='messages',
+                    headers=self._get_headers(),
+                    json=payload
+                )
+                response.raise_for_status()
+                
+                data = response.json()
+                message_id = data.get('messages', [{}])[0].get('id')
+                
+                logger.info(f"Mensaje enviado exitosamente: {message_id}")
+            
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error enviando mensaje: {str(e)}")
+                if hasattr(e.response, 'text'):
+                    logger.error(f"Respuesta de error: {e.response.text}")
+                return None
+        return message_id
     
-    def send_template_message(self, to_number, template_name, language_code='es'):
+    @staticmethod
+    def payload_plantilla(to_number, template_name, language_code='es', components=None):
+        """Payload de un mensaje de plantilla (components: parámetros de encabezado, cuerpo, botones)"""
+        template = {
+            "name": template_name,
+            "language": {
+                "code": language_code
+            }
+        }
+        if components:
+            template["components"] = components
+        return {
+            "messaging_product": "whatsapp",
+            "to": to_number,
+            "type": "template",
+            "template": template
+        }
+    
+    def send_template_message(self, to_number, template_name, language_code='es', components=None):
         """
         Enviar mensaje desde plantilla aprobada
         
@@ -80,30 +205,21 @@ class WhatsAppService:
             to_number: Número de teléfono del destinatario
             template_name: Nombre de la plantilla
             language_code: Código del idioma
+            components: Lista de componentes con los parámetros de la plantilla (opcional)
         
         Returns:
             message_id si tiene éxito, None en caso de error
         """
-        url = f"{self.BASE_URL}/{self.phone_number_id}/messages"
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
         
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "template",
-            "template": {
-                "name": template_name,
-                "language": {
-                    "code": language_code
-                }
-            }
-        }
+        payload = self.payload_plantilla(to_number, template_name, language_code, components)
         
         try:
-            response = requests.post(
+            response = self.transporte.post(
                 url,
+                endpoint='messages',
                 headers=self._get_headers(),
-                json=payload,
-                timeout=10
+                json=payload
             )
             response.raise_for_status()
             
@@ -117,10 +233,26 @@ class WhatsAppService:
             logger.error(f"Error enviando plantilla: {str(e)}")
             return None
     
+    @staticmethod
+    def payload_imagen(to_number, media_id=None, link=None, caption=""):
+        """Payload de una imagen, por ID de media subido o por URL"""
+        imagen = {"id": media_id} if media_id else {"link": link}
+        if caption:
+            imagen["caption"] = caption
+        return {
+            "messaging_product": "whatsapp",
+            "to": to_number,
+            "type": "image",
+            "image": imagen
+        }
+    
     def send_image(self, to_number, image_url, caption=""):
         """
         Enviar imagen
         
+        La imagen se sube una sola vez y se envía por su ID de media
+        (services/media_uploads.py); si no se puede subir, se envía por link.
+        
         Args:
             to_number: Número de teléfono del destinatario
             image_url: URL de la imagen
@@ -129,61 +261,87 @@ class WhatsAppService:
         Returns:
             message_id si tiene éxito, None en caso de error
         """
-        url = f"{self.BASE_URL}/{self.phone_number_id}/messages"
+        from .media_uploads import cache_subidas
+        
+        media_id = cache_subidas.obtener_media_id(self, image_url)
+        if media_id:
+            resultado = self.enviar(self.payload_imagen(to_number, media_id=media_id, caption=caption))
+            if not resultado.ok and resultado.codigo in CODIGOS_MEDIA_INVALIDA:
+                # Meta ya no reconoce el ID: subir de nuevo una sola vez
+                logger.warning(f"ID de media {media_id} rechazado, se sube de nuevo: {resultado.error}")
+                media_id = cache_subidas.obtener_media_id(self, image_url, forzar=True)
+                if media_id:
+                    resultado = self.enviar(self.payload_imagen(to_number, media_id=media_id, caption=caption))
+        if not media_id:
+            resultado = self.enviar(self.payload_imagen(to_number, link=image_url, caption=caption))
+        
+        if not resultado.ok:
+            logger.error(f"Error enviando imagen: {resultado.error}")
+            return None
+        logger.info(f"Imagen enviada: {resultado.message_id}")
+        return resultado.message_id
+    
+    def upload_media(self, archivo, mime_type, nombre='archivo'):
+        """
+        Subir un archivo al endpoint /media para enviarlo luego por su ID
         
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "image",
-            "image": {
-                "link": image_url,
-                "caption": caption
-            }
-        }
+        Args:
+            archivo: Archivo abierto en modo binario
+            mime_type: Tipo MIME del archivo
+            nombre: Nombre del archivo en el multipart
+        
+        Returns:
+            media_id si tiene éxito, None en caso de error
+        """
+        url = f"{self.base_url}/{self.phone_number_id}/media"
         
         try:
-            response = requests.post(
+            response = self.transporte.post(
                 url,
-                headers=self._get_headers(),
-                json=payload,
-                timeout=10
+                endpoint='media_upload',
+                timeout=(settings.GRAPH_HTTP_CONNECT_TIMEOUT, settings.GRAPH_HTTP_DOWNLOAD_TIMEOUT),
+                # Sin Content-Type: requests arma el multipart/form-data
+                headers={'Authorization': f'Bearer {self.access_token}'},
+                data={'messaging_product': 'whatsapp', 'type': mime_type},
+                files={'file': (nombre, archivo, mime_type)}
             )
             response.raise_for_status()
-            
-            data = response.json()
-            message_id = data.get('messages', [{}])[0].get('id')
-            
-            logger.info(f"Imagen enviada: {message_id}")
-            return message_id
+            return response.json().get('id')
         
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error enviando imagen: {str(e)}")
+            logger.error(f"Error subiendo media: {str(e)}")
+            if hasattr(e.response, 'text'):
+                logger.error(f"Respuesta de error: {e.response.text}")
             return None
     
-    def mark_as_read(self, message_id):
+    def mark_as_read(self, message_id, mostrar_escribiendo=False):
         """
         Marcar mensaje como leído
         
         Args:
             message_id: ID del mensaje a marcar
+            mostrar_escribiendo: Mostrar además el indicador de "escribiendo..."
+                (dura hasta la respuesta o 25 segundos)
         
         Returns:
             True si tiene éxito, False en caso de error
         """
-        url = f"{self.BASE_URL}/{self.phone_number_id}/messages"
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
         
         payload = {
             "messaging_product": "whatsapp",
             "status": "read",
             "message_id": message_id
         }
+        if mostrar_escribiendo:
+            payload["typing_indicator"] = {"type": "text"}
         
         try:
-            response = requests.post(
+            response = self.transporte.post(
                 url,
+                endpoint='messages',
                 headers=self._get_headers(),
-                json=payload,
-                timeout=10
+                json=payload
             )
             response.raise_for_status()
             return True
@@ -192,33 +350,111 @@ class WhatsAppService:
             logger.error(f"Error marcando como leído: {str(e)}")
             return False
     
-    def get_media_url(self, media_id):
+    def get_media_info(self, media_id, refrescar=False):
         """
-        Obtener URL de un archivo multimedia
+        Datos de un archivo multimedia: url, mime_type, sha256 y file_size
         
-        Args:
-            media_id: ID del media en WhatsApp
+        La URL que entrega Meta vence a los pocos minutos; los datos se
+        cachean por MEDIA_URL_CACHE_SECONDS (menos que ese plazo).
         
         Returns:
-            URL del archivo o None
+            Dict con los datos o None
         """
-        url = f"{self.BASE_URL}/{media_id}"
+        clave = f"media_info:{media_id}"
+        if not refrescar:
+            info = cache.get(clave)
+            if info is not None:
+                return info
+        
+        url = f"{self.base_url}/{media_id}"
         
         try:
-            response = requests.get(
+            response = self.transporte.get(
                 url,
-                headers=self._get_headers(),
-                timeout=10
+                endpoint='media',
+                headers=self._get_headers()
             )
             response.raise_for_status()
             
-            data = response.json()
-            return data.get('url')
+            info = response.json()
+            if info.get('url'):
+                cache.set(clave, info, timeout=settings.MEDIA_URL_CACHE_SECONDS)
+            return info
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Error obteniendo URL de media: {str(e)}")
             return None
     
+    def get_media_url(self, media_id):
+        """
+        Obtener URL de un archivo multimedia
+        
+        Args:
+            media_id: ID del media en WhatsApp
+        
+        Returns:
+            URL del archivo o None
+        """
+        info = self.get_media_info(media_id)
+        return info.get('url') if info else None
+    
+    def descargar_a_almacen(self, media_id):
+        """
+        Descargar un archivo multimedia al almacén local, por partes
+        
+        Si Meta informa un SHA-256 que ya está en el almacén no se descarga;
+        si informa un tamaño mayor que MEDIA_MAX_BYTES tampoco.
+        
+        Returns:
+            ArchivoMedia o None si no se pudo descargar
+        """
+        try:
+            for intento in range(2):
+                info = self.get_media_info(media_id, refrescar=intento > 0)
+                if not info or not info.get('url'):
+                    logger.error("No se pudo obtener URL del media")
+                    return None
+                
+                existente = almacen_media.buscar(info.get('sha256'))
+                if existente is not None:
+                    return existente
+                if int(info.get('file_size') or 0) > settings.MEDIA_MAX_BYTES:
+                    logger.error(f"Media {media_id} demasiado grande: {info.get('file_size')} bytes")
+                    return None
+                
+                with self.transporte.get(
+                    info['url'],
+                    endpoint='media_download',
+                    headers={'Authorization': f'Bearer {self.access_token}'},
+                    timeout=(settings.GRAPH_HTTP_CONNECT_TIMEOUT, settings.GRAPH_HTTP_DOWNLOAD_TIMEOUT),
+                    stream=True
+                ) as response:
+                    if response.status_code in (401, 403, 404) and intento == 0:
+                        # URL vencida: pedir una nueva
+                        continue
+                    response.raise_for_status()
+                    
+                    largo = int(response.headers.get('Content-Length') or 0)
+                    if largo > settings.MEDIA_MAX_BYTES:
+                        logger.error(f"Media {media_id} demasiado grande: {largo} bytes")
+                        return None
+                    
+                    archivo = almacen_media.guardar_stream(
+                        response.iter_content(chunk_size=settings.MEDIA_CHUNK_SIZE),
+                        mime_type=info.get('mime_type') or response.headers.get('Content-Type', ''),
+                        sha256_esperado=info.get('sha256')
+                    )
+                    logger.info(f"Media descargado al almacén: {archivo.ruta} ({archivo.tamano} bytes)")
+                    return archivo
+            return None
+        
+        except (MediaDemasiadoGrande, MediaCorrupto) as e:
+            logger.error(f"Media {media_id} descartado: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error descargando media: {str(e)}")
+            return None
+    
     def download_media(self, media_id, save_path):
         """
         Descargar archivo multimedia de WhatsApp
@@ -231,24 +467,12 @@ class WhatsAppService:
             True si se descargó exitosamente, False en caso contrario
         """
         try:
-            # Obtener URL del archivo
-            media_url = self.get_media_url(media_id)
-            
-            if not media_url:
-                logger.error("No se pudo obtener URL del media")
+            archivo = self.descargar_a_almacen(media_id)
+            if archivo is None:
                 return False
             
-            # Descargar archivo
-            response = requests.get(
-                media_url,
-                headers={'Authorization': f'Bearer {self.access_token}'},
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            # Guardar archivo
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            # Copia por bloques desde el almacén
+            shutil.copyfile(almacen_media.ruta_absoluta(archivo), save_path)
             
             logger.info(f"Media descargado exitosamente: {save_path}")
             return True
@@ -271,7 +495,7 @@ class WhatsAppService:
         Returns:
             message_id si tiene éxito, None en caso de error
         """
-        url = f"{self.BASE_URL}/{self.phone_number_id}/messages"
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
         
         payload = {
             "messaging_product": "whatsapp",
@@ -286,11 +510,11 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
+            response = self.transporte.post(
                 url,
+                endpoint='messages',
                 headers=self._get_headers(),
-                json=payload,
-                timeout=10
+                json=payload
             )
             response.raise_for_status()
             
@@ -0,0 +1,52 @@
+"""
+Señales para mantener sincronizados los índices en memoria con el catálogo
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Negocio, HorarioAtencion, ProductoNegocio, CategoriaNegocio,
+    ResenaNegocio, ResumenCalificacion, EventoDeportivo, PerfilNegocio, Message,
+    resumenes_calificacion_actualizados
+)
+from .services.query_cache import cache_consultas, etiqueta
+from .services.identity_map import mapa_actual
+from .services.media_store import almacen_media
+
+
+@receiver(resumenes_calificacion_actualizados)
+def invalidar_tabla_ranking(sender, negocio_ids, **kwargs):
+    """Los resúmenes de calificación alimentan el ranking (ver TablaAtributos)"""
+    # cambiar_aprobacion() actualiza reseñas con update(), sin post_save
+    cache_consultas.invalidar(etiqueta(ResenaNegocio), etiqueta(ResumenCalificacion))
+
+
+@receiver([post_save, post_delete], sender=Negocio)
+@receiver([post_save, post_delete], sender=HorarioAtencion)
+@receiver([post_save, post_delete], sender=ProductoNegocio)
+@receiver([post_save, post_delete], sender=CategoriaNegocio)
+@receiver([post_save, post_delete], sender=ResenaNegocio)
+@receiver([post_save, post_delete], sender=ResumenCalificacion)
+@receiver([post_save, post_delete], sender=EventoDeportivo)
+@receiver([post_save, post_delete], sender=PerfilNegocio)
+def invalidar_cache_consultas(sender, using=None, **kwargs):
+    """
+    Invalidar las consultas cacheadas que dependen del modelo, ya y otra vez
+    al confirmar la transacción (otro worker pudo cachear el dato anterior
+    mientras tanto)
+    """
+    nombre = etiqueta(sender)
+    cache_consultas.invalidar(nombre)
+    # Lo que el mensaje en curso ya consultó también quedó viejo
+    mapa = mapa_actual()
+    if mapa is not None:
+        mapa.llamadas.clear()
+    transaction.on_commit(lambda: cache_consultas.invalidar(nombre), using=using)
+
+
+@receiver(post_delete, sender=Message)
+def liberar_archivo_media(sender, instance, **kwargs):
+    """Un mensaje borrado deja de referenciar su archivo del almacén"""
+    if instance.archivo_id:
+        almacen_media.liberar(instance.archivo_id)
@@ -0,0 +1,100 @@
+"""
+Presupuesto de consultas de DatabaseService
+
+Con un catálogo de tamaño realista, cada método debe hacer exactamente las
+consultas previstas y, en los métodos marcados, el plan de ejecución
+(EXPLAIN) no puede recorrer completa ninguna de las tablas indicadas.
+"""
+from django.test import TestCase
+
+from chatbot.db_router import usar_primaria
+from chatbot.models import Message
+from chatbot.services import catalogo_prueba
+from chatbot.services.db_service import DatabaseService
+from chatbot.services.query_cache import cache_consultas
+
+NEGOCIOS = 500
+
+
+class PresupuestoConsultasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        with usar_primaria():
+            cls.datos = catalogo_prueba.sembrar(NEGOCIOS)
+            catalogo_prueba.analizar_tablas()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        # Los índices en memoria se construyeron con la base de prueba
+        catalogo_prueba.invalidar_indices()
+
+    def setUp(self):
+        # La réplica de lectura no existe en la base de prueba y la caché
+        # ocultaría las consultas: todo se mide directamente sobre la BD
+        self.enterContext(usar_primaria())
+        self.enterContext(cache_consultas.desactivada())
+
+    def casos(self):
+        """
+        (nombre, llamada, consultas, tablas que no pueden recorrerse completas)
+
+        Los métodos que filtran con icontains no pueden usar índices B-tree, por
+        eso solo se les limita la cantidad de consultas.
+        """
+        negocio = self.datos['negocio']
+        conversacion = self.datos['conversacion']
+        return [
+            ('buscar_negocios', lambda: DatabaseService.buscar_negocios(categoria='Restaurante'), 1, ['negocios']),
+            ('buscar_negocios_rankeados',
+             lambda: DatabaseService.buscar_negocios_rankeados(query='panadería', texto='panadería abierta'), 1, []),
+            ('buscar_negocios_difuso', lambda: DatabaseService.buscar_negocios_difuso('restorante'), 1, ['negocios']),
+            ('obtener_negocios_mencionados',
+             lambda: DatabaseService.obtener_negocios_mencionados(negocio.nombre), 1, ['negocios']),
+            ('obtener_negocio_por_id', lambda: DatabaseService.obtener_negocio_por_id(negocio.id), 1, ['negocios']),
+            ('obtener_horarios_negocio',
+             lambda: DatabaseService.obtener_horarios_negocio(negocio.id), 1, ['horarios_atencion']),
+            ('verificar_negocio_abierto', lambda: DatabaseService.verificar_negocio_abierto(negocio.id), 0, []),
+            ('obtener_productos_negocio',
+             lambda: DatabaseService.obtener_productos_negocio(negocio.id), 1, ['productos_negocio']),
+            ('buscar_productos_negocio',
+             lambda: DatabaseService.buscar_productos_negocio(negocio.id, 'producto'), 1, ['productos_negocio']),
+            ('buscar_productos_globalmente', lambda: DatabaseService.buscar_productos_globalmente('producto 1'), 1, []),
+            ('obtener_categorias_negocios', DatabaseService.obtener_categorias_negocios, 2, []),
+            ('obtener_resenas_negocio',
+             lambda: DatabaseService.obtener_resenas_negocio(negocio.id), 1, ['resenas_negocio']),
+            ('obtener_calificacion_promedio',
+             lambda: DatabaseService.obtener_calificacion_promedio(negocio.id), 1, ['resumen_calificaciones']),
+            ('obtener_estadisticas_negocio',
+             lambda: DatabaseService.obtener_estadisticas_negocio(negocio.id), 2, ['negocios', 'productos_negocio']),
+            ('buscar_negocios_cercanos', lambda: DatabaseService.buscar_negocios_cercanos(barrio='Centro'), 1, []),
+            ('buscar_negocios_mas_cercanos',
+             lambda: DatabaseService.buscar_negocios_mas_cercanos(negocio.latitud, negocio.longitud), 0, []),
+            ('buscar_negocios_en_radio',
+             lambda: DatabaseService.buscar_negocios_en_radio(negocio.latitud, negocio.longitud, 1.0), 0, []),
+            ('obtener_info_completa_negocio',
+             lambda: DatabaseService.obtener_info_completa_negocio(negocio.id), 5,
+             ['negocios', 'horarios_atencion', 'productos_negocio', 'resenas_negocio', 'resumen_calificaciones']),
+            ('obtener_negocios_abiertos_ahora', DatabaseService.obtener_negocios_abiertos_ahora, 0, []),
+            ('obtener_eventos_proximos',
+             lambda: DatabaseService.obtener_eventos_proximos(dias=30), 1, ['eventos_deportivos']),
+            ('buscar_eventos', lambda: DatabaseService.buscar_eventos(query='Evento'), 1, []),
+            ('obtener_evento_por_id',
+             lambda: DatabaseService.obtener_evento_por_id(self.datos['evento_id']), 1, ['eventos_deportivos']),
+            ('Conversation.get_recent_messages',
+             lambda: conversacion.get_recent_messages(), 1, [Message._meta.db_table]),
+        ]
+
+    def test_consultas_por_metodo(self):
+        for nombre, llamada, consultas, tablas in self.casos():
+            with self.subTest(nombre):
+                # Primera llamada fuera de la medición: construye los índices en memoria
+                catalogo_prueba.evaluar(llamada())
+
+                with self.assertNumQueries(consultas) as capturadas:
+                    catalogo_prueba.evaluar(llamada())
+
+                for consulta in capturadas.captured_queries:
+                    for tabla in catalogo_prueba.tablas_recorridas(consulta['sql']):
+                        self.assertNotIn(tabla, tablas, f'Recorrido completo de {tabla}: {consulta["sql"]}')
@@ -1,15 +1,27 @@
 """
 Views para manejar webhook de WhatsApp - VERSION CON DEBUG MEJORADO
 """
+import asyncio
+import hashlib
+import hmac
 import logging
 import json
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
-from .models import Conversation, Message
-from .services.whatsapp_service import WhatsAppService
+from django.utils import timezone
+from .models import Conversation, Message, BotContext
 from .services.gemini_service import GeminiService
+from .services.db_service import DatabaseService
+from .services.query_cache import cache_consultas
+from .services.identity_map import contexto_mensaje
+from .db_backend.base import metricas as metricas_bd
+from .services.graph_transport import transporte_graph
+from .services.dispatcher import despachador, registrar_estados
+from .services.media_store import almacen_media
+from .services.message_pipeline import EtapasMensaje, en_bd, metricas_etapas
+from .services.whatsapp_async import WhatsAppServiceAsync
 
 logger = logging.getLogger('chatbot')
 
@@ -29,9 +41,9 @@ def index(request):
 
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
-def webhook(request):
+async def webhook(request):
     """
-    Endpoint del webhook de WhatsApp
+    Endpoint del webhook de WhatsApp (vista async: ver whatsapp_project/asgi.py)
     - GET: Verificación del webhook por parte de Meta
     - POST: Recepción de mensajes
     """
@@ -46,7 +58,7 @@ def webhook(request):
     if request.method == 'GET':
         return verify_webhook(request)
     elif request.method == 'POST':
-        return handle_webhook(request)
+        return await handle_webhook(request)
 
 
 def verify_webhook(request):
@@ -106,10 +118,24 @@ def verify_webhook(request):
     return HttpResponse(challenge, content_type='text/plain', status=200)
 
 
-def handle_webhook(request):
+def firma_valida(cuerpo, firma):
+    """
+    Comprobar el encabezado X-Hub-Signature-256: HMAC-SHA256 del cuerpo con
+    la clave secreta de la app (META_WEBHOOK_SECRET)
+    """
+    esperada = 'sha256=' + hmac.new(settings.META_WEBHOOK_SECRET.encode(), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada.encode(), (firma or '').encode())
+
+
+async def handle_webhook(request):
     """
     Maneja los mensajes entrantes de WhatsApp
     """
+    # Con la clave secreta configurada solo se aceptan cuerpos firmados por Meta
+    if settings.META_WEBHOOK_SECRET and not firma_valida(request.body, request.headers.get('X-Hub-Signature-256')):
+        logger.warning("⚠️ Webhook rechazado: firma X-Hub-Signature-256 inválida o ausente")
+        return HttpResponse('Error: Firma inválida', status=403)
+    
     try:
         # LOG CRÍTICO: Registrar el body RAW
         raw_body = request.body.decode('utf-8')
@@ -164,6 +190,12 @@ def handle_webhook(request):
                 value = change.get('value', {})
                 logger.info(f"      📊 Value keys: {list(value.keys())}")
                 
+                # Estados de entrega de los mensajes enviados
+                statuses = value.get('statuses', [])
+                if statuses:
+                    actualizados = await en_bd(registrar_estados, statuses)
+                    logger.info(f"      📬 Estados recibidos: {len(statuses)} ({actualizados} actualizados)")
+                
                 # Verificar mensajes
                 messages = value.get('messages', [])
                 logger.info(f"      💬 Número de mensajes: {len(messages)}")
@@ -179,7 +211,8 @@ def handle_webhook(request):
                     logger.info(f"      📱 From: {message_data.get('from')}")
                     logger.info(f"      📖 Type: {message_data.get('type')}")
                     
-                    process_message(message_data, value)
+                    # En orden: los mensajes de un mismo usuario se responden uno tras otro
+                    await process_message(message_data, value)
         
         logger.info("✅ Webhook procesado exitosamente")
         return JsonResponse({'status': 'ok'})
@@ -193,123 +226,262 @@ def handle_webhook(request):
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
-def process_message(message_data, value):
+async def process_message(message_data, value):
     """
-    Procesa un mensaje individual
+    Procesa un mensaje individual (con su propio mapa de identidad: las
+    consultas repetidas mientras se arma la respuesta se resuelven una vez)
+    
+    La confirmación de lectura y el contexto del catálogo corren a la vez
+    mientras se guarda el mensaje y se lee el historial; el ORM va al pool
+    acotado de services/message_pipeline.py y las esperas a Meta y a Gemini
+    no ocupan hilos. Los tiempos de cada etapa quedan en el log.
     """
-    try:
-        # Extraer datos
-        message_id = message_data.get('id')
-        from_number = message_data.get('from')
-        timestamp = message_data.get('timestamp')
-        message_type = message_data.get('type')
-        
-        logger.info(f"      🔧 PROCESANDO MENSAJE")
-        logger.info(f"         📱 De: {from_number}")
-        logger.info(f"         📖 Tipo: {message_type}")
-        logger.info(f"         🆔 ID: {message_id}")
-        
-        # Obtener/crear conversación
-        contacts = value.get('contacts', [])
-        contact_name = contacts[0].get('profile', {}).get('name', '') if contacts else ''
-        
-        logger.info(f"         👤 Nombre contacto: {contact_name}")
-        
-        conversation, created = Conversation.objects.get_or_create(
-            phone_number=from_number,
-            defaults={'name': contact_name}
-        )
-        
-        if created:
-            logger.info(f"         ✨ Nueva conversación creada: {from_number}")
-        else:
-            logger.info(f"         📂 Conversación existente: {conversation.id}")
-        
-        # Extraer contenido
-        content = ""
-        media_url = None
-        
-        if message_type == 'text':
-            content = message_data.get('text', {}).get('body', '')
-            logger.info(f"         💬 Contenido: {content}")
-        elif message_type == 'image':
-            image_data = message_data.get('image', {})
-            content = image_data.get('caption', '[Imagen recibida]')
-            media_url = image_data.get('id')
-        elif message_type == 'audio':
-            content = '[Audio recibido]'
-            media_url = message_data.get('audio', {}).get('id')
-        elif message_type == 'video':
-            video_data = message_data.get('video', {})
-            content = video_data.get('caption', '[Video recibido]')
-            media_url = video_data.get('id')
-        elif message_type == 'document':
-            doc_data = message_data.get('document', {})
-            content = f"[Documento: {doc_data.get('filename', 'sin nombre')}]"
-            media_url = doc_data.get('id')
-        elif message_type == 'location':
-            loc_data = message_data.get('location', {})
-            lat = loc_data.get('latitude')
-            lon = loc_data.get('longitude')
-            content = f"[Ubicación: {lat}, {lon}]" if lat and lon else "[Ubicación]"
-        elif message_type == 'sticker':
-            content = '[Sticker recibido]'
-            media_url = message_data.get('sticker', {}).get('id')
-        else:
-            content = f"[{message_type.capitalize()} recibido]"
+    with contexto_mensaje():
+        etapas = EtapasMensaje()
+        try:
+            await _procesar_mensaje(message_data, value, etapas)
+        except Exception as e:
+            logger.error(f"❌ Error procesando mensaje: {str(e)}", exc_info=True)
+        finally:
+            logger.info(f"         ⏱️ Etapas: {etapas.resumen()}")
+            metricas_etapas.registrar(etapas)
+
 
-        # Guardar mensaje
-        incoming_message = Message.objects.create(
-            conversation=conversation,
-            message_id=message_id,
-            direction='incoming',
-            message_type=message_type,
-            content=content,
-            media_url=media_url
+async def _procesar_mensaje(message_data, value, etapas):
+    # Extraer datos
+    message_id = message_data.get('id')
+    from_number = message_data.get('from')
+    message_type = message_data.get('type')
+    
+    logger.info(f"      🔧 PROCESANDO MENSAJE")
+    logger.info(f"         📱 De: {from_number}")
+    logger.info(f"         📖 Tipo: {message_type}")
+    logger.info(f"         🆔 ID: {message_id}")
+    
+    contacts = value.get('contacts', [])
+    contact_name = contacts[0].get('profile', {}).get('name', '') if contacts else ''
+    
+    logger.info(f"         👤 Nombre contacto: {contact_name}")
+    
+    content, media_url, ubicacion = extraer_contenido(message_data)
+    
+    # Etapas que no dependen de la BD de conversaciones
+    tareas = []
+    lectura = None
+    if settings.MESSAGE_READ_RECEIPTS:
+        lectura = asyncio.create_task(etapas.esperar(
+            'lectura',
+            WhatsAppServiceAsync().mark_as_read(message_id, mostrar_escribiendo=(message_type == 'text'))
+        ))
+        tareas.append(lectura)
+    if message_type == 'text':
+        gemini_service = GeminiService()
+        contexto_negocios = asyncio.create_task(etapas.ejecutar(
+            'contexto', gemini_service.construir_contexto_negocios, content, from_number
+        ))
+        tareas.append(contexto_negocios)
+    
+    try:
+        conversation, incoming_message = await etapas.ejecutar(
+            'guardar', guardar_mensaje_entrante,
+            from_number, contact_name, message_id, message_type, content, media_url
         )
         
-        logger.info(f"         💾 Mensaje guardado en BD: {incoming_message.id}")
+        # Copia local del medio, descargada en segundo plano
+        if media_url and settings.MEDIA_STORE_INCOMING:
+            almacen_media.guardar_entrante(incoming_message.pk, media_url)
         
         # Procesar respuesta
         if message_type == 'text':
             logger.info("         🤖 Generando respuesta con Gemini...")
             
-            # Gemini
-            gemini_service = GeminiService()
-            recent_messages = conversation.get_recent_messages(limit=5)
-            context = "\n".join([
-                f"{'Usuario' if msg.direction == 'incoming' else 'Bot'}: {msg.content}"
-                for msg in reversed(list(recent_messages))
-            ])
+            context = await etapas.ejecutar('historial', historial_conversacion, conversation)
             
-            response_text = gemini_service.get_response(content, context)
-            logger.info(f"         💡 Respuesta generada: {response_text[:100]}...")
+            try:
+                db_context = await contexto_negocios
+            except Exception as e:
+                # Se vuelve a armar dentro de get_response_async
+                logger.error(f"Error armando el contexto de negocios en paralelo: {e}")
+                db_context = None
             
-            # Enviar por WhatsApp
-            whatsapp_service = WhatsAppService()
-            response_message_id = whatsapp_service.send_text_message(from_number, response_text)
+            # Gemini
+            response_text = await etapas.esperar('llm', gemini_service.get_response_async(
+                content, context, phone_number=from_number, db_context=db_context
+            ))
+            logger.info(f"         💡 Respuesta generada: {response_text[:100]}...")
             
-            if response_message_id:
-                Message.objects.create(
-                    conversation=conversation,
-                    message_id=response_message_id,
-                    direction='outgoing',
-                    message_type='text',
-                    content=response_text,
-                    status='sent'
-                )
-                logger.info(f"         ✅ Respuesta enviada: {response_message_id}")
-            else:
-                logger.error("         ❌ Error enviando respuesta")
+            # Enviar por WhatsApp (el despachador registra el resultado en el Message)
+            partes = await etapas.ejecutar(
+                'encolar', despachador.encolar_texto,
+                conversation, from_number, response_text, respuesta_a=incoming_message
+            )
+            if partes:
+                logger.info(f"         ✅ Respuesta encolada: {partes[0].id} ({len(partes)} partes)")
+        elif ubicacion:
+            # Ubicación: responder con los negocios más cercanos, sin LLM
+            logger.info("         📍 Buscando negocios cercanos a la ubicación...")
+            partes = await etapas.ejecutar(
+                'ubicacion', responder_ubicacion, conversation, incoming_message, from_number, ubicacion
+            )
+            logger.info(f"         ✅ Respuesta encolada: {partes[0].id} ({len(partes)} partes)")
         else:
             # Mensaje multimedia
             logger.info("         🖼️ Enviando respuesta para multimedia...")
-            whatsapp_service = WhatsAppService()
             response_text = "He recibido tu mensaje multimedia. Por ahora solo respondo textos."
-            whatsapp_service.send_text_message(from_number, response_text)
+            await etapas.ejecutar(
+                'encolar', despachador.encolar_texto,
+                conversation, from_number, response_text, respuesta_a=incoming_message
+            )
+        
+        if lectura is not None:
+            await lectura
+    finally:
+        # Si una etapa falla, las tareas lanzadas no quedan sueltas
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+
+def extraer_contenido(message_data):
+    """
+    Contenido del mensaje según su tipo
     
-    except Exception as e:
-        logger.error(f"❌ Error procesando mensaje: {str(e)}", exc_info=True)
+    Returns:
+        (contenido, id del medio o None, (latitud, longitud) o None)
+    """
+    message_type = message_data.get('type')
+    content = ""
+    media_url = None
+    ubicacion = None
+    
+    if message_type == 'text':
+        content = message_data.get('text', {}).get('body', '')
+        logger.info(f"         💬 Contenido: {content}")
+    elif message_type == 'image':
+        image_data = message_data.get('image', {})
+        content = image_data.get('caption', '[Imagen recibida]')
+        media_url = image_data.get('id')
+    elif message_type == 'audio':
+        content = '[Audio recibido]'
+        media_url = message_data.get('audio', {}).get('id')
+    elif message_type == 'video':
+        video_data = message_data.get('video', {})
+        content = video_data.get('caption', '[Video recibido]')
+        media_url = video_data.get('id')
+    elif message_type == 'document':
+        doc_data = message_data.get('document', {})
+        content = f"[Documento: {doc_data.get('filename', 'sin nombre')}]"
+        media_url = doc_data.get('id')
+    elif message_type == 'location':
+        loc_data = message_data.get('location', {})
+        lat = loc_data.get('latitude')
+        lon = loc_data.get('longitude')
+        content = f"[Ubicación: {lat}, {lon}]" if lat and lon else "[Ubicación]"
+        if lat is not None and lon is not None:
+            ubicacion = (float(lat), float(lon))
+    elif message_type == 'sticker':
+        content = '[Sticker recibido]'
+        media_url = message_data.get('sticker', {}).get('id')
+    else:
+        content = f"[{message_type.capitalize()} recibido]"
+    
+    return content, media_url, ubicacion
+
+
+def guardar_mensaje_entrante(from_number, contact_name, message_id, message_type, content, media_url):
+    """
+    Obtener/crear la conversación y guardar el mensaje entrante
+    
+    Returns:
+        (conversation, incoming_message)
+    """
+    conversation, created = Conversation.objects.get_or_create(
+        phone_number=from_number,
+        defaults={'name': contact_name}
+    )
+    
+    if created:
+        logger.info(f"         ✨ Nueva conversación creada: {from_number}")
+    else:
+        logger.info(f"         📂 Conversación existente: {conversation.id}")
+    
+    incoming_message = Message.objects.create(
+        conversation=conversation,
+        message_id=message_id,
+        direction='incoming',
+        message_type=message_type,
+        content=content,
+        media_url=media_url
+    )
+    
+    logger.info(f"         💾 Mensaje guardado en BD: {incoming_message.id}")
+    return conversation, incoming_message
+
+
+def historial_conversacion(conversation):
+    """Últimos mensajes de la conversación como texto para el prompt"""
+    recent_messages = conversation.get_recent_messages(limit=5)
+    return "\n".join([
+        f"{'Usuario' if msg.direction == 'incoming' else 'Bot'}: {msg.content}"
+        for msg in reversed(list(recent_messages))
+    ])
+
+
+def responder_ubicacion(conversation, incoming_message, from_number, ubicacion):
+    """Guardar la ubicación y encolar los negocios más cercanos"""
+    guardar_ubicacion(conversation, *ubicacion)
+    response_text = construir_respuesta_ubicacion(*ubicacion)
+    return despachador.encolar_texto(
+        conversation, from_number, response_text, respuesta_a=incoming_message
+    )
+
+
+def guardar_ubicacion(conversation, latitud, longitud):
+    """
+    Guardar la última ubicación compartida por el usuario en su contexto
+    """
+    bot_context, _ = BotContext.objects.get_or_create(conversation=conversation)
+    bot_context.context_data['ultima_ubicacion'] = {
+        'latitud': latitud,
+        'longitud': longitud,
+        'fecha': timezone.now().isoformat(),
+    }
+    bot_context.save(update_fields=['context_data', 'updated_at'])
+
+
+def construir_respuesta_ubicacion(latitud, longitud):
+    """
+    Construir la respuesta a un mensaje de ubicación con los negocios más cercanos
+    """
+    cercanos = DatabaseService.buscar_negocios_mas_cercanos(
+        latitud, longitud, k=settings.GEO_NEAREST_RESULTS, radio_max_km=settings.GEO_MAX_RADIUS_KM
+    )
+    
+    if not cercanos:
+        return ("Manito, no tengo negocios con ubicación registrada cerca de ti. "
+                "Cuéntame qué estás buscando y te ayudo.")
+    
+    lineas = ["📍 Manito, estos son los negocios más cercanos a tu ubicación:\n"]
+    for posicion, (negocio, distancia) in enumerate(cercanos, start=1):
+        if distancia < 1:
+            distancia_texto = f"{distancia * 1000:.0f} m"
+        else:
+            distancia_texto = f"{distancia:.1f} km"
+        
+        lineas.append(f"{posicion}. *{negocio.nombre}* ({distancia_texto})")
+        direccion = negocio.direccion
+        if negocio.barrio:
+            direccion += f" - {negocio.barrio}"
+        lineas.append(f"   {direccion}")
+        
+        estado = DatabaseService.verificar_negocio_abierto(negocio.id)
+        if estado['abierto'] is not None:
+            emoji = "🟢" if estado['abierto'] else "🔴"
+            lineas.append(f"   {emoji} {estado['mensaje']}")
+    
+    lineas.append("\n¿Te mando la ubicación exacta de alguno?")
+    return "\n".join(lineas)
 
 
 @require_http_methods(["GET"])
@@ -330,6 +502,12 @@ def status(request):
             'gemini_configured': bool(settings.GEMINI_API_KEY),
             'debug_mode': settings.DEBUG,
             'allowed_hosts': settings.ALLOWED_HOSTS,
+            'db_conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
         },
+        'database': metricas_bd.resumen(),
+        'query_cache': cache_consultas.estadisticas(),
+        'whatsapp_http': transporte_graph.resumen(),
+        'outbound_queue': despachador.pendientes(),
+        'message_stages': metricas_etapas.resumen(),
         'test_url': request.build_absolute_uri('/chatbot/webhook/') + '?hub.mode=subscribe&hub.verify_token=my_secure_verify_token&hub.challenge=TEST123'
     })
\ No newline at end of file
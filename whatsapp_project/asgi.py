@@ -0,0 +1,17 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'whatsapp_project.settings')
+
+# El webhook es una vista async: mientras Gemini o Meta responden, el proceso
+# sigue atendiendo otros mensajes. El ORM corre en el pool acotado de
+# chatbot/services/message_pipeline.py, cuyos hilos abren sus propias conexiones.
+application = get_asgi_application()
+
+# Cada hilo del pool del ORM abre su conexión a la BD antes de recibir el primer webhook
+from django.conf import settings  # noqa: E402
+
+if settings.DB_WARMUP_ON_START:
+    from chatbot.services.message_pipeline import calentar_pool
+    calentar_pool()
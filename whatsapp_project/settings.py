@@ -2,6 +2,7 @@
 Django settings for whatsapp_project project.
 """
 
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -55,7 +56,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'chatbot.middleware.WhiteNoiseAsyncMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,19 +89,49 @@ WSGI_APPLICATION = 'whatsapp_project.wsgi.application'
 # --- Database Configuration ---
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # MySQL con métricas de conexión (ver chatbot/db_backend/base.py)
+        'ENGINE': 'chatbot.db_backend',
         'NAME': os.getenv('DB_NAME', 'u659323332_ebano_company'),
         'USER': os.getenv('DB_USER', 'u659323332_ebano_company'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'Ebano123*'),
         'HOST': os.getenv('DB_HOST', '82.197.82.29'),
         'PORT': os.getenv('DB_PORT', '3306'),
+        # Conexión persistente por worker; debe ser menor que wait_timeout del servidor
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '300')),
+        # Ping al reutilizar la conexión; si el servidor la cerró se reabre
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() in ('true', '1', 't'),
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
             'charset': 'utf8mb4',
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10')),
         },
     }
 }
 
+# Abrir las conexiones a la BD al arrancar cada worker (ver wsgi.py y asgi.py)
+DB_WARMUP_ON_START = os.getenv('DB_WARMUP_ON_START', 'True').lower() in ('true', '1', 't')
+
+# --- Read Replica Configuration ---
+# Copia local del catálogo para lecturas (SQLite o MySQL), refrescada con
+# `python manage.py sincronizar_replica`. Sin DB_REPLICA_NAME todo va a 'default'.
+DB_REPLICA_NAME = os.getenv('DB_REPLICA_NAME', '')
+if DB_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': os.getenv('DB_REPLICA_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': DB_REPLICA_NAME,
+        'USER': os.getenv('DB_REPLICA_USER', ''),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', ''),
+        'HOST': os.getenv('DB_REPLICA_HOST', ''),
+        'PORT': os.getenv('DB_REPLICA_PORT', ''),
+    }
+
+CATALOG_REPLICA_ALIAS = 'replica' if DB_REPLICA_NAME else None
+# Tras escribir en el catálogo, segundos que este proceso sigue leyendo del
+# primario (debería cubrir el intervalo de sincronización)
+CATALOG_REPLICA_STALE_SECONDS = int(os.getenv('CATALOG_REPLICA_STALE_SECONDS', '300'))
+
+DATABASE_ROUTERS = ['chatbot.db_router.CatalogReadRouter']
+
 
 # --- Password validation ---
 AUTH_PASSWORD_VALIDATORS = [
@@ -139,11 +170,137 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 META_PHONE_NUMBER_ID = os.getenv('META_PHONE_NUMBER_ID', '')
 META_ACCESS_TOKEN = os.getenv('META_ACCESS_TOKEN', '')
 META_VERIFY_TOKEN = os.getenv('META_VERIFY_TOKEN', 'my_secure_verify_token')
+# Clave secreta de la app: si se define, el webhook exige la firma X-Hub-Signature-256
 META_WEBHOOK_SECRET = os.getenv('META_WEBHOOK_SECRET', '')
+# Para pruebas de carga sin red: python manage.py simular_graph (ver chatbot/services/graph_simulator.py)
+META_GRAPH_BASE_URL = os.getenv('META_GRAPH_BASE_URL', 'https://graph.facebook.com/v22.0')
+# Largo máximo del cuerpo de un mensaje de texto; las respuestas más largas se dividen
+WHATSAPP_TEXT_MAX_CHARS = int(os.getenv('WHATSAPP_TEXT_MAX_CHARS', '4096'))
+
+# --- Graph API HTTP Configuration ---
+# Pool keep-alive por proceso (ver chatbot/services/graph_transport.py)
+GRAPH_HTTP_POOL_CONNECTIONS = int(os.getenv('GRAPH_HTTP_POOL_CONNECTIONS', '4'))
+GRAPH_HTTP_POOL_MAXSIZE = int(os.getenv('GRAPH_HTTP_POOL_MAXSIZE', '10'))
+GRAPH_HTTP_CONNECT_TIMEOUT = float(os.getenv('GRAPH_HTTP_CONNECT_TIMEOUT', '3.05'))
+GRAPH_HTTP_READ_TIMEOUT = float(os.getenv('GRAPH_HTTP_READ_TIMEOUT', '10'))
+GRAPH_HTTP_DOWNLOAD_TIMEOUT = float(os.getenv('GRAPH_HTTP_DOWNLOAD_TIMEOUT', '30'))
+# Reintentos de conexión (todos los métodos) y de lectura/5xx (solo GET)
+GRAPH_HTTP_RETRIES = int(os.getenv('GRAPH_HTTP_RETRIES', '2'))
+GRAPH_HTTP_BACKOFF = float(os.getenv('GRAPH_HTTP_BACKOFF', '0.3'))
+# Conexiones simultáneas del cliente async (httpx) por proceso
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', '100'))
+
+# --- Outbound Dispatch Configuration ---
+# Envío desde colas en hilos de fondo; False envía en el hilo que encola
+OUTBOUND_DISPATCH_ASYNC = os.getenv('OUTBOUND_DISPATCH_ASYNC', 'True').lower() in ('true', '1', 't')
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', '4'))
+# Ritmo por proceso (el límite del número se reparte entre los workers)
+OUTBOUND_RATE_PER_SECOND = float(os.getenv('OUTBOUND_RATE_PER_SECOND', '20'))
+OUTBOUND_BURST = int(os.getenv('OUTBOUND_BURST', '20'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '5'))
+OUTBOUND_BACKOFF_BASE = float(os.getenv('OUTBOUND_BACKOFF_BASE', '1'))
+OUTBOUND_BACKOFF_MAX = float(os.getenv('OUTBOUND_BACKOFF_MAX', '60'))
+# Antigüedad a partir de la cual recuperar_salientes da por perdido un envío pendiente
+OUTBOUND_RECOVERY_AGE_SECONDS = int(os.getenv('OUTBOUND_RECOVERY_AGE_SECONDS', '300'))
+
+# --- Message Pipeline Configuration ---
+# Hilos para el ORM del webhook async (ver chatbot/services/message_pipeline.py);
+# acotan también las conexiones a la BD que abre cada proceso
+MESSAGE_PIPELINE_WORKERS = int(os.getenv('MESSAGE_PIPELINE_WORKERS', '8'))
+# Confirmar la lectura de cada mensaje entrante (con indicador de escritura en los de texto)
+MESSAGE_READ_RECEIPTS = os.getenv('MESSAGE_READ_RECEIPTS', 'True').lower() in ('true', '1', 't')
+
+# --- Media Store Configuration ---
+# Almacén local de medios direccionado por SHA-256 (ver chatbot/services/media_store.py)
+MEDIA_STORE_DIR = os.getenv('MEDIA_STORE_DIR', str(BASE_DIR / '.cache' / 'media'))
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(32 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', str(64 * 1024)))
+# La recolección borra archivos sin referencias más viejos que esto o si el almacén se pasa de tamaño
+MEDIA_STORE_MAX_BYTES = int(os.getenv('MEDIA_STORE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+MEDIA_STORE_MAX_AGE_DAYS = int(os.getenv('MEDIA_STORE_MAX_AGE_DAYS', '30'))
+# Nunca se borra un archivo usado hace menos de esto: puede estar guardado y aún sin vincular
+MEDIA_STORE_MIN_AGE_MINUTES = int(os.getenv('MEDIA_STORE_MIN_AGE_MINUTES', '60'))
+# Las URLs de media de Meta vencen a los 5 minutos
+MEDIA_URL_CACHE_SECONDS = int(os.getenv('MEDIA_URL_CACHE_SECONDS', '240'))
+# Guardar en el almacén los medios que envían los usuarios
+MEDIA_STORE_INCOMING = os.getenv('MEDIA_STORE_INCOMING', 'False').lower() in ('true', '1', 't')
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', '2'))
+# IDs de las imágenes propias subidas a WhatsApp (ver chatbot/services/media_uploads.py);
+# Meta los conserva 30 días
+MEDIA_UPLOAD_TTL_DAYS = int(os.getenv('MEDIA_UPLOAD_TTL_DAYS', '29'))
+MEDIA_UPLOAD_REVALIDATE_SECONDS = int(os.getenv('MEDIA_UPLOAD_REVALIDATE_SECONDS', '3600'))
+MEDIA_UPLOAD_MAX_BYTES = int(os.getenv('MEDIA_UPLOAD_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# --- Broadcast Configuration ---
+# `manage.py broadcast` corre en su propio proceso, con su propio ritmo
+BROADCAST_RATE_PER_SECOND = float(os.getenv('BROADCAST_RATE_PER_SECOND', '50'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '16'))
 
 # --- Gemini Configuration ---
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 
+# --- Prompt Context Configuration ---
+# Registrar los tokens del contexto de negocios frente al formato anterior (diagnóstico)
+CONTEXT_TOKEN_REPORT = os.getenv('CONTEXT_TOKEN_REPORT', 'False').lower() in ('true', '1', 't')
+
+# --- Business Profile Configuration ---
+# Perfiles compactos generados con `manage.py build_profiles`
+PROFILE_MODEL = os.getenv('PROFILE_MODEL', 'gemini-2.5-flash')
+PROFILE_MAX_CHARS = int(os.getenv('PROFILE_MAX_CHARS', '280'))
+PROFILE_BUILD_CONCURRENCY = int(os.getenv('PROFILE_BUILD_CONCURRENCY', '4'))
+
+# --- Fuzzy Search Configuration ---
+# Similitud mínima (Jaccard de trigramas) para aceptar una coincidencia aproximada
+FUZZY_MATCH_THRESHOLD = float(os.getenv('FUZZY_MATCH_THRESHOLD', '0.4'))
+
+# --- Geo Search Configuration ---
+# Tamaño de celda de la grilla espacial (0.01° ≈ 1.1 km en Quibdó)
+GEO_GRID_CELL_DEGREES = float(os.getenv('GEO_GRID_CELL_DEGREES', '0.01'))
+# Cantidad de negocios con los que se responde a un mensaje de ubicación
+GEO_NEAREST_RESULTS = int(os.getenv('GEO_NEAREST_RESULTS', '5'))
+# Distancia máxima (km) de los negocios sugeridos a partir de una ubicación
+GEO_MAX_RADIUS_KM = float(os.getenv('GEO_MAX_RADIUS_KM', '50'))
+# Antigüedad máxima de la última ubicación del usuario para usarla en el ranking
+GEO_LOCATION_MAX_AGE_MINUTES = int(os.getenv('GEO_LOCATION_MAX_AGE_MINUTES', '360'))
+
+# --- Ranking Configuration ---
+# Pesos de cada señal del ranking de negocios (se pueden sobrescribir con un JSON)
+RANKING_WEIGHTS = {
+    'relevancia': 3.0,
+    'abierto': 2.0,
+    'calificacion': 1.5,
+    'resenas': 0.5,
+    'verificado': 1.0,
+    'distancia': 1.5,
+    'productos': 0.5,
+}
+RANKING_WEIGHTS.update(json.loads(os.getenv('RANKING_WEIGHTS', '{}')))
+# Distancia (km) a la que la señal de cercanía vale la mitad
+RANKING_DISTANCE_SCALE_KM = float(os.getenv('RANKING_DISTANCE_SCALE_KM', '1.0'))
+# Cantidad de candidatos que se traen de la BD antes de rankear
+RANKING_CANDIDATES = int(os.getenv('RANKING_CANDIDATES', '200'))
+
+# --- Query Cache Configuration ---
+# 'compartida' es el segundo nivel de la caché de consultas, común a todos los
+# workers de la máquina (ver chatbot/services/query_cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('QUERY_CACHE_DIR', str(BASE_DIR / '.cache' / 'consultas')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('QUERY_CACHE_MAX_ENTRIES', '5000'))},
+    },
+}
+QUERY_CACHE_ALIAS = 'compartida'
+# Entradas del LRU en memoria de cada proceso
+QUERY_CACHE_LOCAL_SIZE = int(os.getenv('QUERY_CACHE_LOCAL_SIZE', '512'))
+# Segundos de vida de una consulta cacheada
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', '600'))
+# Cada cuántos segundos se releen las versiones de etiquetas del nivel compartido
+QUERY_CACHE_TAG_CHECK_SECONDS = float(os.getenv('QUERY_CACHE_TAG_CHECK_SECONDS', '1.0'))
+
 # --- Logging Configuration ---
 LOGGING = {
     'version': 1,
@@ -163,6 +320,10 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        # httpx registra cada petición en INFO; las métricas ya están en /chatbot/status/
+        'httpx': {
+            'level': 'WARNING',
+        },
     },
 }
 
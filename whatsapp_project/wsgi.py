@@ -4,4 +4,11 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'whatsapp_project.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Cada worker abre su conexión a la BD antes de recibir el primer webhook
+from django.conf import settings  # noqa: E402
+
+if settings.DB_WARMUP_ON_START:
+    from chatbot.db_backend.base import calentar_conexiones
+    calentar_conexiones()